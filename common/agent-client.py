@@ -2,12 +2,33 @@
 
 import base64
 import binascii
+import fnmatch
+import getopt
 import os
 import subprocess
 import sys
 import time
+import zlib
 import simplejson as json
 
+try:
+    import xsclient
+except ImportError:
+    xsclient = None
+
+
+# Diffie-Hellman prime used for the password key exchange
+PRIME = 162259276829213363391578010288127
+
+# How long to wait for a background job to finish, and how often to poll
+JOB_TIMEOUT = 1800
+JOB_POLL_INTERVAL = 2
+
+# Defaults for --batch: domains to run at once, and seconds to wait for
+# each one
+BATCH_CONCURRENCY = 50
+BATCH_TIMEOUT = 120
+
 
 class AgentCommError(Exception):
     pass
@@ -40,12 +61,22 @@ class AgentComm(object):
     """Agent Communication Class"""
 
     def __init__(self, domid):
+        self.domid = domid
         prefix = "/local/domain/%d" % domid
         self.xs_request_path = "%s/data/host" % prefix
         self.xs_response_path = "%s/data/guest" % prefix
         self.xs_networking_path = "%s/vm-data/networking" % prefix
         self.xs_hostname_path = "%s/vm-data/hostname" % prefix
 
+        # Talk to xenstored directly if we can, otherwise fall back to
+        # running the xenstore-* tools
+        self.client = None
+        if xsclient:
+            try:
+                self.client = xsclient.AgentClient()
+            except xsclient.XenStoreError, e:
+                print "Using xenstore tools: %s" % e
+
     def _mod_exp(self, num, exp, mod):
         result = 1
         while exp > 0:
@@ -62,10 +93,39 @@ class AgentComm(object):
         return '-'.join([binascii.hexlify(os.urandom(x))
                          for x in (4, 2, 2, 2, 6)])
 
-    def _do_request(self, command, value):
+    def _do_request(self, command, value, background=False):
+        if self.client:
+            print "Sending '%s' request to domain %d" % (command,
+                    self.domid)
+            try:
+                if background:
+                    # Newer agents will run the command as a background
+                    # job and respond right away with a job ID.  Older
+                    # agents ignore this.
+                    resp = self.client.request(self.domid, command, value,
+                            async=True)
+                else:
+                    resp = self.client.request(self.domid, command, value)
+            except xsclient.XenStoreError, e:
+                raise SystemError(str(e))
+        else:
+            resp = self._do_request_tools(command, value, background)
+
+        if background and resp[0] == '202':
+            return self._wait_for_job(resp[1])
+
+        return resp
+
+    def _do_request_tools(self, command, value, background):
         uuid = self._get_uuid()
 
-        req = json.dumps({"name": command, "value": value})
+        # Newer agents compress and/or split up large responses.  Older
+        # agents ignore this and always send the message as is.
+        req = {"name": command, "value": value,
+               "accept_encoding": "zlib,chunked"}
+        if background:
+            req["async"] = True
+        req = json.dumps(req)
 
         req_path = "%s/%s" % (self.xs_request_path, uuid)
         resp_path = "%s/%s" % (self.xs_response_path, uuid)
@@ -88,12 +148,39 @@ class AgentComm(object):
         if not resp:
             raise SystemError("No response received")
 
+        resp = json.loads(resp.rstrip())
+
+        if 'chunks' in resp:
+            chunks = []
+            for i in xrange(resp['chunks']):
+                chunk_path = "%s/%d" % (resp_path, i)
+                p = subprocess.Popen(["xenstore-read", chunk_path],
+                        stderr=subprocess.PIPE, stdout=subprocess.PIPE).stdout
+                chunks.append(p.read().rstrip('\n'))
+                p.close()
+            resp['message'] = ''.join(chunks)
+
         subprocess.call(["xenstore-rm", resp_path])
 
-        resp = json.loads(resp.rstrip())
+        if resp.get('encoding') == 'zlib':
+            resp['message'] = zlib.decompress(
+                    base64.b64decode(resp['message']))
 
         return (resp['returncode'], resp['message'])
 
+    def _wait_for_job(self, job_id):
+        print "Waiting for job %s" % job_id
+
+        end = time.time() + JOB_TIMEOUT
+        while time.time() < end:
+            time.sleep(JOB_POLL_INTERVAL)
+            retcode, message = self._do_request("jobstatus", job_id)
+            if retcode != '202':
+                return (retcode, message)
+            print "Job %s: %s" % (job_id, message)
+
+        raise SystemError("Job %s did not finish" % job_id)
+
     def run_command(self, command, *args):
 
         cmd_func = Commands.COMMANDS.get(command, None)
@@ -104,31 +191,17 @@ class AgentComm(object):
             print "Got result: %s" % repr(result)
         return True
 
-    @Commands.command_opt("password")
-    def _password_cmd(self, args):
-        if len(args) < 1:
-            print "Usage: password <password>"
-            return None
-
-        password = args[0]
-        # prime to use
-        prime = 162259276829213363391578010288127
+    def _make_keypair(self):
         my_private_key = int(binascii.hexlify(os.urandom(10)), 16)
-        my_public_key = self._mod_exp(5, my_private_key, prime)
-
-        # Older Windows agent requires public key to be a string, not an
-        # integer
-        retcode, message = self._do_request("keyinit", str(my_public_key))
-
-        if retcode != 'D0':
-            raise SystemError(
-                    "Invalid response to keyinit: %s" % retcode)
+        return (my_private_key, self._mod_exp(5, my_private_key, PRIME))
 
+    def _compute_shared_key(self, my_private_key, keyinit_message):
         # Older Windows agent will sometimes add \\r\\n (escaped CRLF) to
         # the end of responses.
-        shared_key = str(self._mod_exp(int(message.strip('\\r\\n')),
-                my_private_key, prime))
+        return str(self._mod_exp(int(keyinit_message.strip('\\r\\n')),
+                my_private_key, PRIME))
 
+    def _encrypt_password(self, shared_key, password):
         cmd = ["openssl", "enc", "-aes-128-cbc", "-a",
                 "-nosalt", "-pass", "pass:%s" % shared_key]
 
@@ -143,7 +216,33 @@ class AgentComm(object):
         del p
 
         if err != '':
-            print err
+            raise SystemError("Couldn't encrypt password: %s" % err)
+
+        return b64_pass
+
+    @Commands.command_opt("password")
+    def _password_cmd(self, args):
+        if len(args) < 1:
+            print "Usage: password <password>"
+            return None
+
+        password = args[0]
+        my_private_key, my_public_key = self._make_keypair()
+
+        # Older Windows agent requires public key to be a string, not an
+        # integer
+        retcode, message = self._do_request("keyinit", str(my_public_key))
+
+        if retcode != 'D0':
+            raise SystemError(
+                    "Invalid response to keyinit: %s" % retcode)
+
+        shared_key = self._compute_shared_key(my_private_key, message)
+
+        try:
+            b64_pass = self._encrypt_password(shared_key, password)
+        except SystemError, e:
+            print e
             return(500, "Doh")
 
         return self._do_request("password", b64_pass)
@@ -165,11 +264,12 @@ class AgentComm(object):
         if len(args) < 2:
             raise AgentCommArgError("Usage: agentupdate <url> <md5sum>")
 
-        return self._do_request("agentupdate", args[0] + "," + args[1])
+        return self._do_request("agentupdate", args[0] + "," + args[1],
+                background=True)
 
     @Commands.command_opt("resetnetwork")
     def _reset_network(self, args):
-        return self._do_request("resetnetwork", "")
+        return self._do_request("resetnetwork", "", background=True)
 
     @Commands.command_opt("injectfile")
     def _inject_file(self, args):
@@ -198,7 +298,7 @@ class AgentComm(object):
         return self._do_request("kmsactivate",
             {'activation_key': args[0],
              'profile': args[1],
-             'domains': [args[2]]})
+             'domains': [args[2]]}, background=True)
 
     @Commands.command_opt("help")
     def _help_cmd(self, args):
@@ -206,12 +306,233 @@ class AgentComm(object):
         for cmd_name in Commands.COMMANDS:
             print cmd_name
 
+class BatchRequest(AgentComm):
+    """
+    Collects the (command, value) that an AgentComm command would send,
+    instead of sending it
+    """
+
+    def __init__(self):
+        pass
+
+    def _do_request(self, command, value, background=False):
+        return (command, value)
+
+
+def parse_domains(spec, client):
+    """
+    Parse a list of domains like '5,7,10-20'.  Parts with glob characters
+    are matched against domain IDs and names.  Returns a sorted list of
+    domain IDs.
+    """
+
+    domids = set()
+    names = None
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        if [c for c in '*?[' if c in part]:
+            if names is None:
+                names = client.domain_names()
+            for domid, name in names.items():
+                if fnmatch.fnmatch(str(domid), part) or \
+                        fnmatch.fnmatch(name, part):
+                    domids.add(domid)
+        elif '-' in part:
+            start, end = part.split('-', 1)
+            domids.update(range(int(start), int(end) + 1))
+        else:
+            domids.add(int(part))
+
+    # Never dom0
+    domids.discard(0)
+    domids = list(domids)
+    domids.sort()
+    return domids
+
+
+class Batch(object):
+    """
+    Runs a command across many domains at once.  Each domain's result is
+    printed as a line of JSON as soon as it's known, followed by a
+    summary line at the end.
+    """
+
+    def __init__(self, client, concurrency=BATCH_CONCURRENCY,
+            timeout=BATCH_TIMEOUT):
+        self.client = client
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+        self.start = time.time()
+        self.latencies = []
+        self.succeeded = 0
+        self.failed = 0
+        self.timed_out = 0
+
+    def report(self, domid, result, seconds, error=None):
+        line = {"domid": domid, "seconds": round(seconds, 3)}
+        if result is None:
+            line["error"] = error or "timeout"
+        else:
+            line["returncode"], line["message"] = result
+
+        if error:
+            self.failed += 1
+        elif result is None:
+            self.timed_out += 1
+        elif result[0] == '0':
+            self.succeeded += 1
+        else:
+            self.failed += 1
+        self.latencies.append(seconds)
+
+        print json.dumps(line)
+        sys.stdout.flush()
+
+    def _finished(self, pending):
+        self.report(pending['domid'], pending['result'],
+                time.time() - pending['started'])
+
+    def run(self, domids, command, value):
+        self.client.run([(domid, command, value) for domid in domids],
+                self.timeout, self._finished, self.concurrency)
+
+    def run_password(self, domids, password):
+        """
+        Do all the key exchanges first, then send out the passwords for
+        the domains where it worked
+        """
+
+        helper = BatchRequest()
+        keys = {}
+        started = {}
+        passwords = []
+
+        def keyinit_finished(pending):
+            domid = pending['domid']
+            result = pending['result']
+            if result is None or result[0] != 'D0':
+                self.report(domid, result, time.time() - started[domid])
+                return
+
+            shared_key = helper._compute_shared_key(keys[domid], result[1])
+            try:
+                b64_pass = helper._encrypt_password(shared_key, password)
+            except SystemError, e:
+                self.report(domid, None, time.time() - started[domid],
+                        str(e))
+                return
+            passwords.append((domid, "password", b64_pass))
+
+        def password_finished(pending):
+            domid = pending['domid']
+            self.report(domid, pending['result'],
+                    time.time() - started[domid])
+
+        keyinits = []
+        for domid in domids:
+            keys[domid], public_key = helper._make_keypair()
+            started[domid] = time.time()
+            keyinits.append((domid, "keyinit", str(public_key)))
+
+        self.client.run(keyinits, self.timeout, keyinit_finished,
+                self.concurrency)
+        self.client.run(passwords, self.timeout, password_finished,
+                self.concurrency)
+
+    def summary(self):
+        latencies = self.latencies[:]
+        latencies.sort()
+
+        summary = {"domains": len(latencies),
+                   "succeeded": self.succeeded,
+                   "failed": self.failed,
+                   "timed_out": self.timed_out,
+                   "seconds": round(time.time() - self.start, 3)}
+        if latencies:
+            for name, pct in (("p50", 50), ("p90", 90), ("p99", 99)):
+                index = min(len(latencies) - 1, len(latencies) * pct / 100)
+                summary["latency_%s" % name] = round(latencies[index], 3)
+            summary["latency_max"] = round(latencies[-1], 3)
+
+        print json.dumps({"summary": summary})
+        sys.stdout.flush()
+
+
+def batch_main(prog, args):
+    usage = "Usage: %s --batch [-j <concurrency>] [-t <timeout>] " \
+            "<domains> <command> [<args>]" % prog
+
+    try:
+        opts, args = getopt.getopt(args, "j:t:")
+        opts = dict(opts)
+        concurrency = int(opts.get("-j", BATCH_CONCURRENCY))
+        timeout = float(opts.get("-t", BATCH_TIMEOUT))
+    except (getopt.GetoptError, ValueError), e:
+        print e
+        print usage
+        return 1
+
+    if len(args) < 2:
+        print usage
+        return 1
+
+    spec = args.pop(0)
+    cmd = args.pop(0)
+
+    if not xsclient:
+        print "Error: --batch needs the xsclient module"
+        return 1
+    try:
+        client = xsclient.AgentClient()
+    except xsclient.XenStoreError, e:
+        print "Error: %s" % e
+        return 1
+
+    try:
+        domids = parse_domains(spec, client)
+    except ValueError:
+        print "Error: Invalid domain list '%s'" % spec
+        return 1
+
+    batch = Batch(client, concurrency, timeout)
+
+    if cmd == "password":
+        if len(args) < 1:
+            print "Usage: password <password>"
+            return 1
+        batch.run_password(domids, args[0])
+    else:
+        cmd_func = Commands.COMMANDS.get(cmd, None)
+        if not cmd_func or cmd == "help":
+            print "Error: Unknown command '%s'" % cmd
+            return 1
+        try:
+            command, value = cmd_func(BatchRequest(), args)
+        except AgentCommArgError, e:
+            print e
+            return 1
+        batch.run(domids, command, value)
+
+    batch.summary()
+
+    if batch.succeeded != len(domids):
+        return 1
+    return 0
+
 if __name__ == "__main__":
     args = sys.argv
     prog = args.pop(0)
 
+    if args and args[0] == "--batch":
+        sys.exit(batch_main(prog, args[1:]))
+
     if len(args) < 2:
         print "Usage: %s <domid> <command> [<args>]" % prog
+        print "       %s --batch [-j <concurrency>] [-t <timeout>] " \
+                "<domains> <command> [<args>]" % prog
         AgentComm(0).run_command("help", "")
         sys.exit(1)
 
@@ -0,0 +1,366 @@
+#!/usr/bin/python
+"""
+Host side client for talking to guest agents through xenstored.
+
+Talks the xenstored wire protocol over a single persistent connection
+instead of running the xenstore-* tools, and waits for responses with
+watches instead of polling.  Commands for many domains can be in flight
+at the same time, each with its own timeout:
+
+    client = xsclient.AgentClient()
+    results = client.run([(domid, "version", "agent") for domid in domids],
+                         timeout=30)
+
+This needs to run on dom0's python, so it sticks to python 2.4 syntax.
+"""
+
+import base64
+import binascii
+import errno
+import os
+import select
+import socket
+import struct
+import time
+import zlib
+
+try:
+    import json
+except ImportError:
+    import simplejson as json
+
+
+XENSTORED_SOCKETS = ["/var/run/xenstored/socket", "/run/xenstored/socket"]
+
+# Message types, from xen/include/public/io/xs_wire.h
+XS_DIRECTORY = 1
+XS_READ = 2
+XS_WATCH = 4
+XS_UNWATCH = 5
+XS_WRITE = 11
+XS_RM = 13
+XS_WATCH_EVENT = 15
+XS_ERROR = 16
+
+# type, request id, transaction id, payload length
+HEADER = "=IIII"
+HEADER_SIZE = struct.calcsize(HEADER)
+
+DEFAULT_TIMEOUT = 30
+
+
+class XenStoreError(Exception):
+
+    def __init__(self, msg, err=None):
+        Exception.__init__(self, msg)
+        self.errno = err
+
+
+class Connection(object):
+    """
+    A connection to xenstored.  Requests are answered in order, but
+    watch events can arrive in between and are queued for
+    wait_events().
+    """
+
+    def __init__(self, path=None):
+        if path:
+            paths = [path]
+        else:
+            paths = XENSTORED_SOCKETS
+
+        self.sock = None
+        for path in paths:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.connect(path)
+            except socket.error, e:
+                sock.close()
+                last_error = e
+                continue
+            self.sock = sock
+            break
+
+        if not self.sock:
+            raise XenStoreError("Couldn't connect to xenstored: %s" %
+                    last_error, getattr(last_error, 'errno', None))
+
+        self.req_id = 0
+        self.events = []
+        self._buf = ''
+
+    def close(self):
+        if self.sock:
+            self.sock.close()
+            self.sock = None
+
+    def _recv(self, length):
+        while len(self._buf) < length:
+            data = self.sock.recv(65536)
+            if not data:
+                raise XenStoreError("Connection to xenstored closed")
+            self._buf += data
+        data = self._buf[:length]
+        self._buf = self._buf[length:]
+        return data
+
+    def _recv_msg(self):
+        msg_type, req_id, tx_id, length = struct.unpack(HEADER,
+                self._recv(HEADER_SIZE))
+        return msg_type, req_id, self._recv(length)
+
+    def _queue_event(self, payload):
+        path, token = payload.split('\0')[:2]
+        self.events.append((path, token))
+
+    def request(self, msg_type, *args):
+        """
+        Send a request and wait for its reply.  Arguments are sent NUL
+        terminated, except for the value of a write.
+        """
+
+        payload = '\0'.join(args)
+        if msg_type != XS_WRITE:
+            payload += '\0'
+
+        self.req_id += 1
+        self.sock.sendall(struct.pack(HEADER, msg_type, self.req_id, 0,
+                len(payload)) + payload)
+
+        while True:
+            reply_type, req_id, reply = self._recv_msg()
+            if reply_type == XS_WATCH_EVENT:
+                self._queue_event(reply)
+                continue
+            if req_id != self.req_id:
+                continue
+            if reply_type == XS_ERROR:
+                name = reply.rstrip('\0')
+                raise XenStoreError("%s: %s" % (name, args[0]),
+                        getattr(errno, name, None))
+            return reply
+
+    def read(self, path):
+        return self.request(XS_READ, path)
+
+    def write(self, path, value):
+        self.request(XS_WRITE, path, value)
+
+    def rm(self, path):
+        try:
+            self.request(XS_RM, path)
+        except XenStoreError, e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def directory(self, path):
+        return [x for x in self.request(XS_DIRECTORY, path).split('\0')
+                if x]
+
+    def watch(self, path, token):
+        self.request(XS_WATCH, path, token)
+
+    def unwatch(self, path, token):
+        self.request(XS_UNWATCH, path, token)
+
+    def wait_events(self, timeout):
+        """
+        Return queued watch events as (path, token), waiting up to
+        'timeout' seconds for one if there are none
+        """
+
+        if not self.events:
+            if self._buf or select.select([self.sock], [], [],
+                    max(timeout, 0))[0]:
+                msg_type, req_id, payload = self._recv_msg()
+                if msg_type == XS_WATCH_EVENT:
+                    self._queue_event(payload)
+
+        events = self.events
+        self.events = []
+        return events
+
+
+def make_uuid():
+    # Older Windows agents require something that actually looks like a
+    # UUID. dom0 has an old python that doesn't have the uuid module, so
+    # create it ourselves by hand
+    return '-'.join([binascii.hexlify(os.urandom(x))
+                     for x in (4, 2, 2, 2, 6)])
+
+
+class AgentClient(object):
+    """
+    Runs agent commands in any number of domains at once
+    """
+
+    def __init__(self, conn=None):
+        if conn is None:
+            conn = Connection()
+        self.conn = conn
+
+    def domain_names(self):
+        """Return a dictionary of domid to name for all domains"""
+
+        names = {}
+        for entry in self.conn.directory("/local/domain"):
+            try:
+                names[int(entry)] = self.conn.read(
+                        "/local/domain/%s/name" % entry)
+            except (ValueError, XenStoreError):
+                continue
+        return names
+
+    def _read_response(self, resp_path):
+        """
+        Read and decode a response, returning None if it isn't there
+        """
+
+        try:
+            data = self.conn.read(resp_path).rstrip()
+        except XenStoreError, e:
+            # Watches fire once when they're set up, before there's a
+            # response
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+        if not data:
+            return None
+
+        resp = json.loads(data)
+
+        # Large responses can be split up under the response path
+        if 'chunks' in resp:
+            resp['message'] = ''.join([
+                    self.conn.read("%s/%d" % (resp_path, i))
+                    for i in xrange(resp['chunks'])])
+        if resp.get('encoding') == 'zlib':
+            resp['message'] = zlib.decompress(
+                    base64.b64decode(resp['message']))
+
+        return (resp['returncode'], resp['message'])
+
+    def start(self, domid, command, value, **kwargs):
+        """
+        Write out a request and watch for its response.  Returns the
+        request, to be passed to wait().
+        """
+
+        uuid = make_uuid()
+        prefix = "/local/domain/%d" % domid
+
+        req = {"name": command, "value": value,
+               "accept_encoding": "zlib,chunked"}
+        req.update(kwargs)
+
+        pending = {'domid': domid,
+                   'command': command,
+                   'started': time.time(),
+                   'token': uuid,
+                   'req_path': "%s/data/host/%s" % (prefix, uuid),
+                   'resp_path': "%s/data/guest/%s" % (prefix, uuid)}
+
+        self.conn.watch(pending['resp_path'], uuid)
+        self.conn.write(pending['req_path'], json.dumps(req))
+        return pending
+
+    def _finish(self, pending, result):
+        self.conn.unwatch(pending['resp_path'], pending['token'])
+        self.conn.rm(pending['resp_path'])
+        pending['result'] = result
+        return pending
+
+    def _wait_any(self, by_token):
+        """
+        Wait until at least one request in 'by_token' finishes or times
+        out.  Finished requests are removed and returned.
+        """
+
+        finished = []
+        while by_token and not finished:
+            now = time.time()
+            for token, pending in by_token.items():
+                if pending['deadline'] > now:
+                    continue
+                # Don't leave the request around for the agent
+                del by_token[token]
+                self.conn.rm(pending['req_path'])
+                finished.append(self._finish(pending, None))
+
+            if not by_token:
+                break
+
+            next_deadline = min([p['deadline'] for p in by_token.values()])
+            for path, token in self.conn.wait_events(next_deadline - now):
+                pending = by_token.get(token)
+                if not pending or path != pending['resp_path']:
+                    continue
+                result = self._read_response(path)
+                if result is None:
+                    continue
+                del by_token[token]
+                finished.append(self._finish(pending, result))
+
+        return finished
+
+    def wait(self, requests, timeout=DEFAULT_TIMEOUT, callback=None):
+        """
+        Wait for responses to started requests.  Each request gets a
+        'result' of (returncode, message), or None if the domain didn't
+        respond within 'timeout' seconds.  'callback' is called with each
+        request as it finishes.
+        """
+
+        by_token = {}
+        deadline = time.time() + timeout
+        for pending in requests:
+            pending.setdefault('deadline', deadline)
+            by_token[pending['token']] = pending
+
+        finished = []
+        while by_token:
+            for pending in self._wait_any(by_token):
+                finished.append(pending)
+                if callback:
+                    callback(pending)
+
+        return finished
+
+    def request(self, domid, command, value, timeout=DEFAULT_TIMEOUT,
+            **kwargs):
+        """Run one command, returning (returncode, message)"""
+
+        pending = self.start(domid, command, value, **kwargs)
+        result = self.wait([pending], timeout)[0]['result']
+        if result is None:
+            raise XenStoreError("No response received from domain %d" %
+                    domid, errno.ETIMEDOUT)
+        return result
+
+    def run(self, commands, timeout=DEFAULT_TIMEOUT, callback=None,
+            concurrency=None):
+        """
+        Run (domid, command, value) tuples concurrently, with at most
+        'concurrency' in flight at once.  Each one has 'timeout' seconds
+        from when it's sent.  Returns the finished requests, see wait().
+        """
+
+        commands = list(commands)
+        commands.reverse()
+
+        by_token = {}
+        finished = []
+        while commands or by_token:
+            while commands and (not concurrency or
+                    len(by_token) < concurrency):
+                domid, command, value = commands.pop()
+                pending = self.start(domid, command, value)
+                pending['deadline'] = pending['started'] + timeout
+                by_token[pending['token']] = pending
+
+            for pending in self._wait_any(by_token):
+                finished.append(pending)
+                if callback:
+                    callback(pending)
+
+        return finished
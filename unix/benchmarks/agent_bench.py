@@ -0,0 +1,195 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#  Copyright (c) 2011 Openstack, LLC.
+#  All Rights Reserved.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License"); you may
+#     not use this file except in compliance with the License. You may obtain
+#     a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#     WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#     License for the specific language governing permissions and limitations
+#     under the License.
+#
+
+"""
+Nova agent benchmark module
+
+Every benchmarks/bench_*.py module defines a run(options) function that
+returns a list of results.  A result is a dictionary with a 'name' key
+plus any number of numeric measurements.  Results can be saved as a
+baseline and later runs compared against it.
+"""
+
+import cPickle
+import os
+import resource
+import sys
+import time
+import traceback
+
+try:
+    import anyjson
+except ImportError:
+    try:
+        import simplejson as json
+    except ImportError:
+        import json
+
+    class anyjson(object):
+        """Fake anyjson module as a class"""
+
+        @staticmethod
+        def serialize(buf):
+            return json.dumps(buf)
+
+        @staticmethod
+        def deserialize(buf):
+            return json.loads(buf)
+
+
+def percentile(values, pct):
+    """Return the 'pct' percentile of an already sorted list"""
+
+    if not values:
+        return 0.0
+    index = int(round((len(values) - 1) * pct / 100.0))
+    return values[index]
+
+
+def latency_summary(latencies):
+    """Summarize a list of latencies (in seconds) in milliseconds"""
+
+    latencies = sorted(latencies)
+    return {'p50_ms': percentile(latencies, 50) * 1000.0,
+            'p90_ms': percentile(latencies, 90) * 1000.0,
+            'p99_ms': percentile(latencies, 99) * 1000.0,
+            'max_ms': percentile(latencies, 100) * 1000.0}
+
+
+def timed(func, *args, **kwargs):
+    """Call a function, returning (elapsed seconds, result)"""
+
+    start = time.time()
+    result = func(*args, **kwargs)
+    return time.time() - start, result
+
+
+def measure(func, min_time=0.2, min_iterations=3):
+    """
+    Call a function repeatedly for at least 'min_time' seconds and
+    'min_iterations' calls, returning per-call timings in milliseconds
+    and the growth of the peak RSS in KB while it ran.  Use
+    run_forked() to keep the peak RSS of earlier work out of the way.
+    """
+
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    times = []
+    total = 0.0
+    while len(times) < min_iterations or total < min_time:
+        elapsed, result = timed(func)
+        times.append(elapsed)
+        total += elapsed
+
+    after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return {'iterations': len(times),
+            'best_ms': min(times) * 1000.0,
+            'mean_ms': total / len(times) * 1000.0,
+            'peak_kb': after - before}
+
+
+def run_forked(func, *args):
+    """
+    Run a function returning a result dictionary in a child process, so
+    memory used by one benchmark doesn't affect the next one
+    """
+
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        try:
+            result = func(*args)
+        except Exception:
+            result = {'error': traceback.format_exc()}
+        data = cPickle.dumps(result)
+        while data:
+            data = data[os.write(wfd, data):]
+        os._exit(0)
+
+    os.close(wfd)
+    chunks = []
+    while True:
+        chunk = os.read(rfd, 65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    os.close(rfd)
+    os.waitpid(pid, 0)
+
+    result = cPickle.loads(''.join(chunks))
+    if 'error' in result:
+        raise RuntimeError(result['error'])
+    return result
+
+
+def save_baseline(filename, results):
+    baseline = {}
+    for result in results:
+        values = result.copy()
+        del values['name']
+        baseline[result['name']] = values
+
+    f = open(filename, 'w')
+    try:
+        f.write(anyjson.serialize(baseline))
+    finally:
+        f.close()
+
+
+def load_baseline(filename):
+    f = open(filename)
+    try:
+        return anyjson.deserialize(f.read())
+    finally:
+        f.close()
+
+
+def format_result(result, baseline=None):
+    keys = [k for k in result if k != 'name']
+    keys.sort()
+
+    if baseline:
+        baseline = baseline.get(result['name'], {})
+
+    fields = []
+    for key in keys:
+        value = result[key]
+        if isinstance(value, float):
+            field = '%s=%.3f' % (key, value)
+        else:
+            field = '%s=%s' % (key, value)
+
+        old_value = baseline and baseline.get(key)
+        if old_value:
+            field += '(%+.1f%%)' % ((value - old_value) * 100.0 / old_value)
+
+        fields.append(field)
+
+    return '%-40s %s' % (result['name'], ' '.join(fields))
+
+
+def report(results, baseline=None, outfile=sys.stdout):
+    for result in results:
+        print >> outfile, format_result(result, baseline)
+
+
+if __name__ != "__main__":
+    if not len(sys.path) or sys.path[0] != "..":
+        sys.path.insert(0, "..")
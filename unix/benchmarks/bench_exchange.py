@@ -0,0 +1,147 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#  Copyright (c) 2011 Openstack, LLC.
+#  All Rights Reserved.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License"); you may
+#     not use this file except in compliance with the License. You may obtain
+#     a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#     WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#     License for the specific language governing permissions and limitations
+#     under the License.
+#
+
+"""
+End-to-end request path benchmark: XSComm + JsonParser + commands
+running against the in-memory XenStore
+"""
+
+import binascii
+import os
+import random
+import tempfile
+import time
+
+import agent_bench
+from tests import fake_xenstore
+
+# Make sure plugins.xscomm can be imported without Xen
+fake_xenstore.install()
+
+import commands.command_list
+import plugins
+import plugins.xscomm
+
+# Relative weights of the requests we push through
+REQUEST_MIX = [
+    (40, '{"name": "version", "value": "agent"}'),
+    (30, '{"name": "features", "value": ""}'),
+    (15, '{"name": "keyinit", "value": "%d"}'),
+    (10, '{"name": "<unknown_command>", "value": ""}'),
+    (5, '<malformed request>'),
+]
+
+CASES = [
+    # name, number of requests, requests per batch, latency, conflict rate
+    ('exchange-1x5000', 5000, 1, 0, 0),
+    ('exchange-50x5000', 5000, 50, 0, 0),
+    ('exchange-50x2000-conflicts', 2000, 50, 0, 0.2),
+    ('exchange-10x200-latency', 200, 10, 0.0005, 0),
+]
+
+
+def _make_requests(rand, count):
+    total = sum([weight for weight, data in REQUEST_MIX])
+
+    requests = []
+    for i in xrange(count):
+        pick = rand.randint(1, total)
+        for weight, data in REQUEST_MIX:
+            pick -= weight
+            if pick <= 0:
+                break
+        if '%d' in data:
+            data = data % rand.getrandbits(100)
+        requests.append(data)
+    return requests
+
+
+def _make_uuid(rand):
+    return '-'.join([binascii.hexlify(os.urandom(x))
+                     for x in (4, 2, 2, 2, 6)])
+
+
+def _run_case(parser, count, batch_size, latency, conflict_rate):
+    rand = random.Random(count)
+    store = fake_xenstore.reset(latency=latency,
+            conflict_rate=conflict_rate, seed=count)
+    host = fake_xenstore.Handle()
+
+    # Open XSComm after reset() so it uses the new store
+    xs = plugins.XSComm()
+
+    requests = _make_requests(rand, count)
+    latencies = []
+    errors = 0
+
+    start = time.time()
+    while requests:
+        batch = requests[:batch_size]
+        del requests[:batch_size]
+
+        for data in batch:
+            host.write('data/host/%s' % _make_uuid(rand), data)
+
+        handled = 0
+        while handled < len(batch):
+            t0 = time.time()
+            try:
+                req = xs.get_request()
+            except fake_xenstore.PyXenStoreError:
+                # XSComm will reopen the handle and retry
+                errors += 1
+                continue
+            if req is None:
+                break
+            resp = parser.parse_request(req)
+            try:
+                xs.put_response(req, resp)
+            except fake_xenstore.PyXenStoreError:
+                errors += 1
+            latencies.append(time.time() - t0)
+            handled += 1
+
+    elapsed = time.time() - start
+
+    result = {'requests': len(latencies),
+              'req_per_sec': len(latencies) / elapsed,
+              'xs_ops': store.ops,
+              'xs_conflicts': store.conflicts,
+              'xs_errors': errors,
+              'rejected': xs.rejected}
+    result.update(agent_bench.latency_summary(latencies))
+    return result
+
+
+def run(options):
+    # Use the fake store even if the real pyxenstore module is installed
+    plugins.xscomm.pyxenstore = fake_xenstore
+
+    tmpdir = tempfile.mkdtemp()
+    c = commands.init(testmode=True, tmpdir=tmpdir)
+    parser = plugins.JsonParser(c)
+
+    results = []
+    for name, count, batch_size, latency, conflict_rate in CASES:
+        result = _run_case(parser, count, batch_size, latency,
+                conflict_rate)
+        result['name'] = name
+        results.append(result)
+
+    os.rmdir(tmpdir)
+    return results
@@ -0,0 +1,181 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#  Copyright (c) 2011 Openstack, LLC.
+#  All Rights Reserved.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License"); you may
+#     not use this file except in compliance with the License. You may obtain
+#     a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#     WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#     License for the specific language governing permissions and limitations
+#     under the License.
+#
+
+"""
+Journaled file update benchmark: time and number of fsync() calls for
+update_files() as the number of files and directories grows, and time
+and peak memory for restaging a big streamed hosts file
+
+Staged files are chowned to root, like the agent does, so this needs to
+run as root.
+"""
+
+import logging
+import os
+import shutil
+import tempfile
+
+import agent_bench
+import bench_network_generators
+from tests import fake_xenstore
+
+fake_xenstore.install()
+
+import commands.network
+
+# name, number of files, number of directories they're spread over
+CASES = [
+    ('1file', 1, 1),
+    ('16files-1dir', 16, 1),
+    ('16files-4dirs', 16, 4),
+    ('128files-1dir', 128, 1),
+    ('128files-8dirs', 128, 8),
+]
+
+FILE_SIZE = 4096
+
+HOSTS_LINES = 100000
+
+
+def _run_case(num_files, num_dirs):
+    tmpdir = tempfile.mkdtemp()
+    try:
+        _set_state_files(tmpdir)
+
+        filepaths = []
+        for i in xrange(num_files):
+            dirname = os.path.join(tmpdir, 'dir%d' % (i % num_dirs))
+            if not os.path.exists(dirname):
+                os.mkdir(dirname)
+            filepaths.append(os.path.join(dirname, 'file%d' % i))
+
+        fsyncs = [0]
+        real_fsync = os.fsync
+
+        def counting_fsync(fd):
+            fsyncs[0] += 1
+            real_fsync(fd)
+
+        os.fsync = counting_fsync
+
+        generation = [0]
+
+        def update():
+            # Change every file every time so they're all rewritten
+            generation[0] += 1
+            data = ('%d\n' % generation[0]).ljust(FILE_SIZE, '#')
+            commands.network.update_files(dict([(filepath, data)
+                                                for filepath in filepaths]))
+
+        result = agent_bench.measure(update)
+        result['fsyncs'] = fsyncs[0] / result['iterations']
+    finally:
+        shutil.rmtree(tmpdir)
+
+    return result
+
+
+def _set_state_files(tmpdir):
+    commands.network.FILE_STATE_FILE = os.path.join(tmpdir, 'state',
+            'files.state')
+    commands.network.FILE_JOURNAL_FILE = os.path.join(tmpdir, 'state',
+            'files.journal')
+
+
+def _set_hosts_files(tmpdir):
+    _set_state_files(tmpdir)
+    commands.network.HOSTS_FILE = os.path.join(tmpdir, 'hosts')
+    interfaces = bench_network_generators.make_interfaces(1, 1, 0)
+
+    def update():
+        filepath, data = commands.network.get_etc_hosts(interfaces, 'bench')
+        commands.network.update_files({filepath: data})
+
+    return update
+
+
+def _make_hosts_case(tmpdir):
+    update = _set_hosts_files(tmpdir)
+
+    # Written a line at a time to keep it out of the peak RSS
+    f = open(commands.network.HOSTS_FILE, 'w')
+    try:
+        f.write('127.0.0.1\tlocalhost\n')
+        for i in xrange(HOSTS_LINES):
+            f.write('0.0.0.0\tads%d.example.com\n' % i)
+    finally:
+        f.close()
+
+    # Adds our own entry and records the digest, later updates are no-ops
+    update()
+    return {}
+
+
+def _run_hosts_case(tmpdir, forget_state):
+    """
+    Restage an unchanged hosts file through get_etc_hosts(), like every
+    resetnetwork does.  With 'forget_state' the saved digest is dropped
+    first, so the staged copy has to be compared with the real one
+    """
+
+    update = _set_hosts_files(tmpdir)
+
+    fsyncs = [0]
+    real_fsync = os.fsync
+
+    def counting_fsync(fd):
+        fsyncs[0] += 1
+        real_fsync(fd)
+
+    os.fsync = counting_fsync
+
+    def restage():
+        if forget_state and os.path.exists(commands.network.FILE_STATE_FILE):
+            os.unlink(commands.network.FILE_STATE_FILE)
+        update()
+
+    result = agent_bench.measure(restage)
+    result['fsyncs'] = fsyncs[0] / result['iterations']
+    return result
+
+
+def run(options):
+    if os.geteuid() != 0:
+        logging.warning("skipping file commit benchmark, needs root")
+        return []
+
+    results = []
+    for name, num_files, num_dirs in CASES:
+        result = agent_bench.run_forked(_run_case, num_files, num_dirs)
+        result['name'] = 'filecommit-%s' % name
+        results.append(result)
+
+    for name, forget_state in [('hosts-stream', False),
+                               ('hosts-stream-compare', True)]:
+        # Set up in a separate process so its peak RSS isn't counted
+        tmpdir = tempfile.mkdtemp()
+        try:
+            agent_bench.run_forked(_make_hosts_case, tmpdir)
+            result = agent_bench.run_forked(_run_hosts_case, tmpdir,
+                                            forget_state)
+        finally:
+            shutil.rmtree(tmpdir)
+        result['name'] = 'filecommit-%s' % name
+        results.append(result)
+
+    return results
@@ -0,0 +1,157 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#  Copyright (c) 2011 Openstack, LLC.
+#  All Rights Reserved.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License"); you may
+#     not use this file except in compliance with the License. You may obtain
+#     a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#     WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#     License for the specific language governing permissions and limitations
+#     under the License.
+#
+
+"""
+Per-distro network file generator benchmarks
+"""
+
+from cStringIO import StringIO
+
+import agent_bench
+from tests import fake_xenstore
+
+# commands.network imports pyxenstore
+fake_xenstore.install()
+
+import commands.network
+import commands.arch.network
+import commands.debian.network
+import commands.freebsd.network
+import commands.gentoo.network
+import commands.redhat.network
+import commands.suse.network
+
+# name, interfaces, IPs per interface, routes per interface
+CONFIGS = [
+    ('1if-1ip', 1, 1, 0),
+    ('2if-8ip-8rt', 2, 8, 8),
+    ('4if-64ip-64rt', 4, 64, 64),
+    ('16if-256ip-256rt', 16, 256, 256),
+    # One interface with lots of aliases
+    ('1if-2048ip', 1, 2048, 0),
+]
+
+# Number of lines in the existing /etc/hosts and rc.conf files
+HOSTS_LINES = 100000
+RCCONF_LINES = 5000
+
+
+def make_interfaces(num_ifaces, num_ips, num_routes):
+    """
+    Return a normalized interfaces dictionary, as passed to the
+    configure_network() functions
+    """
+
+    interfaces = {}
+    for i in xrange(num_ifaces):
+        ip4s = []
+        ip6s = []
+        for j in xrange(num_ips):
+            ip4s.append({'address': '10.%d.%d.%d' % (i, j / 250, j % 250 + 2),
+                         'netmask': '255.255.255.0',
+                         'prefixlen': 24})
+            # Half as many IPv6 addresses as IPv4
+            if j % 2 == 0:
+                ip6s.append({'address': '2001:db8:%x::%x' % (i, j + 2),
+                             'prefixlen': '64'})
+
+        routes = []
+        for j in xrange(num_routes):
+            routes.append({'network': '172.%d.%d.0' % (
+                                16 + (i + j / 256) % 16, j % 256),
+                           'netmask': '255.255.255.0',
+                           'prefixlen': 24,
+                           'gateway': '10.%d.0.1' % i})
+
+        interfaces['eth%d' % i] = {
+            'mac': '40:40:00:00:00:%02x' % i,
+            'up': True,
+            'ip4s': ip4s,
+            'ip6s': ip6s,
+            'gateway4': i == 0 and '10.0.0.1' or None,
+            'gateway6': i == 0 and '2001:db8::1' or None,
+            'routes': routes,
+            'dns': ['10.0.0.2', '10.0.0.3'],
+        }
+
+    return interfaces
+
+
+def make_hosts_file(num_lines=HOSTS_LINES):
+    lines = ['127.0.0.1\tlocalhost', '::1\tlocalhost ip6-localhost']
+    for i in xrange(num_lines):
+        lines.append('0.0.0.0\tads%d.example.com' % i)
+    return '\n'.join(lines) + '\n'
+
+
+def make_rcconf_file(num_lines=RCCONF_LINES):
+    lines = ['hostname="oldhostname"', 'sshd_enable="YES"',
+             'ifconfig_xn0="DHCP"']
+    for i in xrange(num_lines):
+        lines.append('custom_setting_%d="YES"' % i)
+    return '\n'.join(lines) + '\n'
+
+
+def make_network_file():
+    return 'NETWORKING=yes\nHOSTNAME=oldhostname\nNETWORKING_IPV6=no\n'
+
+
+# name, function making the existing file data (if any), generator
+GENERATORS = [
+    ('debian', None, lambda interfaces, data:
+            commands.debian.network._get_file_data(interfaces)),
+    ('redhat', make_network_file, lambda interfaces, data:
+            commands.redhat.network.process_interface_files(
+                StringIO(data), interfaces)),
+    ('arch-netcfg', make_rcconf_file, lambda interfaces, data:
+            commands.arch.network._update_rc_conf_netcfg(
+                StringIO(data), interfaces.keys())),
+    ('arch-legacy', make_rcconf_file, lambda interfaces, data:
+            commands.arch.network._update_rc_conf_legacy(
+                StringIO(data), interfaces)),
+    ('gentoo-openrc', None, lambda interfaces, data:
+            commands.gentoo.network._get_file_data_openrc(interfaces)),
+    ('gentoo-legacy', None, lambda interfaces, data:
+            commands.gentoo.network._get_file_data_legacy(interfaces)),
+    ('suse', None, lambda interfaces, data:
+            commands.suse.network.get_interface_files(interfaces)),
+    ('freebsd', make_rcconf_file, lambda interfaces, data:
+            commands.freebsd.network._create_rcconf_file(
+                StringIO(data), interfaces, 'myhostname')),
+    ('etc-hosts', make_hosts_file, lambda interfaces, data:
+            commands.network._get_etc_hosts(
+                StringIO(data), interfaces, 'myhostname')),
+]
+
+
+def _run_generator(config, make_data, generator):
+    interfaces = make_interfaces(*config[1:])
+    data = make_data and make_data()
+    return agent_bench.measure(lambda: generator(interfaces, data))
+
+
+def run(options):
+    results = []
+    for config in CONFIGS:
+        for gen_name, make_data, generator in GENERATORS:
+            result = agent_bench.run_forked(_run_generator, config,
+                    make_data, generator)
+            result['name'] = 'netgen-%s-%s' % (gen_name, config[0])
+            results.append(result)
+
+    return results
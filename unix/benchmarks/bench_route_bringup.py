@@ -0,0 +1,169 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#  Copyright (c) 2011 Openstack, LLC.
+#  All Rights Reserved.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License"); you may
+#     not use this file except in compliance with the License. You may obtain
+#     a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#     WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#     License for the specific language governing permissions and limitations
+#     under the License.
+#
+
+"""
+Route bring-up benchmark for the debian interfaces file
+
+Runs the 'up' commands generated for an interface the way ifup would,
+one process per command.  As root, the real route and ip commands are
+run in a private network namespace with a veth eth0, and the routes
+are flushed again after each run, which is included in the times.
+Otherwise they're replaced by stand-ins: 'true' for each per-route
+command and 'cat' of the batch file for 'ip -batch'.  The stand-ins
+only measure the cost of starting the processes, not of programming
+the routes.  Results have 'real' set to 1 when the real commands ran.
+"""
+
+import ctypes
+import os
+import shutil
+import subprocess
+import tempfile
+
+import agent_bench
+import bench_network_generators
+from tests import fake_xenstore
+
+fake_xenstore.install()
+
+import commands.debian.network
+import commands.network
+
+ROUTE_COUNTS = [1, 16, 128, 512]
+
+# name, batch route threshold
+MODES = [
+    ('per-route', -1),
+    ('batch', 0),
+]
+
+CLONE_NEWNET = 0x40000000
+
+# Sets up the interface make_interfaces() describes
+SETUP_COMMANDS = [
+    ['ip', 'link', 'add', 'eth0', 'type', 'veth', 'peer', 'name', 'peer0'],
+    ['ip', 'addr', 'add', '10.0.0.2/24', 'dev', 'eth0'],
+    ['ip', 'link', 'set', 'peer0', 'up'],
+    ['ip', 'link', 'set', 'eth0', 'up'],
+]
+# Removes the routes added by route and ip, leaving the interface's own
+FLUSH_COMMAND = ['ip', 'route', 'flush', 'proto', 'boot']
+
+
+def _call(cmd):
+    devnull = open(os.devnull, 'w')
+    try:
+        return subprocess.call(cmd, stdout=devnull, stderr=devnull)
+    except OSError:
+        return -1
+    finally:
+        devnull.close()
+
+
+def _private_netns():
+    """
+    Move this process into a new network namespace with a veth eth0.
+    Returns False if that isn't possible.
+    """
+
+    if os.geteuid() != 0:
+        return False
+
+    try:
+        libc = ctypes.CDLL(None, use_errno=True)
+        if libc.unshare(CLONE_NEWNET) != 0:
+            return False
+    except (OSError, AttributeError):
+        return False
+
+    for cmd in SETUP_COMMANDS:
+        if _call(cmd) != 0:
+            return False
+
+    return True
+
+
+def _get_up_commands(interfaces, tmpdir, real):
+    """
+    Return the commands ifup would run to bring up the routes, or their
+    stand-ins unless 'real' is set
+    """
+
+    route_files = commands.debian.network._get_route_files(interfaces)
+
+    cmds = []
+    for line in commands.debian.network._get_file_data(interfaces).split('\n'):
+        line = line.strip()
+        if line.startswith('up ip -batch '):
+            filepath = line.split()[-1]
+            tmp_file = os.path.join(tmpdir, os.path.basename(filepath))
+            f = open(tmp_file, 'w')
+            try:
+                f.write(route_files[filepath])
+            finally:
+                f.close()
+            if real:
+                cmds.append(['ip', '-batch', tmp_file])
+            else:
+                cmds.append(['cat', tmp_file])
+        elif line.startswith('up route '):
+            if real:
+                cmds.append(line.split()[1:])
+            else:
+                cmds.append(['true'] + line.split()[1:])
+
+    return cmds
+
+
+def _run_commands(cmds, real):
+    for cmd in cmds:
+        if _call(cmd) != 0 and real:
+            raise RuntimeError("'%s' failed" % ' '.join(cmd))
+
+    if real:
+        _call(FLUSH_COMMAND)
+
+
+def _run_case(num_routes, threshold):
+    commands.network.BATCH_ROUTE_THRESHOLD = threshold
+    interfaces = bench_network_generators.make_interfaces(1, 1, num_routes)
+
+    # Only this benchmark's process ends up in the namespace
+    real = _private_netns()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cmds = _get_up_commands(interfaces, tmpdir, real)
+        result = agent_bench.measure(lambda: _run_commands(cmds, real))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    result['processes'] = len(cmds)
+    result['real'] = int(real)
+    return result
+
+
+def run(options):
+    results = []
+    for num_routes in ROUTE_COUNTS:
+        for mode_name, threshold in MODES:
+            result = agent_bench.run_forked(_run_case, num_routes, threshold)
+            result['name'] = 'routes-%s-%d' % (mode_name, num_routes)
+            results.append(result)
+
+    return results
@@ -27,6 +27,7 @@ import sys
 class CommandNotFoundError(Exception):
 
     def __init__(self, cmd):
+        Exception.__init__(self, cmd)
         self.cmd = cmd
 
     def __str__(self):
@@ -53,6 +54,15 @@ class CommandBase(object):
     _cmd_instances = []
     _cmds = {}
     _init_args = {}
+    # Extra capabilities reported by the 'features' command
+    _features = []
+
+    # Set by the profile command class when profiling is available
+    _profiler = None
+    # Set by the job command class when background jobs are available
+    _job_runner = None
+    # Set by the worker command class when commands can be isolated
+    _worker = None
 
     @staticmethod
     def _get_commands(inst):
@@ -74,12 +84,46 @@ class CommandBase(object):
             inst = cls(**kwargs)
             cls._cmd_instances.append(inst)
             cls._cmds.update(cls._get_commands(inst))
+
+        # Started once every command is set up, and before the agent
+        # starts any threads
+        if CommandBase._worker:
+            CommandBase._worker.start()
+
         return sys.modules[__name__]
 
+    @classmethod
+    def run_threads(cls):
+        """
+        Start the background threads of every command class.  Called
+        once the agent has daemonized, as threads don't survive the fork.
+        """
+
+        for inst in cls._cmd_instances:
+            inst.start_threads()
+
+    def start_threads(self):
+        """Start any background threads this command class needs"""
+        pass
+
+    @classmethod
+    def init_arg(cls, name, default=None):
+        """Return an option passed to init(), or 'default' if it wasn't"""
+        return cls._init_args.get(name, default)
+
     @classmethod
     def command_names(cls):
         return [x for x in cls._cmds]
 
+    @classmethod
+    def feature_add(cls, name):
+        if name not in cls._features:
+            cls._features.append(name)
+
+    @classmethod
+    def feature_names(cls):
+        return list(cls._features)
+
     @classmethod
     def command_instance(cls, cmd_name):
         try:
@@ -94,19 +138,60 @@ class CommandBase(object):
         except KeyError:
             raise CommandNotFoundError(cmd_name)
 
+    @classmethod
+    def command_background(cls, cmd_name):
+        """Returns True if a command can be run as a background job"""
+        func = cls.command_function(cmd_name)
+        return cls._job_runner is not None and \
+                getattr(func, '_cmd_background', False)
+
+    @classmethod
+    def command_coalesce(cls, cmd_name):
+        """
+        Returns True if pending requests for a command can be answered
+        by a single run of it
+        """
+        func = cls.command_function(cmd_name)
+        return getattr(func, '_cmd_coalesce', False)
+
+    @classmethod
+    def run_command_background(cls, cmd_name, arg):
+        """Start a command as a background job and return its job ID"""
+        job = cls._job_runner.start(cmd_name, arg)
+        return (202, job.job_id)
+
     @classmethod
     def run_command(cls, cmd_name, arg):
-        return cls.command_function(cmd_name)(arg)
+        func = cls.command_function(cmd_name)
+        profiler = cls._profiler
+        if profiler and profiler.is_armed(cmd_name):
+            # Profile it here, a worker process can't be profiled
+            return profiler.run(cmd_name, func, arg)
+        if cls._worker and getattr(func, '_cmd_isolate', False):
+            return cls._worker.run(cmd_name, arg)
+        return func(arg)
 
 
-def command_add(cmd_name):
+def command_add(cmd_name, background=False, coalesce=False, isolate=False):
     """
     Decorator for command classes to use to add commands
+
+    Commands that can take a long time should set 'background' so that
+    a request can ask for them to be run as a background job
+
+    Commands where only the latest request matters should set 'coalesce'
+    so that several pending requests are handled by running it once
+
+    Commands that use a lot of memory should set 'isolate' so they run
+    in their own worker process that gives the memory back when it exits
     """
 
     def wrap(f):
         f._is_cmd = True
         f._cmd_name = cmd_name
+        f._cmd_background = background
+        f._cmd_coalesce = coalesce
+        f._cmd_isolate = isolate
         return f
     return wrap
 
@@ -134,7 +134,7 @@ def configure_network(hostname, interfaces):
         return (500, "Couldn't set hostname: %s" % str(e))
 
     # Stage files
-    commands.network.stage_files(update_files)
+    digests = commands.network.stage_files(update_files)
 
     errors = set()
 
@@ -160,7 +160,7 @@ def configure_network(hostname, interfaces):
             return (500, "Couldn't stop network: %d" % status)
 
     # Move files
-    commands.network.move_files(update_files, remove_files)
+    commands.network.move_files(update_files, remove_files, digests)
 
     # Up network
     logging.info('configuring interfaces up')
@@ -204,7 +204,7 @@ def get_hostname_file(infile, hostname):
     """
     Update hostname on system
     """
-    outfile = StringIO()
+    outfile = commands.network.FileData()
 
     found = False
     for line in infile:
@@ -213,18 +213,17 @@ def get_hostname_file(infile, hostname):
             k, v = line.split('=', 1)
             k = k.strip()
             if k == "HOSTNAME":
-                print >> outfile, 'HOSTNAME="%s"' % hostname
+                outfile.writeline('HOSTNAME="%s"' % hostname)
                 found = True
             else:
-                print >> outfile, line
+                outfile.writeline(line)
         else:
-            print >> outfile, line
+            outfile.writeline(line)
 
     if not found:
-        print >> outfile, 'HOSTNAME="%s"' % hostname
+        outfile.writeline('HOSTNAME="%s"' % hostname)
 
-    outfile.seek(0)
-    return outfile.read()
+    return outfile.getvalue()
 
 
 def _parse_variable(line, strip_bang=False):
@@ -386,12 +385,11 @@ def _update_rc_conf_legacy(infile, interfaces):
     lines = filter(lambda l: l is not None, lines)
 
     # Serialize into new file
-    outfile = StringIO()
+    outfile = commands.network.FileData()
     for line in lines:
-        print >> outfile, line
+        outfile.writeline(line)
 
-    outfile.seek(0)
-    return outfile.read()
+    return outfile.getvalue()
 
 
 def _get_file_data_netcfg(ifname, interface):
@@ -409,36 +407,36 @@ def _get_file_data_netcfg(ifname, interface):
 
     dns = interface['dns']
 
-    outfile = StringIO()
+    outfile = commands.network.FileData()
 
-    print >>outfile, 'CONNECTION="ethernet"'
-    print >>outfile, 'INTERFACE=%s' % ifname
+    outfile.writeline('CONNECTION="ethernet"')
+    outfile.writeline('INTERFACE=%s' % ifname)
 
     if ip4s:
         ip4 = ip4s.pop(0)
-        print >>outfile, 'IP="static"'
-        print >>outfile, 'ADDR="%(address)s"' % ip4
-        print >>outfile, 'NETMASK="%(netmask)s"' % ip4
+        outfile.writeline('IP="static"')
+        outfile.writeline('ADDR="%(address)s"' % ip4)
+        outfile.writeline('NETMASK="%(netmask)s"' % ip4)
 
         if gateway4:
-            print >>outfile, 'GATEWAY="%s"' % gateway4
+            outfile.writeline('GATEWAY="%s"' % gateway4)
 
     if ip6s:
         ip6 = ip6s.pop(0)
-        print >>outfile, 'IP6="static"'
-        print >>outfile, 'ADDR6="%(address)s/%(prefixlen)s"' % ip6
+        outfile.writeline('IP6="static"')
+        outfile.writeline('ADDR6="%(address)s/%(prefixlen)s"' % ip6)
 
         if gateway6:
-            print >>outfile, 'GATEWAY6="%s"' % gateway6
+            outfile.writeline('GATEWAY6="%s"' % gateway6)
 
     routes = ['"%(network)s/%(netmask)s via %(gateway)s"' % route 
               for route in interface['routes']]
 
     if routes:
-        print >>outfile, 'ROUTES=(%s)' % ' '.join(routes)
+        outfile.writeline('ROUTES=(%s)' % ' '.join(routes))
 
     if dns:
-        print >>outfile, 'DNS=(%s)' % ' '.join(dns)
+        outfile.writeline('DNS=(%s)' % ' '.join(dns))
 
     # Finally add remaining aliases. This is kind of hacky, see comment at
     # top for explanation
@@ -446,17 +444,16 @@ def _get_file_data_netcfg(ifname, interface):
               ['%(address)s/%(prefixlen)s' % ip6 for ip6 in ip6s]
 
     if aliases:
-        commands = '; '.join(['ip addr add %s dev %s' % (a, ifname)
-                              for a in aliases])
-        print >>outfile, 'POST_UP="%s"' % commands
+        cmds = '; '.join(['ip addr add %s dev %s' % (a, ifname)
+                          for a in aliases])
+        outfile.writeline('POST_UP="%s"' % cmds)
 
         aliases.reverse()
-        commands = '; '.join(['ip addr del %s dev %s' % (a, ifname)
-                              for a in aliases])
-        print >>outfile, 'PRE_DOWN="%s"' % commands
+        cmds = '; '.join(['ip addr del %s dev %s' % (a, ifname)
+                          for a in aliases])
+        outfile.writeline('PRE_DOWN="%s"' % cmds)
 
-    outfile.seek(0)
-    return outfile.read()
+    return outfile.getvalue()
 
 
 def _update_rc_conf_netcfg(infile, netnames):
@@ -506,12 +503,11 @@ def _update_rc_conf_netcfg(infile, netnames):
             pass
 
     # Serialize into new file
-    outfile = StringIO()
+    outfile = commands.network.FileData()
     for line in lines:
-        print >> outfile, line
+        outfile.writeline(line)
 
-    outfile.seek(0)
-    return outfile.read()
+    return outfile.getvalue()
 
 
 def get_interface_files(infiles, interfaces, version):
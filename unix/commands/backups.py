@@ -0,0 +1,171 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#  Copyright (c) 2011 Openstack, LLC.
+#  All Rights Reserved.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License"); you may
+#     not use this file except in compliance with the License. You may obtain
+#     a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#     WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#     License for the specific language governing permissions and limitations
+#     under the License.
+#
+
+"""
+Backup file retention
+"""
+
+import logging
+import os
+import re
+import time
+
+import commands
+
+# Number of backups to keep of each file, and the age in seconds after
+# which backups other than the newest are removed (None to keep them
+# regardless of age).  Can be changed with the 'backup_keep' and
+# 'backup_max_age' options
+BACKUP_KEEP = 5
+BACKUP_MAX_AGE = 30 * 24 * 60 * 60
+
+# Directories 'cleanbackups' looks through when not given any
+BACKUP_DIRS = [
+    '/etc',
+    '/etc/NetworkManager/system-connections',
+    '/etc/conf.d',
+    '/etc/network',
+    '/etc/network.d',
+    '/etc/systemd/network',
+    '/etc/sysconfig',
+    '/etc/sysconfig/network',
+    '/etc/sysconfig/network-scripts',
+]
+
+# network.move_files() makes '<file>.<time>.bak~' backups and
+# file_inject._write_file() makes '<file>.bak.<time>' ones.  The time must
+# look like one of ours (seconds since the epoch, 10 digits since 2001),
+# so backups like 'hosts.bak.1' that admins make themselves are left alone
+_BACKUP_RE = re.compile(r'^(.+?)\.(?:(\d{10,})\.bak~|'
+                        r'bak\.(\d{10,}(?:\.\d+)?))$')
+
+
+def is_backup(filepath):
+    """Return True if 'filepath' is a backup made by the agent"""
+    return _BACKUP_RE.match(os.path.basename(filepath)) is not None
+
+
+def _list_backups(dirname):
+    """
+    Return a dictionary of file path to a list of (time, backup path)
+    for the backups in 'dirname'
+    """
+
+    backups = {}
+    try:
+        names = os.listdir(dirname)
+    except OSError:
+        return backups
+
+    for name in names:
+        match = _BACKUP_RE.match(name)
+        if not match:
+            continue
+
+        filename, timestamp, inject_timestamp = match.groups()
+        backups.setdefault(os.path.join(dirname, filename), []).append(
+                (float(timestamp or inject_timestamp),
+                 os.path.join(dirname, name)))
+
+    return backups
+
+
+def _prune(backups, keep, max_age, now):
+    """Remove backups outside of the retention policy"""
+
+    backups.sort()
+    backups.reverse()
+
+    removed = 0
+    for i, (timestamp, backup) in enumerate(backups):
+        if i < keep and (i == 0 or max_age is None or
+                now - timestamp <= max_age):
+            continue
+
+        try:
+            os.unlink(backup)
+        except OSError, e:
+            logging.warning("couldn't remove backup %s: %s" % (backup,
+                    str(e)))
+            continue
+        removed += 1
+
+    return removed
+
+
+def prune_backups(filepaths, keep=None, max_age=None):
+    """
+    Remove old backups of the files in 'filepaths', keeping at most the
+    newest 'keep' ones.  Of those, ones older than 'max_age' seconds are
+    removed too, except for the newest.  Returns the number of backups
+    removed.
+    """
+
+    if keep is None:
+        keep = commands.init_arg("backup_keep", BACKUP_KEEP)
+    if max_age is None:
+        max_age = commands.init_arg("backup_max_age", BACKUP_MAX_AGE)
+
+    by_dir = {}
+    for filepath in filepaths:
+        by_dir.setdefault(os.path.dirname(filepath), []).append(filepath)
+
+    now = time.time()
+    removed = 0
+    for dirname, dir_filepaths in by_dir.iteritems():
+        backups = _list_backups(dirname)
+        for filepath in dir_filepaths:
+            if filepath in backups:
+                removed += _prune(backups[filepath], keep, max_age, now)
+
+    return removed
+
+
+def clean_backups(dirnames, keep=None, max_age=None):
+    """
+    Apply the retention policy to every file with backups in 'dirnames'.
+    Returns the number of backups removed.
+    """
+
+    filepaths = []
+    for dirname in dirnames:
+        filepaths.extend(_list_backups(dirname).keys())
+
+    return prune_backups(filepaths, keep, max_age)
+
+
+class BackupCommands(commands.CommandBase):
+
+    def __init__(self, *args, **kwargs):
+        pass
+
+    @commands.command_add('cleanbackups', background=True)
+    def cleanbackups_cmd(self, data):
+        """
+        Remove old backups from a comma separated list of directories,
+        or from the directories the agent writes to by default
+        """
+
+        if data:
+            dirnames = [d.strip() for d in data.split(',') if d.strip()]
+        else:
+            dirnames = BACKUP_DIRS
+
+        removed = clean_backups(dirnames)
+
+        return (0, "removed %d backups" % removed)
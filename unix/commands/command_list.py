@@ -20,9 +20,13 @@
 List of command modules to load
 """
 
+import backups
 import file_inject
+import jobs
 import misc
 import network
 import password
+import profiling
 import update
+import worker
 import kms
@@ -22,21 +22,26 @@ debian/ubuntu network helper module
 
 # Debian/Ubuntu network configuration uses:
 # - 1 network configuration file (/etc/network/interfaces)
-# - 1 IP per interface
-# - routes are per interface
+# - 1 IP per interface, or secondary IPs added with 'up' commands when
+#   there are lots of them
+# - routes are per interface, in an 'ip -batch' file per interface when
+#   there are lots of them
 # - gateways are per interface
 # - DNS is per interface (but see comments below about /etc/resolv.conf)
 
+import glob
 import logging
 import os
 import subprocess
 import time
 from cStringIO import StringIO
 
+import commands.backups
 import commands.network
 
 HOSTNAME_FILE = "/etc/hostname"
 INTERFACE_FILE = "/etc/network/interfaces"
+ROUTES_FILE = "/etc/network/routes-%s"
 
 INTERFACE_HEADER = \
 """
@@ -53,6 +58,10 @@ def configure_network(hostname, interfaces):
     data = _get_file_data(interfaces)
     update_files = {INTERFACE_FILE: data}
 
+    # Generate route batch files, and remove ones no longer used
+    update_files.update(_get_route_files(interfaces))
+    remove_files = _get_stale_route_files(update_files)
+
     # Generate new hostname file
     data = get_hostname_file(hostname)
     update_files[HOSTNAME_FILE] = data
@@ -103,7 +112,7 @@ def configure_network(hostname, interfaces):
     files_update_error = None
     # Write out new files
     try:
-        commands.network.update_files(update_files)
+        commands.network.update_files(update_files, remove_files)
     except Exception, e:
         files_update_error = e
 
@@ -170,12 +179,111 @@ def _run_on_interfaces(cmd):
                 cmd, i, status))
 
 
+def _write_alias_interfaces(file_data, ifname_prefix, interface):
+    """
+    Write a stanza for each (sub-)interface, with one IPv4 and one IPv6
+    address each
+    """
+
+    ip4s = interface['ip4s']
+    ip6s = interface['ip6s']
+
+    gateway4 = interface['gateway4']
+    gateway6 = interface['gateway6']
+
+    dns = interface['dns']
+
+    ifname_suffix_num = 0
+
+    for ip4, ip6 in map(None, ip4s, ip6s):
+        if ifname_suffix_num:
+            ifname = "%s:%d" % (ifname_prefix, ifname_suffix_num)
+        else:
+            ifname = ifname_prefix
+
+        file_data.write("\n")
+        file_data.write("auto %s\n" % ifname)
+
+        if ip4:
+            file_data.write("iface %s inet static\n" % ifname)
+            file_data.write("    address %(address)s\n" % ip4)
+            file_data.write("    netmask %(netmask)s\n" % ip4)
+
+            if gateway4:
+                file_data.write("    gateway %s\n" % gateway4)
+                gateway4 = None
+
+        if ip6:
+            file_data.write("iface %s inet6 static\n" % ifname)
+            file_data.write("    address %(address)s\n" % ip6)
+            file_data.write("    netmask %(prefixlen)s\n" % ip6)
+
+            if gateway6:
+                file_data.write("    gateway %s\n" % gateway6)
+                gateway6 = None
+
+        if dns:
+            file_data.write("    dns-nameservers %s\n" % ' '.join(dns))
+            dns = None
+
+        ifname_suffix_num += 1
+
+
+def _write_bulk_interface(file_data, ifname, interface):
+    """
+    Write one stanza per address family, with the secondary addresses
+    added by 'up' commands instead of as eth0:N alias interfaces
+    """
+
+    ip4s = interface['ip4s']
+    ip6s = interface['ip6s']
+
+    file_data.write("\n")
+    file_data.write("auto %s\n" % ifname)
+
+    if ip4s:
+        file_data.write("iface %s inet static\n" % ifname)
+        file_data.write("    address %(address)s\n" % ip4s[0])
+        file_data.write("    netmask %(netmask)s\n" % ip4s[0])
+
+        if interface['gateway4']:
+            file_data.write("    gateway %s\n" % interface['gateway4'])
+
+        for ip4 in ip4s[1:]:
+            address = '%s/%s' % (ip4['address'],
+                                 commands.network.get_prefixlen(ip4))
+            file_data.write("    up ip addr add %s dev %s\n" %
+                            (address, ifname))
+            file_data.write("    down ip addr del %s dev %s\n" %
+                            (address, ifname))
+
+    if ip6s:
+        file_data.write("iface %s inet6 static\n" % ifname)
+        file_data.write("    address %(address)s\n" % ip6s[0])
+        file_data.write("    netmask %(prefixlen)s\n" % ip6s[0])
+
+        if interface['gateway6']:
+            file_data.write("    gateway %s\n" % interface['gateway6'])
+
+        for ip6 in ip6s[1:]:
+            address = '%(address)s/%(prefixlen)s' % ip6
+            file_data.write("    up ip -6 addr add %s dev %s\n" %
+                            (address, ifname))
+            file_data.write("    down ip -6 addr del %s dev %s\n" %
+                            (address, ifname))
+
+    if interface['dns']:
+        file_data.write("    dns-nameservers %s\n" %
+                        ' '.join(interface['dns']))
+
+
 def _get_file_data(interfaces):
     """
     Return interfaces file data in 1 long string
     """
 
-    file_data = INTERFACE_HEADER
+    file_data = commands.network.FileData()
+    file_data.write(INTERFACE_HEADER)
 
     ifnames = interfaces.keys()
     ifnames.sort()
@@ -183,57 +291,77 @@ def _get_file_data(interfaces):
     for ifname_prefix in ifnames:
         interface = interfaces[ifname_prefix]
 
-        ip4s = interface['ip4s']
-        ip6s = interface['ip6s']
-
-        gateway4 = interface['gateway4']
-        gateway6 = interface['gateway6']
-
-        dns = interface['dns']
+        if commands.network.use_bulk_aliases(interface):
+            _write_bulk_interface(file_data, ifname_prefix, interface)
+        else:
+            _write_alias_interfaces(file_data, ifname_prefix, interface)
+
+        if commands.network.use_batch_routes(interface):
+            # Routes through the interface go away when it's brought
+            # down, so there's nothing to undo
+            file_data.write("up ip -batch %s\n" %
+                            (ROUTES_FILE % ifname_prefix))
+        else:
+            for route in interface['routes']:
+                file_data.write("up route add -net %(network)s "
+                                "netmask %(netmask)s gw %(gateway)s\n" %
+                                route)
+                file_data.write("down route del -net %(network)s "
+                                "netmask %(netmask)s gw %(gateway)s\n" %
+                                route)
+
+    return file_data.getvalue()
+
+
+def _get_route_data(ifname, interface):
+    """
+    Return 'ip -batch' commands adding the routes for an interface
+    """
 
-        ifname_suffix_num = 0
+    route_data = commands.network.FileData()
+    for route in interface['routes']:
+        route_data.write("route replace %s/%s via %s dev %s\n" % (
+                route['network'], commands.network.get_prefixlen(route),
+                route['gateway'], ifname))
 
-        for ip4, ip6 in map(None, ip4s, ip6s):
-            if ifname_suffix_num:
-                ifname = "%s:%d" % (ifname_prefix, ifname_suffix_num)
-            else:
-                ifname = ifname_prefix
+    return route_data.getvalue()
 
-            file_data += "\n"
-            file_data += "auto %s\n" % ifname
 
-            if ip4:
-                file_data += "iface %s inet static\n" % ifname
-                file_data += "    address %(address)s\n" % ip4
-                file_data += "    netmask %(netmask)s\n" % ip4
+def _get_stale_route_files(update_files):
+    """
+    Return the route batch files that aren't in 'update_files'
+    """
 
-                if gateway4:
-                    file_data += "    gateway %s\n" % gateway4
-                    gateway4 = None
+    remove_files = set()
+    for filepath in glob.glob(ROUTES_FILE % '*'):
+        # The glob also matches backups and editor files, skip those.
+        # Interface names can have dots in them (VLANs like eth0.100).
+        if filepath.endswith('~') or commands.backups.is_backup(filepath):
+            continue
 
-            if ip6:
-                file_data += "iface %s inet6 static\n" % ifname
-                file_data += "    address %(address)s\n" % ip6
-                file_data += "    netmask %(prefixlen)s\n" % ip6
+        if filepath not in update_files:
+            remove_files.add(filepath)
 
-                if gateway6:
-                    file_data += "    gateway %s\n" % gateway6
-                    gateway6 = None
+    return remove_files
 
-            if dns:
-                file_data += "    dns-nameservers %s\n" % ' '.join(dns)
-                dns = None
 
-            ifname_suffix_num += 1
+def _get_route_files(interfaces):
+    """
+    Return route batch files for interfaces with lots of routes
+    """
 
-        for route in interface['routes']:
-            file_data += "up route add -net %(network)s " \
-                         "netmask %(netmask)s gw %(gateway)s\n" % route
-            file_data += "down route del -net %(network)s " \
-                         "netmask %(netmask)s gw %(gateway)s\n" % route
+    route_files = {}
+    for ifname, interface in interfaces.iteritems():
+        if commands.network.use_batch_routes(interface):
+            route_files[ROUTES_FILE % ifname] = _get_route_data(ifname,
+                                                                interface)
 
-    return file_data
+    return route_files
 
 
 def get_interface_files(interfaces):
-    return {'interfaces': _get_file_data(interfaces)}
+    update_files = {'interfaces': _get_file_data(interfaces)}
+    for filepath, data in _get_route_files(interfaces).iteritems():
+        update_files[os.path.basename(filepath)] = data
+
+    return update_files
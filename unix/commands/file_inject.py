@@ -20,6 +20,7 @@
 JSON File injection plugin
 """
 
+import backups
 import base64
 import commands
 import os
@@ -47,13 +48,15 @@ def _write_file(filename, data):
 
     os.rename(tempfilename, filename)
 
+    backups.prune_backups([filename])
+
 
 class FileInject(commands.CommandBase):
 
     def __init__(self, *args, **kwargs):
         pass
 
-    @commands.command_add('injectfile')
+    @commands.command_add('injectfile', isolate=True)
     def injectfile_cmd(self, data):
 
         try:
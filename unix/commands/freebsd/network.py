@@ -22,7 +22,8 @@ FreeBSD network helper module
 
 # FreeBSD network configuration uses:
 # - 1 shell-script-style global configuration file (/etc/rc.conf)
-# - 1 IP per interface
+# - 1 IP per interface, or an ifconfig_*_aliases list when there are lots
+#   of them
 # - routes are global
 # - gateways are global
 # - DNS is configured via resolv.conf 
@@ -30,20 +31,28 @@ FreeBSD network helper module
 import os
 import re
 import time
-import subprocess
 import logging
-from cStringIO import StringIO
 
 import commands.network
 
 RCCONF_FILE = "/etc/rc.conf"
 
+# rc.conf settings for a particular interface and ones applied by the
+# routing (and, before FreeBSD 9, network_ipv6) rc scripts
+_IFCONFIG_SETTING = re.compile(r'^(?:ipv6_)?ifconfig_([^_=]+)')
+_ROUTING_SETTING = re.compile(r'^(?:ipv6_)?(?:defaultrouter|static_routes|'
+                              r'route_|enable=|network_interfaces)')
+
 
 def configure_network(hostname, interfaces):
     update_files = {}
 
+    # Remember what's configured now so only what changed is restarted
+    lines = _read_rcconf()
+    old_settings = _get_rcconf_settings(lines)
+
     # Generate new /etc/rc.conf
-    data = _get_file_data(interfaces, hostname)
+    data = _create_rcconf_file(lines, interfaces, hostname)
     update_files[RCCONF_FILE] = data
 
     # Generate new /etc/resolv.conf file
@@ -56,42 +65,195 @@ def configure_network(hostname, interfaces):
     update_files[filepath] = data
 
     # Write out new files
-    commands.network.update_files(update_files)
+    changed = commands.network.update_files(update_files)
 
-    pipe = subprocess.PIPE
+    errors = []
 
     # Set hostname
     try:
         commands.network.sethostname(hostname)
     except Exception, e:
         logging.error("Couldn't sethostname(): %s" % str(e))
-        return (500, "Couldn't set hostname: %s" % str(e))
-
-    # Restart network
-    logging.debug('executing /etc/rc.d/netif restart')
-    p = subprocess.Popen(["/etc/rc.d/netif", "restart"],
-            stdin=pipe, stdout=pipe, stderr=pipe, env={})
-    logging.debug('waiting on pid %d' % p.pid)
-    status = os.waitpid(p.pid, 0)[1]
-    logging.debug('status = %d' % status)
-
-    if status != 0:
-        return (500, "Couldn't restart IPv4 networking: %d" % status)
-
-    # Restart network
-    logging.debug('executing /etc/rc.d/network_ipv6 restart')
-    p = subprocess.Popen(["/etc/rc.d/network_ipv6", "restart"],
-            stdin=pipe, stdout=pipe, stderr=pipe, env={})
-    logging.debug('waiting on pid %d' % p.pid)
-    status = os.waitpid(p.pid, 0)[1]
-    logging.debug('status = %d' % status)
-
-    if status != 0:
-        return (500, "Couldn't restart IPv6 networking: %d" % status)
+        errors.append("Couldn't set hostname: %s" % str(e))
+
+    if RCCONF_FILE in changed:
+        new_settings = _get_rcconf_settings(
+                update_files[RCCONF_FILE].splitlines())
+        ifnames, restart_routing = _get_restarts(old_settings, new_settings)
+    else:
+        ifnames, restart_routing = [], False
+
+    # Restart only the interfaces whose configuration changed.  A plain
+    # 'netif restart' takes down every interface, loopback included
+    cmds = [["/etc/rc.d/netif", "restart", ifname] for ifname in ifnames]
+    for cmd, status in commands.network.run_commands(cmds):
+        errors.append("Couldn't restart interface %s: %d" % (cmd[2], status))
+
+    if restart_routing:
+        cmds = [["/etc/rc.d/routing", "restart"]]
+        # FreeBSD 8 and earlier configure IPv6 separately
+        if os.path.exists("/etc/rc.d/network_ipv6"):
+            cmds.append(["/etc/rc.d/network_ipv6", "restart"])
+
+        for cmd, status in commands.network.run_commands(cmds):
+            errors.append("Couldn't restart %s: %d" %
+                    (os.path.basename(cmd[0]), status))
+
+    if errors:
+        return (500, "; ".join(errors))
 
     return (0, "")
 
 
+def _read_rcconf():
+    """
+    Return the lines of the current rc.conf
+    """
+
+    f = open(RCCONF_FILE)
+    try:
+        return f.readlines()
+    finally:
+        f.close()
+
+
+def _get_rcconf_settings(lines):
+    """
+    Return the interface and routing settings in rc.conf 'lines' as a
+    dictionary of interface name to its settings and a list of routing
+    settings
+    """
+
+    interfaces = {}
+    routing = []
+
+    for line in lines:
+        line = line.strip()
+
+        match = _IFCONFIG_SETTING.match(line)
+        if match:
+            interfaces.setdefault(match.group(1), []).append(line)
+        elif _ROUTING_SETTING.match(line):
+            routing.append(line)
+
+    for settings in interfaces.itervalues():
+        settings.sort()
+    routing.sort()
+
+    return interfaces, routing
+
+
+def _get_restarts(old_settings, new_settings):
+    """
+    Return the interfaces to restart, given the settings before and
+    after the update, and whether routing needs to be restarted
+    """
+
+    old_interfaces, old_routing = old_settings
+    new_interfaces, new_routing = new_settings
+
+    # Interfaces no longer configured are restarted too so they're
+    # taken down
+    ifnames = commands.network.changed_settings(old_interfaces,
+            new_interfaces)
+
+    # Restarting an interface flushes the routes through it
+    restart_routing = bool(ifnames) or old_routing != new_routing
+
+    return ifnames, restart_routing
+
+
+def _write_alias_interfaces(outfile, ifname_prefix, interface):
+    """
+    Write the first IPs for the interface and an ifconfig_*_aliasN entry
+    for each additional IP
+    """
+
+    ip4s = interface['ip4s']
+    ip6s = interface['ip6s']
+
+    ifname_suffix_num = 0
+
+    for ip4, ip6 in map(None, ip4s, ip6s):
+        if ifname_suffix_num:
+            ifname = "%s_alias%d" % (ifname_prefix, ifname_suffix_num - 1)
+        else:
+            ifname = ifname_prefix
+
+        if ip4:
+            if ifname_suffix_num:
+                # XXX -- Known bug here.  If we're adding an alias
+                # that is on the same network as another address already
+                # configured, the netmask here should be 255.255.255.255
+                outfile.writeline('ifconfig_%s="%s netmask %s"' %
+                        (ifname, ip4['address'], ip4['netmask']))
+            else:
+                outfile.writeline('ifconfig_%s="%s netmask %s up"' %
+                        (ifname, ip4['address'], ip4['netmask']))
+
+        if ip6:
+            outfile.writeline('ipv6_ifconfig_%s="%s/%s"' %
+                    (ifname, ip6['address'], ip6['prefixlen']))
+
+        ifname_suffix_num += 1
+
+
+def _get_alias_ranges(ip4s):
+    """
+    Return 'address/prefixlen' strings for IPv4 addresses, collapsing
+    runs of consecutive addresses into 'a.b.c.d-e/prefixlen' ranges
+    """
+
+    ranges = []
+    last = None
+    for ip4 in ip4s:
+        prefixlen = commands.network.get_prefixlen(ip4)
+        network, host = ip4['address'].rsplit('.', 1)
+        host = int(host)
+
+        if last and last[0] == network and last[2] == host - 1 and \
+                last[3] == prefixlen:
+            last[2] = host
+        else:
+            last = [network, host, host, prefixlen]
+            ranges.append(last)
+
+    entries = []
+    for network, first, end, prefixlen in ranges:
+        if first == end:
+            entries.append('%s.%d/%s' % (network, first, prefixlen))
+        else:
+            entries.append('%s.%d-%d/%s' % (network, first, end, prefixlen))
+
+    return entries
+
+
+def _write_bulk_aliases(outfile, ifname, interface):
+    """
+    Write the first IPs for the interface and all of the others in one
+    ifconfig_*_aliases entry
+    """
+
+    ip4s = interface['ip4s']
+    ip6s = interface['ip6s']
+
+    if ip4s:
+        outfile.writeline('ifconfig_%s="%s netmask %s up"' %
+                (ifname, ip4s[0]['address'], ip4s[0]['netmask']))
+
+    if ip6s:
+        outfile.writeline('ipv6_ifconfig_%s="%s/%s"' %
+                (ifname, ip6s[0]['address'], ip6s[0]['prefixlen']))
+
+    aliases = ['inet %s' % entry for entry in _get_alias_ranges(ip4s[1:])]
+    aliases.extend(['inet6 %(address)s/%(prefixlen)s' % ip6
+                    for ip6 in ip6s[1:]])
+
+    if aliases:
+        outfile.writeline('ifconfig_%s_aliases="%s"' %
+                (ifname, ' '.join(aliases)))
+
+
 def _create_rcconf_file(infile, interfaces, hostname):
     """
     Return new rc.conf, merging in 'infile'
@@ -100,7 +262,7 @@ def _create_rcconf_file(infile, interfaces, hostname):
     ipv6_interfaces = []
     static_route_entries = []
 
-    outfile = StringIO()
+    outfile = commands.network.FileData()
 
     for line in infile:
         line = line.strip()
@@ -114,10 +276,10 @@ def _create_rcconf_file(infile, interfaces, hostname):
                 line.startswith("dhcpd_") or \
                 line.startswith("hostname"):
             continue
-        print >> outfile, line
+        outfile.writeline(line)
 
-    print >> outfile, 'dhcpd_enable="NO"'
-    print >> outfile, 'hostname=%s' % hostname
+    outfile.writeline('dhcpd_enable="NO"')
+    outfile.writeline('hostname=%s' % hostname)
 
     gateway4, gateway6 = commands.network.get_gateways(interfaces)
 
@@ -126,36 +288,13 @@ def _create_rcconf_file(infile, interfaces, hostname):
     for ifname_prefix in ifnames:
         interface = interfaces[ifname_prefix]
 
-        ip4s = interface['ip4s']
-        ip6s = interface['ip6s']
-
-        if ip6s:
+        if interface['ip6s']:
             ipv6_interfaces.append(ifname_prefix)
 
-        ifname_suffix_num = 0
-
-        for ip4, ip6 in map(None, ip4s, ip6s):
-            if ifname_suffix_num:
-                ifname = "%s_alias%d" % (ifname_prefix, ifname_suffix_num - 1)
-            else:
-                ifname = ifname_prefix
-
-            if ip4:
-                if ifname_suffix_num:
-                    # XXX -- Known bug here.  If we're adding an alias
-                    # that is on the same network as another address already
-                    # configured, the netmask here should be 255.255.255.255
-                    print >> outfile, 'ifconfig_%s="%s netmask %s"' % \
-                            (ifname, ip4['address'], ip4['netmask'])
-                else:
-                    print >> outfile, 'ifconfig_%s="%s netmask %s up"' % \
-                            (ifname, ip4['address'], ip4['netmask'])
-
-            if ip6:
-                print >> outfile, 'ipv6_ifconfig_%s="%s/%s"' % \
-                        (ifname, ip6['address'], ip6['prefixlen'])
-
-            ifname_suffix_num += 1
+        if commands.network.use_bulk_aliases(interface):
+            _write_bulk_aliases(outfile, ifname_prefix, interface)
+        else:
+            _write_alias_interfaces(outfile, ifname_prefix, interface)
 
         for route in interface['routes']:
             if ':' in route['network']:
@@ -171,23 +310,22 @@ def _create_rcconf_file(infile, interfaces, hostname):
         for i, line in enumerate(static_route_entries):
             name = 'lan%d' % i
             names.append(name)
-            print >> outfile, 'route_%s="%s"' % (name, line)
+            outfile.writeline('route_%s="%s"' % (name, line))
 
-        print >> outfile, 'static_routes="%s"' % ','.join(names)
+        outfile.writeline('static_routes="%s"' % ','.join(names))
 
     if ipv6_interfaces:
-        print >> outfile, 'ipv6_enable="YES"'
-        print >> outfile, 'ipv6_network_interfaces="%s"' % \
-            ','.join(ipv6_interfaces)
+        outfile.writeline('ipv6_enable="YES"')
+        outfile.writeline('ipv6_network_interfaces="%s"' %
+            ','.join(ipv6_interfaces))
 
     if gateway4:
-        print >> outfile, 'defaultrouter="%s"' % gateway4
+        outfile.writeline('defaultrouter="%s"' % gateway4)
 
     if gateway6:
-        print >> outfile, 'ipv6_defaultrouter="%s"' % gateway6
+        outfile.writeline('ipv6_defaultrouter="%s"' % gateway6)
 
-    outfile.seek(0)
-    return outfile.read()
+    return outfile.getvalue()
 
 
 def _get_file_data(interfaces, hostname):
@@ -195,4 +333,4 @@ def _get_file_data(interfaces, hostname):
     Return the data for a new rc.conf file
     """
 
-    return _create_rcconf_file(open(RCCONF_FILE), interfaces, hostname)
+    return _create_rcconf_file(_read_rcconf(), interfaces, hostname)
@@ -35,7 +35,6 @@ gentoo network helper module
 import os
 import re
 import time
-import subprocess
 import logging
 from cStringIO import StringIO
 
@@ -44,8 +43,21 @@ import commands.network
 HOSTNAME_FILE = "/etc/conf.d/hostname"
 NETWORK_FILE = "/etc/conf.d/net"
 
+# Start of a variable in conf.d/net, and the interface it's for if any
+_NET_VARIABLE = re.compile(r'^\s*(?:(?:config|routes)_(\w+)|\w+)=')
+
 
 def configure_network(hostname, interfaces):
+    # Remember what's configured now so only what changed is restarted
+    if os.path.exists(NETWORK_FILE):
+        f = open(NETWORK_FILE)
+        try:
+            old_settings = _get_net_settings(f)
+        finally:
+            f.close()
+    else:
+        old_settings = None
+
     # Figure out if this system is running OpenRC
     if os.path.islink('/sbin/runscript'):
         data, ifaces = _get_file_data_openrc(interfaces)
@@ -68,38 +80,98 @@ def configure_network(hostname, interfaces):
     update_files[filepath] = data
 
     # Write out new files
-    commands.network.update_files(update_files)
+    changed = commands.network.update_files(update_files)
 
-    pipe = subprocess.PIPE
+    errors = []
 
     # Set hostname
     try:
         commands.network.sethostname(hostname)
     except Exception, e:
         logging.error("Couldn't sethostname(): %s" % str(e))
-        return (500, "Couldn't set hostname: %s" % str(e))
+        errors.append("Couldn't set hostname: %s" % str(e))
 
-    # Restart network
-    for ifname in ifaces:
+    if NETWORK_FILE in changed:
+        new_settings = _get_net_settings(
+                update_files[NETWORK_FILE].splitlines())
+        restart = _get_restarts(old_settings, new_settings, ifaces)
+    else:
+        restart = set()
+
+    cmds = []
+    for ifname in sorted(ifaces):
         scriptpath = '/etc/init.d/net.%s' % ifname
 
         if not os.path.exists(scriptpath):
             # Gentoo won't create these symlinks automatically
             os.symlink('net.lo', scriptpath)
+            restart.add(ifname)
+
+        if ifname in restart:
+            cmds.append([scriptpath, 'restart'])
 
-        logging.debug('executing %s restart' % scriptpath)
-        p = subprocess.Popen([scriptpath, 'restart'],
-                stdin=pipe, stdout=pipe, stderr=pipe, env={})
-        logging.debug('waiting on pid %d' % p.pid)
-        status = os.waitpid(p.pid, 0)[1]
-        logging.debug('status = %d' % status)
+    # Restart network, the interfaces are independent of each other so
+    # they're restarted all at once
+    for cmd, status in commands.network.run_commands(cmds, parallel=True):
+        ifname = os.path.basename(cmd[0])[len('net.'):]
+        errors.append("Couldn't restart network %s: %d" % (ifname, status))
 
-        if status != 0:
-            return (500, "Couldn't restart network %s: %d" % (ifname, status))
+    if errors:
+        return (500, "; ".join(errors))
 
     return (0, "")
 
 
+def _get_net_settings(lines):
+    """
+    Return the settings in a conf.d/net file as a dictionary of interface
+    name to its settings and a list of the other settings
+    """
+
+    interfaces = {}
+    other = []
+
+    settings = other
+    for line in lines:
+        line = line.rstrip('\n')
+
+        # Values can span lines, anything that doesn't start a new
+        # variable belongs to the previous one
+        match = _NET_VARIABLE.match(line)
+        if match:
+            if match.group(1):
+                settings = interfaces.setdefault(match.group(1), [])
+            else:
+                settings = other
+        elif not line.strip() or line.lstrip().startswith('#'):
+            continue
+
+        settings.append(line)
+
+    return interfaces, other
+
+
+def _get_restarts(old_settings, new_settings, ifaces):
+    """
+    Return the set of interfaces in 'ifaces' to restart, given the
+    settings before (None if there weren't any) and after the update
+    """
+
+    if old_settings is None:
+        return set(ifaces)
+
+    old_interfaces, old_other = old_settings
+    new_interfaces, new_other = new_settings
+
+    # Settings like 'modules' apply to every interface
+    if old_other != new_other:
+        return set(ifaces)
+
+    changed = commands.network.changed_settings(old_interfaces,
+            new_interfaces)
+    return set(ifaces) & set(changed)
+
+
 def get_hostname_file(hostname):
     """
     Update hostname on system
@@ -114,8 +186,9 @@ def _get_file_data_legacy(interfaces):
 
     ifaces = set()
 
-    network_data = '# Automatically generated, do not edit\n'
-    network_data += 'modules=( "ifconfig" )\n\n'
+    network_data = commands.network.FileData()
+    network_data.write('# Automatically generated, do not edit\n')
+    network_data.write('modules=( "ifconfig" )\n\n')
 
     ifnames = interfaces.keys()
     ifnames.sort()
@@ -129,17 +202,17 @@ def _get_file_data_legacy(interfaces):
         gateway4 = interface['gateway4']
         gateway6 = interface['gateway6']
 
-        network_data += 'config_%s=(\n' % ifname
+        network_data.write('config_%s=(\n' % ifname)
 
         for ip in ip4s:
-            network_data += '    "%s netmask %s"\n' % \
-                    (ip['address'], ip['netmask'])
+            network_data.write('    "%s netmask %s"\n' %
+                    (ip['address'], ip['netmask']))
 
         for ip in ip6s:
-            network_data += '    "%s/%s"\n' % \
-                    (ip['address'], ip['prefixlen'])
+            network_data.write('    "%s/%s"\n' %
+                    (ip['address'], ip['prefixlen']))
 
-        network_data += ')\n'
+        network_data.write(')\n')
 
         routes = []
         for route in interface['routes']:
@@ -152,14 +225,14 @@ def _get_file_data_legacy(interfaces):
             routes.append('default via %s' % gateway6)
 
         if routes:
-            network_data += 'routes_%s=(\n' % ifname
+            network_data.write('routes_%s=(\n' % ifname)
             for config in routes:
-                network_data += '    "%s"\n' % config
-            network_data += ')\n'
+                network_data.write('    "%s"\n' % config)
+            network_data.write(')\n')
 
         ifaces.add(ifname)
 
-    return network_data, ifaces
+    return network_data.getvalue(), ifaces
 
 
 def _get_file_data_openrc(interfaces):
@@ -169,8 +242,9 @@ def _get_file_data_openrc(interfaces):
 
     ifaces = set()
 
-    network_data = '# Automatically generated, do not edit\n'
-    network_data += 'modules="ifconfig"\n\n'
+    network_data = commands.network.FileData()
+    network_data.write('# Automatically generated, do not edit\n')
+    network_data.write('modules="ifconfig"\n\n')
 
     ifnames = interfaces.keys()
     ifnames.sort()
@@ -193,7 +267,8 @@ def _get_file_data_openrc(interfaces):
         for ip in ip6s:
             iface_data.append('%s/%s' % (ip['address'], ip['prefixlen']))
 
-        network_data += 'config_%s="%s"\n' % (ifname, '\n'.join(iface_data))
+        network_data.write('config_%s="%s"\n' %
+                           (ifname, '\n'.join(iface_data)))
 
         route_data = []
         for route in interface['routes']:
@@ -206,11 +281,12 @@ def _get_file_data_openrc(interfaces):
             route_data.append('default via %s' % gateway6)
 
         if route_data:
-            network_data += 'routes_%s="%s"\n' % (ifname, '\n'.join(route_data))
+            network_data.write('routes_%s="%s"\n' %
+                               (ifname, '\n'.join(route_data)))
 
         ifaces.add(ifname)
 
-    return network_data, ifaces
+    return network_data.getvalue(), ifaces
 
 
 def get_interface_files(interfaces, version):
@@ -0,0 +1,298 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#  Copyright (c) 2011 Openstack, LLC.
+#  All Rights Reserved.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License"); you may
+#     not use this file except in compliance with the License. You may obtain
+#     a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#     WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#     License for the specific language governing permissions and limitations
+#     under the License.
+#
+
+"""
+JSON background job plugin
+"""
+
+try:
+    import anyjson
+except ImportError:
+    try:
+        import simplejson as json
+    except ImportError:
+        import json
+
+    class anyjson(object):
+        """Fake anyjson module as a class"""
+
+        @staticmethod
+        def serialize(buf):
+            return json.dumps(buf)
+
+        @staticmethod
+        def deserialize(buf):
+            return json.loads(buf)
+
+import binascii
+import logging
+import os
+import threading
+import time
+
+import commands
+
+# Number of finished jobs to remember for 'jobstatus'
+JOB_KEEP = 32
+
+# Where jobs are saved so their status survives an agent restart
+JOB_STATE_FILE = '/var/lib/nova-agent/jobs.state'
+
+# Progress of a job that restarts the agent as its last step.  If the
+# agent restarts while a job is at this point, the job succeeded.
+RESTARTING = "restarting the agent"
+
+_current = threading.local()
+
+
+def set_progress(message):
+    """
+    Record progress for the background job running in this thread, if
+    any.  The message is returned by 'jobstatus' until the job finishes.
+    """
+
+    forward = getattr(_current, 'forward', None)
+    if forward:
+        forward(message)
+        return
+
+    job = getattr(_current, 'job', None)
+    if job:
+        job.progress = message
+        if job.runner:
+            job.runner._save()
+
+
+def forward_progress(func):
+    """
+    Pass progress messages set in this thread to 'func' instead, for
+    commands running in a worker process on behalf of a job
+    """
+
+    _current.forward = func
+
+
+class Job(object):
+
+    def __init__(self, cmd_name, arg):
+        self.job_id = binascii.hexlify(os.urandom(8))
+        self.cmd_name = cmd_name
+        self.arg = arg
+        self.progress = ''
+        self.result = None
+        self.started = time.time()
+        self.finished = None
+        self.thread = None
+        self.runner = None
+
+    def to_dict(self):
+        # The argument isn't saved, it can hold secrets
+        return {'cmd_name': self.cmd_name,
+                'progress': self.progress,
+                'result': self.result,
+                'started': self.started,
+                'finished': self.finished}
+
+    @classmethod
+    def from_dict(cls, job_id, data):
+        job = cls(data['cmd_name'], None)
+        job.job_id = job_id
+        job.progress = data['progress']
+        if data['result'] is not None:
+            job.result = tuple(data['result'])
+        job.started = data['started']
+        job.finished = data['finished']
+        return job
+
+
+class JobCommands(commands.CommandBase):
+    """
+    Runs commands in background threads and reports their status
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.job_keep = kwargs.get("job_keep", JOB_KEEP)
+        if kwargs.get("testmode", False):
+            self.state_file = kwargs.get("job_state_file")
+        else:
+            self.state_file = kwargs.get("job_state_file", JOB_STATE_FILE)
+
+        self._lock = threading.Lock()
+        self._jobs = {}
+
+        if self.state_file:
+            self._load()
+
+        commands.CommandBase._job_runner = self
+
+    def _load(self):
+        """
+        Load the jobs saved by a previous agent process.  Jobs that were
+        still running were cut short by the restart.
+        """
+
+        if not os.path.exists(self.state_file):
+            return
+
+        try:
+            f = open(self.state_file)
+            try:
+                state = anyjson.deserialize(f.read())
+            finally:
+                f.close()
+            jobs = [Job.from_dict(job_id, data)
+                    for job_id, data in state.iteritems()]
+        except Exception, e:
+            logging.warning("couldn't load %s: %s" % (self.state_file,
+                    str(e)))
+            return
+
+        for job in jobs:
+            if not job.finished:
+                if job.progress == RESTARTING:
+                    job.result = (0, "")
+                else:
+                    job.result = (500, "Interrupted by an agent restart")
+                job.finished = time.time()
+                logging.info("job %s ('%s') was running when the agent "
+                        "restarted, completed with code '%s'" % (
+                        job.job_id, job.cmd_name, job.result[0]))
+            self._jobs[job.job_id] = job
+
+        self._lock.acquire()
+        try:
+            self._prune()
+            self._write_state()
+        finally:
+            self._lock.release()
+
+    def _save(self):
+        self._lock.acquire()
+        try:
+            self._write_state()
+        finally:
+            self._lock.release()
+
+    def _write_state(self):
+        """Save the jobs to the state file.  Called with the lock held."""
+
+        if not self.state_file:
+            return
+
+        state = dict([(job_id, job.to_dict())
+                      for job_id, job in self._jobs.iteritems()])
+
+        tmp_file = '%s.%d.tmp~' % (self.state_file, os.getpid())
+        try:
+            dirname = os.path.dirname(self.state_file)
+            if not os.path.exists(dirname):
+                os.makedirs(dirname, 0700)
+
+            f = open(tmp_file, 'w')
+            try:
+                f.write(anyjson.serialize(state))
+            finally:
+                f.close()
+            os.rename(tmp_file, self.state_file)
+        except (IOError, OSError), e:
+            logging.warning("couldn't save %s: %s" % (self.state_file,
+                    str(e)))
+            if os.path.exists(tmp_file):
+                os.unlink(tmp_file)
+
+    def _prune(self):
+        """Forget about the oldest finished jobs"""
+
+        finished = [(job.finished, job_id)
+                    for job_id, job in self._jobs.iteritems()
+                    if job.finished]
+        finished.sort()
+
+        for job_finished, job_id in finished[:-self.job_keep]:
+            del self._jobs[job_id]
+
+    def _run(self, job):
+        _current.job = job
+
+        try:
+            result = self.run_command(job.cmd_name, job.arg)
+        except commands.CommandNotFoundError, e:
+            logging.warn(str(e))
+            result = (404, str(e))
+        except Exception, e:
+            logging.exception("Exception while running job %s (%r)" % (
+                    job.job_id, job.cmd_name))
+            result = (500, str(e))
+
+        logging.info("job %s ('%s') completed with code '%s', "
+                "message '%s'" % (job.job_id, job.cmd_name, result[0],
+                result[1]))
+
+        self._lock.acquire()
+        try:
+            job.result = result
+            job.finished = time.time()
+            self._prune()
+            self._write_state()
+        finally:
+            self._lock.release()
+
+        _current.job = None
+
+    def start(self, cmd_name, arg):
+        """
+        Start a command in a background thread and return its Job.  If
+        the same command with the same argument is already running,
+        return that job instead of starting another.
+        """
+
+        self._lock.acquire()
+        try:
+            for job in self._jobs.itervalues():
+                if not job.finished and job.cmd_name == cmd_name and \
+                        job.arg == arg:
+                    logging.info("'%s' already running as job %s" % (
+                            cmd_name, job.job_id))
+                    return job
+
+            job = Job(cmd_name, arg)
+            job.runner = self
+            self._jobs[job.job_id] = job
+            self._write_state()
+        finally:
+            self._lock.release()
+
+        logging.info("starting '%s' as job %s" % (cmd_name, job.job_id))
+
+        job.thread = threading.Thread(target=self._run, args=(job,))
+        job.thread.setDaemon(True)
+        job.thread.start()
+
+        return job
+
+    @commands.command_add('jobstatus')
+    def jobstatus_cmd(self, data):
+
+        job = self._jobs.get(data)
+        if not job:
+            return (404, "No such job '%s'" % data)
+
+        if not job.finished:
+            return (202, job.progress or "running")
+
+        return job.result
@@ -57,7 +57,7 @@ class ActivateCommand(commands.CommandBase):
 
         return translations.get(system)
 
-    @commands.command_add('kmsactivate')
+    @commands.command_add('kmsactivate', background=True)
     def activate_cmd(self, data):
 
         os_mod = self.detect_os()
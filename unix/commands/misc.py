@@ -31,7 +31,7 @@ class MiscCommands(commands.CommandBase):
 
     @commands.command_add('features')
     def features_cmd(self, data):
-        commands = ','.join(self.command_names())
+        commands = ','.join(self.command_names() + self.feature_names())
         return (0, commands)
 
     @commands.command_add('version')
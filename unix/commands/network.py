@@ -41,23 +41,31 @@ except ImportError:
 
 from cStringIO import StringIO
 import fcntl
+import hashlib
+import itertools
 import logging
 import os
 import platform
 import pyxenstore
 import re
 import socket
+import stat
+import subprocess
+import tempfile
 import time
 from ctypes import *
 
 import agentlib
+import backups
 import commands
+import jobs
 import debian.network
 import redhat.network
 import arch.network
 import suse.network
 import gentoo.network
 import freebsd.network
+import networkd.network
 
 
 XENSTORE_INTERFACE_PATH = "vm-data/networking"
@@ -66,6 +74,29 @@ DEFAULT_HOSTNAME = ''
 HOSTS_FILE = '/etc/hosts'
 RESOLV_CONF_FILE = '/etc/resolv.conf'
 
+# Records the SHA1, size, mtime and inode of the files we last wrote, so
+# unchanged files can be skipped without reading them
+FILE_STATE_FILE = '/var/lib/nova-agent/files.state'
+
+# Journal of the file update in progress, so it can be finished or undone
+# at startup if the agent or guest died part way through
+FILE_JOURNAL_FILE = '/var/lib/nova-agent/files.journal'
+
+# Matches the address at the start of a hosts file line
+_HOSTS_ADDRESS = re.compile(r'\s*([^\s#]*)')
+
+# Interfaces with more addresses than this have their secondary addresses
+# configured in bulk instead of as one alias interface each.  Can be
+# changed with the 'bulk_alias_threshold' option, a negative value
+# disables bulk configuration
+BULK_ALIAS_THRESHOLD = 8
+
+# Interfaces with more routes than this have them installed with one
+# batch command where the distro supports it, instead of one command per
+# route.  Can be changed with the 'batch_route_threshold' option, a
+# negative value disables batching
+BATCH_ROUTE_THRESHOLD = 8
+
 if os.uname()[0].lower() == 'freebsd':
     INTERFACE_LABELS = {"public": "xn0",
                         "private": "xn1"}
@@ -97,7 +128,8 @@ NETMASK_TO_PREFIXLEN = {
 class NetworkCommands(commands.CommandBase):
 
     def __init__(self, *args, **kwargs):
-        pass
+        if not kwargs.get("testmode", False):
+            recover_files()
 
     @staticmethod
     def detect_os():
@@ -125,22 +157,28 @@ class NetworkCommands(commands.CommandBase):
             if not system and os.path.exists('/etc/arch-release'):
                 system = 'arch'
 
-        if not system:
-            return None
+        if system:
+            system = system.lower()
+            global DEFAULT_HOSTNAME
+            DEFAULT_HOSTNAME = system
 
-        system = system.lower()
-        global DEFAULT_HOSTNAME
-        DEFAULT_HOSTNAME = system
+        # Guests where systemd-networkd manages the network are configured
+        # through it, whatever the distribution
+        if os.uname()[0] == "Linux" and networkd.network.is_running():
+            return networkd
 
         return translations.get(system)
 
-    @commands.command_add('resetnetwork')
+    @commands.command_add('resetnetwork', background=True, coalesce=True,
+            isolate=True)
     def resetnetwork_cmd(self, data):
 
         os_mod = self.detect_os()
         if not os_mod:
             raise SystemError("Couldn't figure out my OS")
 
+        jobs.set_progress("reading network configuration")
+
         xs_handle = pyxenstore.Handle()
 
         try:
@@ -275,10 +313,45 @@ class NetworkCommands(commands.CommandBase):
         #if not gateway4 and not gateway6:
         #    raise RuntimeError('No gateway found for public interface')
 
+        jobs.set_progress("configuring network")
+
         return os_mod.network.configure_network(hostname, config)
 
 
-def _get_etc_hosts(infile, interfaces, hostname):
+class FileData(object):
+    """
+    Builds up the contents of a file and joins it together once at the
+    end, instead of repeatedly concatenating strings or writing to a
+    StringIO and reading it back
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(data)
+
+    def writeline(self, line):
+        self._chunks.append(line)
+        self._chunks.append('\n')
+
+    def writelines(self, lines):
+        self._chunks.extend(lines)
+
+    def __len__(self):
+        return len(self._chunks)
+
+    def getvalue(self):
+        return ''.join(self._chunks)
+
+
+def _write_etc_hosts(infile, outfile, interfaces, hostname):
+    """
+    Write an updated copy of hosts file 'infile' to 'outfile'.  Lines for
+    the first IP of each interface are patched with the new hostname,
+    everything else is copied as is.
+    """
+
     ips = set()
     for interface in interfaces.itervalues():
         ip4s = interface['ip4s']
@@ -289,60 +362,81 @@ def _get_etc_hosts(infile, interfaces, hostname):
         if ip6s:
             ips.add(ip6s[0]['address'])
 
-    outfile = StringIO()
+    last = '\n'
+    if ips:
+        for line in infile:
+            if _HOSTS_ADDRESS.match(line).group(1) not in ips:
+                outfile.write(line)
+                last = line
+                continue
 
-    for line in infile:
-        line = line.strip()
+            line = line.strip()
 
-        if '#' in line:
-            config, comment = line.split('#', 1)
-            config = config.strip()
-            comment = '\t#' + comment
-        else:
-            config, comment = line, ''
-
-        parts = re.split('\s+', config)
-        if parts:
-            if parts[0] in ips:
-                confip = parts.pop(0)
-                if len(parts) == 1 and parts[0] != hostname:
-                    # Single hostname that differs, we replace that one
-                    print >> outfile, '# %s\t# Removed by nova-agent' % line
-                    print >> outfile, '%s\t%s%s' % (confip, hostname, comment)
-                elif len(parts) == 2 and len(
-                        filter(lambda h: '.' in h, parts)) == 1:
-                    # Two hostnames, one a hostname, one a domain name. Replace
-                    # the hostname
-                    hostnames = map(
-                            lambda h: ('.' in h) and h or hostname, parts)
-                    print >> outfile, '# %s\t# Removed by nova-agent' % line
-                    print >> outfile, '%s\t%s%s' % (confip,
-                            ' '.join(hostnames), comment)
-                else:
-                    # Don't know how to handle this line, so skip it
-                    print >> outfile, line
-
-                ips.remove(confip)
+            if '#' in line:
+                config, comment = line.split('#', 1)
+                config = config.strip()
+                comment = '\t#' + comment
             else:
-                print >> outfile, line
-        else:
-            print >> outfile, line
+                config, comment = line, ''
+
+            parts = config.split()
+            confip = parts.pop(0)
+            if len(parts) == 1 and parts[0] != hostname:
+                # Single hostname that differs, we replace that one
+                outfile.write('# %s\t# Removed by nova-agent\n' % line)
+                outfile.write('%s\t%s%s\n' % (confip, hostname, comment))
+            elif len(parts) == 2 and \
+                    len([h for h in parts if '.' in h]) == 1:
+                # Two hostnames, one a hostname, one a domain name. Replace
+                # the hostname
+                hostnames = [('.' in h) and h or hostname for h in parts]
+                outfile.write('# %s\t# Removed by nova-agent\n' % line)
+                outfile.write('%s\t%s%s\n' % (confip,
+                        ' '.join(hostnames), comment))
+            else:
+                # Don't know how to handle this line, so skip it
+                outfile.write(line + '\n')
+            last = '\n'
+
+            ips.remove(confip)
+            if not ips:
+                break
+
+    # Nothing left to patch in the rest of the file
+    outfile.writelines(infile)
 
     # Add public IPs we didn't manage to patch
+    if ips and not last.endswith('\n'):
+        outfile.write('\n')
     for ip in ips:
-        print >> outfile, '%s\t%s' % (ip, hostname)
+        outfile.write('%s\t%s\n' % (ip, hostname))
 
-    outfile.seek(0)
-    return outfile.read()
+
+def _get_etc_hosts(infile, interfaces, hostname):
+    outfile = FileData()
+    _write_etc_hosts(infile, outfile, interfaces, hostname)
+    return outfile.getvalue()
 
 
 def get_etc_hosts(interfaces, hostname):
-    if os.path.exists(HOSTS_FILE):
-        infile = open(HOSTS_FILE)
-    else:
-        infile = StringIO()
+    """
+    Return the path of the hosts file and a function writing the updated
+    version of it to a file object, to be passed to update_files().  A
+    big hosts file is streamed through instead of held in memory.
+    """
+
+    def write_etc_hosts(outfile):
+        if os.path.exists(HOSTS_FILE):
+            infile = open(HOSTS_FILE)
+        else:
+            infile = StringIO()
+
+        try:
+            _write_etc_hosts(infile, outfile, interfaces, hostname)
+        finally:
+            infile.close()
 
-    return HOSTS_FILE, _get_etc_hosts(infile, interfaces, hostname)
+    return HOSTS_FILE, write_etc_hosts
 
 
 def get_gateways(interfaces):
@@ -369,6 +463,42 @@ def get_gateways(interfaces):
     return gateway4, gateway6
 
 
+def use_bulk_aliases(interface):
+    """
+    Return True if the secondary addresses of 'interface' should be
+    configured in bulk
+    """
+
+    threshold = commands.init_arg("bulk_alias_threshold",
+            BULK_ALIAS_THRESHOLD)
+    if threshold < 0:
+        return False
+
+    return len(interface['ip4s']) + len(interface['ip6s']) > threshold
+
+
+def use_batch_routes(interface):
+    """
+    Return True if the routes of 'interface' should be installed with
+    one batch command
+    """
+
+    threshold = commands.init_arg("batch_route_threshold",
+            BATCH_ROUTE_THRESHOLD)
+    if threshold < 0:
+        return False
+
+    return len(interface['routes']) > threshold
+
+
+def get_prefixlen(ip4):
+    """Return the prefix length of an IPv4 address or route entry"""
+
+    if 'prefixlen' in ip4:
+        return ip4['prefixlen']
+    return NETMASK_TO_PREFIXLEN[ip4['netmask']]
+
+
 def get_nameservers(interfaces):
     for interface in interfaces.itervalues():
         for nameserver in interface['dns']:
@@ -376,28 +506,227 @@ def get_nameservers(interfaces):
 
 
 def get_resolv_conf(interfaces):
-    resolv_data = ''
+    resolv_data = FileData()
     for nameserver in get_nameservers(interfaces):
-        resolv_data += 'nameserver %s\n' % nameserver
+        resolv_data.writeline('nameserver %s' % nameserver)
 
     if not resolv_data:
         return None, None
 
     return RESOLV_CONF_FILE, '# Automatically generated, do not edit\n' + \
-                             resolv_data
+                             resolv_data.getvalue()
 
 
 def sethostname(hostname):
     agentlib.sethostname(hostname)
 
 
-def stage_files(update_files):
+def changed_settings(old_settings, new_settings):
+    """
+    Return the sorted keys of two dictionaries of settings whose values
+    differ, including ones only in one of them
+    """
+
+    changed = [key for key in set(old_settings) | set(new_settings)
+               if old_settings.get(key) != new_settings.get(key)]
+    changed.sort()
+    return changed
+
+
+def run_commands(cmds, parallel=False):
+    """
+    Run each command (a list of arguments), one after another or all at
+    once if 'parallel' is set.  Every command is run regardless of
+    failures.  Returns a list of (command, status) for the ones that
+    failed.
+    """
+
+    def _wait(cmd, p, output):
+        if p is None:
+            return -1
+
+        logging.debug('waiting on pid %d' % p.pid)
+        status = p.wait()
+        logging.debug('"%s" exited with code %d' % (' '.join(cmd), status))
+        if status != 0:
+            output.seek(0)
+            logging.error('"%s" failed: %s' % (' '.join(cmd),
+                    output.read().strip()))
+        output.close()
+        return status
+
+    started = []
+    statuses = []
+    for cmd in cmds:
+        logging.debug('executing %s' % ' '.join(cmd))
+
+        # Output goes to a file rather than a pipe so processes running
+        # in parallel can't block each other on a full pipe
+        output = tempfile.TemporaryFile()
+        try:
+            p = subprocess.Popen(cmd, stdin=subprocess.PIPE, stdout=output,
+                    stderr=subprocess.STDOUT, env={})
+            p.stdin.close()
+        except OSError, e:
+            output.close()
+            logging.error('couldn\'t execute %s: %s' % (cmd[0], str(e)))
+            p = None
+
+        if parallel:
+            started.append((cmd, p, output))
+        else:
+            statuses.append((cmd, _wait(cmd, p, output)))
+
+    for cmd, p, output in started:
+        statuses.append((cmd, _wait(cmd, p, output)))
+
+    return [(cmd, status) for cmd, status in statuses if status != 0]
+
+
+def _read_file(filepath):
+    f = open(filepath)
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def _load_file_state():
+    if not os.path.exists(FILE_STATE_FILE):
+        return {}
+
+    try:
+        return anyjson.deserialize(_read_file(FILE_STATE_FILE))
+    except Exception, e:
+        logging.warning("couldn't load %s: %s" % (FILE_STATE_FILE, str(e)))
+        return {}
+
+
+def _save_file_state(state):
+    tmp_file = '%s.%d.tmp~' % (FILE_STATE_FILE, os.getpid())
+    try:
+        dirname = os.path.dirname(FILE_STATE_FILE)
+        if not os.path.exists(dirname):
+            os.makedirs(dirname, 0700)
+
+        f = open(tmp_file, 'w')
+        try:
+            f.write(anyjson.serialize(state))
+        finally:
+            f.close()
+        os.rename(tmp_file, FILE_STATE_FILE)
+    except (IOError, OSError), e:
+        logging.warning("couldn't save %s: %s" % (FILE_STATE_FILE, str(e)))
+        if os.path.exists(tmp_file):
+            os.unlink(tmp_file)
+
+
+def _file_unchanged(filepath, digest, state):
+    """
+    Return True if 'filepath' is still the file we last wrote and that
+    had the SHA1 'digest'
+    """
+
+    entry = state.get(filepath)
+    if not entry or entry['sha1'] != digest:
+        return False
+
+    try:
+        st = os.stat(filepath)
+    except OSError:
+        return False
+
+    return st.st_size == entry['size'] and st.st_mtime == entry['mtime'] \
+            and st.st_ino == entry['inode']
+
+
+class _DigestFile(object):
+    """
+    Passes writes through to a file object, keeping a SHA1 of the data
+    """
+
+    def __init__(self, f):
+        self.f = f
+        self.sha1 = hashlib.sha1()
+
+    def write(self, data):
+        self.sha1.update(data)
+        self.f.write(data)
+
+    def writelines(self, lines):
+        lines = iter(lines)
+        while True:
+            data = ''.join(itertools.islice(lines, 1024))
+            if not data:
+                break
+            self.write(data)
+
+
+def _same_contents(filepath1, filepath2, blocksize=65536):
+    """
+    Return True if both files have the same contents, comparing them a
+    block at a time so neither has to be held in memory
+    """
+
+    if os.path.getsize(filepath1) != os.path.getsize(filepath2):
+        return False
+
+    f1 = open(filepath1)
+    try:
+        f2 = open(filepath2)
+        try:
+            while True:
+                data1 = f1.read(blocksize)
+                if data1 != f2.read(blocksize):
+                    return False
+                if not data1:
+                    return True
+        finally:
+            f2.close()
+    finally:
+        f1.close()
+
+
+def _mode_unchanged(filepath, mode):
+    try:
+        return stat.S_IMODE(os.stat(filepath).st_mode) == mode
+    except OSError:
+        return False
+
+
+def stage_files(update_files, modes=None):
+    """
+    Write out new versions of files next to the current ones.  The data
+    for a file is either a string or a function that writes it to the
+    file object it's passed.  Files are mode 0644 unless given in
+    'modes'.  Files that are unchanged are removed from 'update_files'.
+    Returns the SHA1 of every file, to be passed to move_files().
+    """
+
+    if modes is None:
+        modes = {}
+
     tmp_suffix = '%d.tmp~' % os.getpid()
+    state = _load_file_state()
+    digests = {}
+
+    # Staged files are removed at startup if we don't get to move_files()
+    if update_files:
+        _write_journal({'state': 'staging',
+                        'tmp_suffix': tmp_suffix,
+                        'update': update_files.keys(),
+                        'remove': []})
 
     for filepath, data in update_files.items():
-        if os.path.exists(filepath):
-            # If the data is the same, skip it, nothing to do
-            if data == open(filepath).read():
+        mode = modes.get(filepath, 0644)
+
+        if not callable(data):
+            digests[filepath] = hashlib.sha1(data).hexdigest()
+
+            # If the data and mode are the same, skip it, nothing to do
+            if _mode_unchanged(filepath, mode) and \
+                    (_file_unchanged(filepath, digests[filepath], state) or
+                     data == _read_file(filepath)):
                 logging.info("skipping %s (no changes)" % filepath)
                 del update_files[filepath]
                 continue
@@ -407,43 +736,243 @@ def stage_files(update_files):
         tmp_file = '%s.%s' % (filepath, tmp_suffix)
         f = open(tmp_file, 'w')
         try:
-            f.write(data)
+            if callable(data):
+                outfile = _DigestFile(f)
+                data(outfile)
+                digests[filepath] = outfile.sha1.hexdigest()
+            else:
+                f.write(data)
+            f.flush()
+
+            # Streamed data can only be compared once it's written
+            unchanged = callable(data) and \
+                    _mode_unchanged(filepath, mode) and \
+                    (_file_unchanged(filepath, digests[filepath], state) or
+                     _same_contents(tmp_file, filepath))
+
+            # Only files that will be moved into place need syncing
+            if not unchanged:
+                os.fsync(f.fileno())
             f.close()
 
-            os.chown(tmp_file, 0, 0)
-            os.chmod(tmp_file, 0644)
+            if not unchanged:
+                os.chown(tmp_file, 0, 0)
+                os.chmod(tmp_file, mode)
         except:
+            f.close()
             os.unlink(tmp_file)
             raise
 
+        if unchanged:
+            logging.info("skipping %s (no changes)" % filepath)
+            os.unlink(tmp_file)
+            del update_files[filepath]
 
-def move_files(update_files, remove_files=None):
-    if not remove_files:
-        remove_files = set()
+    return digests
 
-    tmp_suffix = '%d.tmp~' % os.getpid()
-    bak_suffix = '%d.bak~' % time.time()
 
-    for filepath in update_files.iterkeys():
-        if os.path.exists(filepath):
+def _record_file_state(digests, remove_files):
+    state = _load_file_state()
+
+    for filepath, digest in digests.iteritems():
+        try:
+            st = os.stat(filepath)
+        except OSError:
+            state.pop(filepath, None)
+            continue
+        state[filepath] = {'sha1': digest,
+                           'size': st.st_size,
+                           'mtime': st.st_mtime,
+                           'inode': st.st_ino}
+
+    for filepath in remove_files:
+        state.pop(filepath, None)
+
+    _save_file_state(state)
+
+
+def _fsync_dir(dirname):
+    """Make renames and removals in 'dirname' durable"""
+
+    try:
+        fd = os.open(dirname, os.O_RDONLY)
+    except OSError:
+        return
+
+    try:
+        try:
+            os.fsync(fd)
+        except OSError:
+            # Not every filesystem can sync a directory
+            pass
+    finally:
+        os.close(fd)
+
+
+def _write_journal(journal):
+    """
+    Durably replace the journal.  Returns False if it couldn't be written,
+    in which case the update goes ahead without one.
+    """
+
+    dirname = os.path.dirname(FILE_JOURNAL_FILE)
+    tmp_file = '%s.tmp~' % FILE_JOURNAL_FILE
+    try:
+        if not os.path.exists(dirname):
+            os.makedirs(dirname, 0700)
+
+        f = open(tmp_file, 'w')
+        try:
+            f.write(anyjson.serialize(journal))
+            f.flush()
+            os.fsync(f.fileno())
+        finally:
+            f.close()
+
+        os.rename(tmp_file, FILE_JOURNAL_FILE)
+    except (IOError, OSError), e:
+        logging.warning("couldn't write %s: %s" % (FILE_JOURNAL_FILE,
+                str(e)))
+        return False
+
+    _fsync_dir(dirname)
+    return True
+
+
+def _clear_journal():
+    if os.path.exists(FILE_JOURNAL_FILE):
+        os.unlink(FILE_JOURNAL_FILE)
+
+
+def _commit_files(update, remove, tmp_suffix, bak_suffix):
+    """
+    Move staged files into place and back up the files being replaced or
+    removed.  Files that were already handled are skipped, so this can be
+    run again to finish an interrupted commit.
+    """
+
+    dirnames = set()
+
+    for filepath in update:
+        tmp_file = '%s.%s' % (filepath, tmp_suffix)
+        bak_file = '%s.%s' % (filepath, bak_suffix)
+        if not os.path.exists(tmp_file):
+            # Already moved into place
+            continue
+
+        if os.path.exists(filepath) and not os.path.exists(bak_file):
             # Move previous version to a backup
             logging.info("backing up %s (%s)" % (filepath, bak_suffix))
-            os.rename(filepath, '%s.%s' % (filepath, bak_suffix))
+            os.rename(filepath, bak_file)
 
         logging.info("updating %s" % filepath)
         try:
-            os.rename('%s.%s' % (filepath, tmp_suffix), filepath)
+            os.rename(tmp_file, filepath)
         except:
             # Move backup file back so there's some sort of configuration
-            os.rename('%s.%s' % (filepath, bak_suffix), filepath)
+            if os.path.exists(bak_file):
+                os.rename(bak_file, filepath)
             raise
 
-    for filepath in remove_files:
+        dirnames.add(os.path.dirname(filepath))
+
+    for filepath in remove:
+        if not os.path.exists(filepath):
+            continue
+
         logging.info("moving %s (%s)" % (filepath, bak_suffix))
+        os.rename(filepath, '%s.%s' % (filepath, bak_suffix))
+
+        dirnames.add(os.path.dirname(filepath))
+
+    for dirname in dirnames:
+        _fsync_dir(dirname)
+
+
+def recover_files():
+    """
+    Finish or undo a file update that was interrupted, using the journal.
+    Updates that were still being staged are undone, ones that were being
+    moved into place are finished.
+    """
+
+    if not os.path.exists(FILE_JOURNAL_FILE):
+        return
+
+    try:
+        journal = anyjson.deserialize(_read_file(FILE_JOURNAL_FILE))
+    except Exception, e:
+        logging.error("couldn't read %s: %s" % (FILE_JOURNAL_FILE, str(e)))
+        _clear_journal()
+        return
+
+    tmp_suffix = journal['tmp_suffix']
+    if journal['state'] == 'staging':
+        logging.info("undoing interrupted update of %s" %
+                ', '.join(journal['update']))
+        for filepath in journal['update']:
+            tmp_file = '%s.%s' % (filepath, tmp_suffix)
+            if os.path.exists(tmp_file):
+                os.unlink(tmp_file)
+    else:
+        logging.info("finishing interrupted update of %s" %
+                ', '.join(journal['update'] + journal['remove']))
+        _commit_files(journal['update'], journal['remove'], tmp_suffix,
+                journal['bak_suffix'])
+
+    _clear_journal()
+
+
+def move_files(update_files, remove_files=None, digests=None):
+    """
+    Move files staged by stage_files() into place, backing up the old
+    versions, and back up then remove 'remove_files'.  The staged files
+    are synced and the moves are journaled first, so an interrupted
+    update is finished by recover_files().  Old backups are pruned
+    afterwards.  'digests', as returned by stage_files(), is recorded so
+    the files can be skipped cheaply next time if they haven't changed.
+    """
+
+    if not remove_files:
+        remove_files = set()
+
+    tmp_suffix = '%d.tmp~' % os.getpid()
+    bak_suffix = '%d.bak~' % time.time()
+
+    update = update_files.keys()
+    remove = list(remove_files)
+
+    if update or remove:
+        # The staged files themselves were synced by stage_files()
+        for dirname in set([os.path.dirname(filepath)
+                            for filepath in update]):
+            _fsync_dir(dirname)
+
+        _write_journal({'state': 'committing',
+                        'tmp_suffix': tmp_suffix,
+                        'bak_suffix': bak_suffix,
+                        'update': update,
+                        'remove': remove})
+
+        _commit_files(update, remove, tmp_suffix, bak_suffix)
+
+    _clear_journal()
+
+    if digests is not None:
+        _record_file_state(digests, remove_files)
+
+    backups.prune_backups(update + remove)
+
 
-        os.rename(filepath, '%s.%s' % (filepath, bak_file))
+def update_files(update_files, remove_files=None, modes=None):
+    """
+    Write out files and remove 'remove_files'.  Returns the paths of the
+    files that actually changed.
+    """
 
+    digests = stage_files(update_files, modes)
+    move_files(update_files, remove_files, digests)
 
-def update_files(update_files, remove_files=None):
-    stage_files(update_files)
-    move_files(update_files, remove_files)
+    changed = update_files.keys()
+    changed.sort()
+    return changed
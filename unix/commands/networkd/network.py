@@ -0,0 +1,222 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#  Copyright (c) 2011 Openstack, LLC.
+#  All Rights Reserved.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License"); you may
+#     not use this file except in compliance with the License. You may obtain
+#     a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#     WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#     License for the specific language governing permissions and limitations
+#     under the License.
+#
+
+"""
+systemd-networkd network helper module
+"""
+
+# Guests running systemd-networkd (whatever the distribution) use:
+# - 1 .network unit per interface in /etc/systemd/network, matched by MAC
+# - multiple IPs per interface
+# - routes are per interface
+# - gateways are per interface
+# - DNS is per interface, and in resolv.conf unless systemd-resolved
+#   manages it
+#
+# The units are applied with 'networkctl reload' and 'reconfigure' of the
+# links whose unit changed, instead of restarting the network.
+
+import glob
+import os
+import subprocess
+import logging
+
+import commands.network
+
+HOSTNAME_FILE = "/etc/hostname"
+NETWORK_DIR = "/etc/systemd/network"
+
+# networkd sorts the units in /etc, /run and /lib together by name and
+# uses the first one that matches a link.  Ours need to come before the
+# distro's and ones generated by netplan or cloud-init, like
+# /run/systemd/network/10-netplan-<if>.network
+UNIT_FILE = "00-nova-agent-%s.network"
+
+
+def is_running():
+    """
+    Return True if systemd-networkd is managing the network
+    """
+
+    if not os.path.isdir(NETWORK_DIR):
+        return False
+
+    devnull = open(os.devnull, 'w')
+    try:
+        status = subprocess.call(['systemctl', 'is-active', '--quiet',
+                                  'systemd-networkd'],
+                                 stdout=devnull, stderr=devnull, env={})
+    except OSError:
+        # No systemctl, so no systemd
+        return False
+    finally:
+        devnull.close()
+
+    return status == 0
+
+
+def configure_network(hostname, interfaces):
+    update_files = {}
+
+    unit_files = {}
+    for filename, data in get_interface_files(interfaces).iteritems():
+        filepath = os.path.join(NETWORK_DIR, filename)
+        unit_files[filepath] = _get_unit_ifname(filename)
+        update_files[filepath] = data
+
+    # Remove units for interfaces that are no longer configured
+    remove_files = set()
+    for filepath in glob.glob(os.path.join(NETWORK_DIR, UNIT_FILE % '*')):
+        if filepath not in update_files:
+            unit_files[filepath] = _get_unit_ifname(
+                    os.path.basename(filepath))
+            remove_files.add(filepath)
+
+    # Generate new hostname file
+    data = get_hostname_file(hostname)
+    update_files[HOSTNAME_FILE] = data
+
+    # Generate new /etc/resolv.conf file, unless systemd-resolved owns it
+    # and picks up the DNS servers from the units
+    filepath, data = commands.network.get_resolv_conf(interfaces)
+    if data and not os.path.islink(filepath):
+        update_files[filepath] = data
+
+    # Generate new /etc/hosts file
+    filepath, data = commands.network.get_etc_hosts(interfaces, hostname)
+    update_files[filepath] = data
+
+    # Write out new files
+    changed = commands.network.update_files(update_files, remove_files)
+
+    errors = []
+
+    # Set hostname
+    try:
+        commands.network.sethostname(hostname)
+    except Exception, e:
+        logging.error("Couldn't sethostname(): %s" % str(e))
+        errors.append("Couldn't set hostname: %s" % str(e))
+
+    ifnames = []
+    for filepath in list(changed) + list(remove_files):
+        ifname = unit_files.get(filepath)
+        if ifname and os.path.exists('/sys/class/net/%s' % ifname):
+            ifnames.append(ifname)
+    ifnames.sort()
+
+    if ifnames:
+        errors.extend(_apply_units(ifnames))
+
+    if errors:
+        return (500, "; ".join(errors))
+
+    return (0, "")
+
+
+def _apply_units(ifnames):
+    """
+    Have networkd reload its units and reconfigure the links in
+    'ifnames'.  Returns a list of errors.
+    """
+
+    # Depending on the systemd release, 'networkctl reload' either
+    # reconfigures the links whose unit changed or only reads the units,
+    # so the changed links are always reconfigured explicitly too
+    failed = commands.network.run_commands([['networkctl', 'reload']])
+    if not failed:
+        failed = commands.network.run_commands(
+                [['networkctl', 'reconfigure'] + ifnames])
+        return ["Couldn't reconfigure %s: %d" % (' '.join(ifnames), status)
+                for cmd, status in failed]
+
+    # systemd before 244 can only pick up changes with a restart
+    logging.info('networkctl reload failed, restarting systemd-networkd')
+    failed = commands.network.run_commands(
+            [['systemctl', 'restart', 'systemd-networkd']])
+    return ["Couldn't restart systemd-networkd: %d" % status
+            for cmd, status in failed]
+
+
+def get_hostname_file(hostname):
+    return hostname + '\n'
+
+
+def _get_unit_ifname(filename):
+    """
+    Return the interface name from one of our unit file names
+    """
+
+    prefix, suffix = UNIT_FILE.split('%s')
+    return filename[len(prefix):-len(suffix)]
+
+
+def _get_unit_data(ifname, interface):
+    """
+    Return the data for the .network unit for an interface
+    """
+
+    unit_data = commands.network.FileData()
+    unit_data.writeline('# Automatically generated, do not edit')
+    unit_data.writeline('[Match]')
+    unit_data.writeline('MACAddress=%s' % interface['mac'])
+    unit_data.writeline('')
+    unit_data.writeline('[Network]')
+    unit_data.writeline('Description=%s' % ifname)
+    unit_data.writeline('DHCP=no')
+
+    for ip4 in interface['ip4s']:
+        unit_data.writeline('Address=%s/%s' % (ip4['address'],
+                commands.network.get_prefixlen(ip4)))
+
+    if interface['ip6s']:
+        # Addresses are static, don't pick up others from router
+        # advertisements
+        unit_data.writeline('IPv6AcceptRA=no')
+
+    for ip6 in interface['ip6s']:
+        unit_data.writeline('Address=%(address)s/%(prefixlen)s' % ip6)
+
+    if interface['gateway4']:
+        unit_data.writeline('Gateway=%s' % interface['gateway4'])
+    if interface['gateway6']:
+        unit_data.writeline('Gateway=%s' % interface['gateway6'])
+
+    for nameserver in interface.get('dns', []):
+        unit_data.writeline('DNS=%s' % nameserver)
+
+    for route in interface['routes']:
+        unit_data.writeline('')
+        unit_data.writeline('[Route]')
+        unit_data.writeline('Destination=%s/%s' % (route['network'],
+                commands.network.get_prefixlen(route)))
+        unit_data.writeline('Gateway=%(gateway)s' % route)
+
+    return unit_data.getvalue()
+
+
+def get_interface_files(interfaces):
+    """
+    Return a dictionary of unit file name to data for the interfaces
+    """
+
+    update_files = {}
+    for ifname, interface in interfaces.iteritems():
+        update_files[UNIT_FILE % ifname] = _get_unit_data(ifname, interface)
+
+    return update_files
@@ -25,6 +25,7 @@ import binascii
 import logging
 import os
 import subprocess
+import threading
 import time
 
 from Crypto.Cipher import AES
@@ -61,6 +62,91 @@ class PasswordError(Exception):
         return self.response
 
 
+# Number of precomputed keypairs to keep ready for 'keyinit'
+KEYPAIR_POOL_SIZE = 4
+# Pause between computing keypairs so refilling the pool doesn't get in
+# the way of handling requests
+KEYPAIR_REFILL_DELAY = 0.05
+
+
+# Number of key exchange sessions to remember, and for how long
+KEY_SESSIONS = 16
+KEY_SESSION_TTL = 300
+
+
+class KeyPairPool(object):
+    """
+    Pool of precomputed (private key, public key) pairs.  Each pair is
+    only ever handed out once.  The pool is filled and refilled by a
+    background thread once start() is called.
+    """
+
+    def __init__(self, make_keypair, size=KEYPAIR_POOL_SIZE):
+        self.make_keypair = make_keypair
+        self.size = size
+
+        self._lock = threading.Lock()
+        self._pairs = []
+        self._wanted = threading.Event()
+        self._thread = None
+
+    def _refill(self):
+        while True:
+            self._wanted.wait()
+            self._wanted.clear()
+
+            while len(self._pairs) < self.size:
+                try:
+                    pair = self.make_keypair()
+                except Exception, e:
+                    logging.error("Couldn't precompute keypair: %s" % str(e))
+                    break
+
+                self._lock.acquire()
+                try:
+                    self._pairs.append(pair)
+                    full = len(self._pairs) >= self.size
+                finally:
+                    self._lock.release()
+
+                if not full:
+                    time.sleep(KEYPAIR_REFILL_DELAY)
+
+    def start(self):
+        """Start the thread that keeps the pool filled"""
+
+        if self._thread:
+            return
+
+        self._thread = threading.Thread(target=self._refill)
+        self._thread.setDaemon(True)
+        self._thread.start()
+        self._wanted.set()
+
+    def available(self):
+        return len(self._pairs)
+
+    def get(self):
+        """
+        Return a keypair, computing one right away if the pool is empty
+        """
+
+        self._lock.acquire()
+        try:
+            if self._pairs:
+                pair = self._pairs.pop(0)
+            else:
+                pair = None
+        finally:
+            self._lock.release()
+
+        self._wanted.set()
+
+        if pair is None:
+            pair = self.make_keypair()
+        return pair
+
+
 class PasswordCommands(commands.CommandBase):
     """
     Class for password related commands
@@ -73,6 +159,32 @@ class PasswordCommands(commands.CommandBase):
         self.kwargs = {}
         self.kwargs.update(kwargs)
 
+        pool_size = kwargs.get("keypair_pool_size", KEYPAIR_POOL_SIZE)
+        if pool_size:
+            self.keypair_pool = KeyPairPool(self._make_keypair, pool_size)
+        else:
+            self.keypair_pool = None
+
+        self.key_sessions = kwargs.get("key_sessions", KEY_SESSIONS)
+        self.key_session_ttl = kwargs.get("key_session_ttl",
+                KEY_SESSION_TTL)
+
+        self._key_lock = threading.Lock()
+        # Set when a session is added, so the expiry thread rechecks
+        self._key_added = threading.Event()
+        # session id -> (expiration time, AES key)
+        self._aes_keys = {}
+        # Session used by 'password' requests that don't name one
+        self._last_session = None
+
+    def start_threads(self):
+        if self.keypair_pool:
+            self.keypair_pool.start()
+
+        thread = threading.Thread(target=self._expire_keys_loop)
+        thread.setDaemon(True)
+        thread.start()
+
     def _mod_exp(self, num, exp, mod):
         result = 1
         while exp > 0:
@@ -96,6 +208,10 @@ class PasswordCommands(commands.CommandBase):
 
         return self._mod_exp(self.base, private_key, self.prime)
 
+    def _make_keypair(self):
+        private_key = self._make_private_key()
+        return (private_key, self._dh_compute_public_key(private_key))
+
     def _dh_compute_shared_key(self, public_key, private_key):
         """
         Given public and private keys, compute the shared key
@@ -122,33 +238,134 @@ class PasswordCommands(commands.CommandBase):
 
         return (aes_key, aes_iv)
 
-    def _decrypt_password(self, aes_key, data):
+    def _decrypt_password(self, aes, data):
+
+        # Decrypt into a buffer we can wipe afterwards, so the only copy
+        # of the plaintext left behind is the password we return
+        passwd = bytearray(len(data))
+        try:
+            try:
+                aes.decrypt(data, output=passwd)
+            except TypeError:
+                # Older PyCrypto can't decrypt into a buffer.  The string
+                # it returns can't be wiped, so a copy of the plaintext
+                # stays in memory until it's reused.
+                passwd[:] = aes.decrypt(data)
+
+            # Check the PKCS#7 padding without bailing out early, so the
+            # time taken doesn't depend on where the padding is wrong
+            cut_off_sz = passwd and passwd[-1] or 0
+            bad = int(len(passwd) < 16 or len(passwd) % 16 != 0 or
+                    cut_off_sz == 0 or cut_off_sz > 16)
+            for i in xrange(1, min(16, len(passwd)) + 1):
+                # 0xff for the padding bytes, 0 for the rest
+                mask = ((i - cut_off_sz - 1) >> 8) & 0xff
+                bad |= (passwd[-i] ^ cut_off_sz) & mask
+            if bad:
+                raise PasswordError((500, "Invalid password data received"))
+
+            # A slice would be another bytearray left unwiped
+            return str(buffer(passwd, 0, len(passwd) - cut_off_sz))
+        finally:
+            passwd[:] = bytearray(len(passwd))
+
+    def _add_key(self, session, aes_key):
+        """
+        Remember the AES key for a key exchange session, forgetting
+        about expired and the oldest sessions
+        """
+
+        now = time.time()
+        entry = (now + self.key_session_ttl, aes_key)
+
+        self._key_lock.acquire()
+        try:
+            self._aes_keys[session] = entry
+            self._last_session = session
+            self._expire_keys(now)
+        finally:
+            self._key_lock.release()
+
+        self._key_added.set()
 
-        aes = AES.new(aes_key[0], AES.MODE_CBC, aes_key[1])
-        passwd = aes.decrypt(data)
+    def _expire_keys(self, now):
+        """
+        Forget about expired sessions, and the oldest ones if there are
+        too many.  Returns when the next session expires, or None if
+        there are none left.  Called with the key lock held.
+        """
 
-        cut_off_sz = ord(passwd[len(passwd) - 1])
-        if cut_off_sz > 16 or len(passwd) < 16:
-            raise PasswordError((500, "Invalid password data received"))
+        sessions = [(entry[0], sid) for sid, entry in
+                    self._aes_keys.iteritems()]
+        sessions.sort()
+        for expires, sid in sessions:
+            if expires > now and len(self._aes_keys) <= self.key_sessions:
+                return expires
+            del self._aes_keys[sid]
+            if sid == self._last_session:
+                self._last_session = None
 
-        passwd = passwd[: - cut_off_sz]
+        return None
 
-        return passwd
+    def _expire_keys_loop(self):
+        """
+        Drop sessions as soon as they expire, instead of leaving their
+        keys in memory until the next key exchange
+        """
+
+        while True:
+            self._key_added.clear()
+
+            now = time.time()
+            self._key_lock.acquire()
+            try:
+                expires = self._expire_keys(now)
+            finally:
+                self._key_lock.release()
+
+            if expires is None:
+                self._key_added.wait()
+            else:
+                self._key_added.wait(expires - now)
+
+    def _get_key(self, session=None):
+        """
+        Return the AES key for a session, or for the most recent session
+        if none is given.  Returns None if there's no such session or it
+        has expired.
+        """
 
-    def _decode_password(self, data):
+        self._key_lock.acquire()
+        try:
+            if session is None:
+                session = self._last_session
+            entry = self._aes_keys.get(session)
+            if not entry:
+                return None
+            expires, aes_key = entry
+            if expires <= time.time():
+                del self._aes_keys[session]
+                return None
+            return aes_key
+        finally:
+            self._key_lock.release()
+
+    def _decode_password(self, data, session=None):
 
         try:
             real_data = base64.b64decode(data)
         except Exception:
             raise PasswordError((500, "Couldn't decode base64 data"))
 
-        try:
-            aes_key = self.aes_key
-        except AttributeError:
+        aes_key = self._get_key(session)
+        if not aes_key:
             raise PasswordError((500, "Password without key exchange"))
 
         try:
-            passwd = self._decrypt_password(aes_key, real_data)
+            # A CBC cipher keeps chaining state, so each password needs
+            # a new one
+            aes = AES.new(aes_key[0], AES.MODE_CBC, aes_key[1])
+            passwd = self._decrypt_password(aes, real_data)
         except PasswordError, e:
             raise e
         except Exception, e:
@@ -164,15 +381,22 @@ class PasswordCommands(commands.CommandBase):
         # Make sure there are no newlines at the end
         set_password('root', passwd.strip('\n'))
 
-    def _wipe_key(self):
+    def _wipe_key(self, session=None):
         """
-        Remove key from a previous keyinit command
+        Remove key from a previous keyinit command.  All keys are removed
+        if no session is given.
         """
 
+        self._key_lock.acquire()
         try:
-            del self.aes_key
-        except AttributeError:
-            pass
+            if session is None:
+                self._aes_keys.clear()
+            else:
+                self._aes_keys.pop(session, None)
+            if session is None or session == self._last_session:
+                self._last_session = None
+        finally:
+            self._key_lock.release()
 
     @commands.command_add('keyinit')
     def keyinit_cmd(self, data):
@@ -184,13 +408,18 @@ class PasswordCommands(commands.CommandBase):
         # we'll make sure to always convert it to long.
         remote_public_key = long(data)
 
-        my_private_key = self._make_private_key()
-        my_public_key = self._dh_compute_public_key(my_private_key)
+        if self.keypair_pool:
+            my_private_key, my_public_key = self.keypair_pool.get()
+        else:
+            my_private_key, my_public_key = self._make_keypair()
 
         shared_key = str(self._dh_compute_shared_key(remote_public_key,
                 my_private_key))
 
-        self.aes_key = self._compute_aes_key(shared_key)
+        # Our public key is never reused, so it doubles as the session
+        # id that 'password' can pass back to pick this key
+        self._add_key(str(my_public_key),
+                self._compute_aes_key(shared_key))
 
         # The key needs to be a string response right now
         return ("D0", str(my_public_key))
@@ -198,13 +427,27 @@ class PasswordCommands(commands.CommandBase):
     @commands.command_add('password')
     def password_cmd(self, data):
 
-        try:
-            passwd = self._decode_password(data)
-            self._change_password(passwd)
-        except PasswordError, e:
-            return e.get_response()
+        # Either just the encrypted password, which uses the key from
+        # the latest 'keyinit', or a dictionary naming the session (the
+        # public key 'keyinit' returned) along with it
+        if isinstance(data, dict):
+            session = data.get('session')
+            if session is not None:
+                session = str(session)
+            data = data.get('password', '')
+        else:
+            session = self._last_session
 
-        self._wipe_key()
+        try:
+            try:
+                passwd = self._decode_password(data, session)
+                self._change_password(passwd)
+            except PasswordError, e:
+                return e.get_response()
+        finally:
+            # A session is used once, whether or not it worked
+            if session is not None:
+                self._wipe_key(session)
 
         return (0, "")
 
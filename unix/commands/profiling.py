@@ -0,0 +1,247 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#  Copyright (c) 2011 Openstack, LLC.
+#  All Rights Reserved.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License"); you may
+#     not use this file except in compliance with the License. You may obtain
+#     a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#     WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#     License for the specific language governing permissions and limitations
+#     under the License.
+#
+
+"""
+JSON command profiling plugin
+"""
+
+import cProfile
+import logging
+import os
+import sys
+import thread
+import threading
+import time
+
+import commands
+
+PROFILE_DIR = "/var/log/nova-agent-profile"
+PROFILE_KEEP = 10
+SAMPLE_INTERVAL = 0.005
+
+PROFILERS = {"cprofile": "prof",
+             "sample": "stacks"}
+
+
+class SamplingProfiler(object):
+    """
+    Low overhead profiler that periodically samples the stack of the
+    thread running a command.  Output is in 'collapsed stack' format,
+    one line per unique stack followed by the number of samples.
+    """
+
+    def __init__(self, interval=SAMPLE_INTERVAL):
+        self.interval = interval
+        self.stacks = {}
+        self._thread_id = None
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.isSet():
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append('%s:%s' % (os.path.basename(code.co_filename),
+                        code.co_name))
+                frame = frame.f_back
+            if stack:
+                stack.reverse()
+                key = ';'.join(stack)
+                self.stacks[key] = self.stacks.get(key, 0) + 1
+            self._stop.wait(self.interval)
+
+    def runcall(self, func, *args):
+        self._thread_id = thread.get_ident()
+        self._stop.clear()
+
+        sampler = threading.Thread(target=self._sample)
+        sampler.setDaemon(True)
+        sampler.start()
+        try:
+            return func(*args)
+        finally:
+            self._stop.set()
+            sampler.join()
+
+    def dump_stats(self, filename):
+        f = open(filename, 'w')
+        try:
+            for stack, count in sorted(self.stacks.iteritems()):
+                f.write('%s %d\n' % (stack, count))
+        finally:
+            f.close()
+
+
+class ProfileCommands(commands.CommandBase):
+    """
+    Class for the 'profile' command.  Profiling can be turned on for
+    the next N invocations of a command and/or for a time window, either
+    with the 'profile' command or by passing 'profile_commands' to
+    commands.init() in the config file.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.profile_dir = kwargs.get("profile_dir", PROFILE_DIR)
+        self.profile_keep = kwargs.get("profile_keep", PROFILE_KEEP)
+
+        self._lock = threading.Lock()
+        # cmd_name -> (profiler, remaining runs, expiration time)
+        self._armed = {}
+        self._dumps = []
+        self._dump_num = 0
+
+        for cmd_name, count in kwargs.get("profile_commands", {}).items():
+            self._arm(cmd_name, "cprofile", count, None)
+
+        commands.CommandBase._profiler = self
+
+    def _arm(self, cmd_name, profiler, count, seconds):
+        if seconds:
+            expires = time.time() + seconds
+        else:
+            expires = None
+
+        self._lock.acquire()
+        try:
+            if not count and not expires:
+                self._armed.pop(cmd_name, None)
+            else:
+                self._armed[cmd_name] = (profiler, count, expires)
+        finally:
+            self._lock.release()
+
+    def _take(self, cmd_name):
+        """
+        Return the profiler to use for this run of a command, or None if
+        profiling isn't armed for it.  Uses up one of the armed runs.
+        """
+
+        self._lock.acquire()
+        try:
+            try:
+                profiler, count, expires = self._armed[cmd_name]
+            except KeyError:
+                return None
+
+            if expires and time.time() > expires:
+                del self._armed[cmd_name]
+                return None
+
+            if count:
+                count -= 1
+                if count:
+                    self._armed[cmd_name] = (profiler, count, expires)
+                else:
+                    del self._armed[cmd_name]
+
+            return profiler
+        finally:
+            self._lock.release()
+
+    def _rotate(self):
+        """Remove the oldest dumps so only 'profile_keep' remain"""
+
+        dumps = []
+        for filename in os.listdir(self.profile_dir):
+            ext = filename.rsplit('.', 1)[-1]
+            if ext not in PROFILERS.values():
+                continue
+            filepath = os.path.join(self.profile_dir, filename)
+            dumps.append((os.path.getmtime(filepath), filepath))
+
+        dumps.sort()
+        for mtime, filepath in dumps[:-self.profile_keep]:
+            try:
+                os.unlink(filepath)
+            except OSError:
+                pass
+
+        self._dumps = [filepath for mtime, filepath in
+                dumps[-self.profile_keep:]]
+
+    def _dump_path(self, cmd_name, profiler):
+        self._dump_num += 1
+        return os.path.join(self.profile_dir, "%s-%s-%d-%d.%s" % (
+                cmd_name, time.strftime("%Y%m%d%H%M%S"), os.getpid(),
+                self._dump_num, PROFILERS[profiler]))
+
+    def is_armed(self, cmd_name):
+        return cmd_name in self._armed
+
+    def run(self, cmd_name, func, arg):
+        profiler = self._take(cmd_name)
+        if not profiler:
+            return func(arg)
+
+        if profiler == "sample":
+            prof = SamplingProfiler()
+        else:
+            prof = cProfile.Profile()
+
+        try:
+            return prof.runcall(func, arg)
+        finally:
+            try:
+                if not os.path.exists(self.profile_dir):
+                    os.makedirs(self.profile_dir, 0700)
+                dump_path = self._dump_path(cmd_name, profiler)
+                prof.dump_stats(dump_path)
+                logging.info("wrote profile for '%s' to %s" % (cmd_name,
+                        dump_path))
+                self._rotate()
+            except Exception, e:
+                logging.error("Couldn't write profile for '%s': %s" % (
+                        cmd_name, str(e)))
+
+    @commands.command_add('profile')
+    def profile_cmd(self, data):
+
+        # No arguments just returns the dumps written so far
+        if not data or data == "status":
+            if os.path.isdir(self.profile_dir):
+                self._rotate()
+            return (0, ','.join(self._dumps))
+
+        if not isinstance(data, dict):
+            return (500, "Invalid arguments")
+
+        cmd_name = data.get("command")
+        if cmd_name not in self.command_names():
+            return (404, "No such agent command '%s'" % cmd_name)
+
+        profiler = data.get("profiler", "cprofile")
+        if profiler not in PROFILERS:
+            return (500, "Unknown profiler '%s'" % profiler)
+
+        try:
+            count = int(data.get("count", 0))
+            seconds = int(data.get("seconds", 0))
+        except (TypeError, ValueError):
+            return (500, "Invalid 'count' or 'seconds' argument")
+
+        if "count" not in data and not seconds:
+            count = 1
+
+        self._arm(cmd_name, profiler, count, seconds)
+
+        if not count and not seconds:
+            return (0, "Profiling disabled for '%s'" % cmd_name)
+
+        return (0, "Profiling enabled for '%s', writing to %s" % (cmd_name,
+                self.profile_dir))
@@ -22,7 +22,8 @@ redhat/centos network helper module
 
 # Red Hat network configuration uses:
 # - 1 network configuration file per interface
-# - 1 IP per interface
+# - 1 IP per interface, or all of them in numbered keys when there are
+#   lots of them
 # - routes are per interface
 # - gateways are per interface
 # - DNS is configured per interface
@@ -35,6 +36,7 @@ import logging
 from cStringIO import StringIO
 
 import commands.network
+import commands.redhat.nm
 
 NETWORK_FILE = "/etc/sysconfig/network"
 NETCONFIG_DIR = "/etc/sysconfig/network-scripts"
@@ -43,6 +45,11 @@ ROUTE_FILE = "route-%s"
 
 
 def configure_network(hostname, interfaces):
+    # NetworkManager can apply changed connections without restarting
+    # the network
+    if commands.redhat.nm.is_running():
+        return commands.redhat.nm.configure_network(hostname, interfaces)
+
     if os.path.exists(NETWORK_FILE):
         infile = open(NETWORK_FILE)
     else:
@@ -90,7 +97,7 @@ def _update_key_value(infile, key, value):
     """
     Update hostname on system
     """
-    outfile = StringIO()
+    outfile = commands.network.FileData()
 
     found = False
     for line in infile:
@@ -99,18 +106,17 @@ def _update_key_value(infile, key, value):
             k, v = line.split('=', 1)
             k = k.strip()
             if k == key:
-                print >> outfile, "%s=%s" % (key, value)
+                outfile.writeline("%s=%s" % (key, value))
                 found = True
             else:
-                print >> outfile, line
+                outfile.writeline(line)
         else:
-            print >> outfile, line
+            outfile.writeline(line)
 
     if not found:
-        print >> outfile, "%s=%s" % (key, value)
+        outfile.writeline("%s=%s" % (key, value))
 
-    outfile.seek(0)
-    return outfile.read()
+    return outfile.getvalue()
 
 
 def get_hostname_file(infile, hostname):
@@ -120,9 +126,10 @@ def get_hostname_file(infile, hostname):
     return _update_key_value(infile, 'HOSTNAME', hostname)
 
 
-def _get_file_data(ifname_prefix, interface):
+def _get_alias_iface_data(ifname_prefix, interface):
     """
-    Return data for (sub-)interfaces and routes
+    Return data for the interface and a sub-interface for each additional
+    IP
     """
 
     ip4s = interface['ip4s']
@@ -143,46 +150,114 @@ def _get_file_data(ifname_prefix, interface):
         else:
             ifname = ifname_prefix
 
-        iface_data = "# Automatically generated, do not edit\n"
-        iface_data += "DEVICE=%s\n" % ifname
-        iface_data += "BOOTPROTO=static\n"
-        iface_data += "HWADDR=%s\n" % interface['mac']
+        iface_data = commands.network.FileData()
+        iface_data.write("# Automatically generated, do not edit\n")
+        iface_data.write("DEVICE=%s\n" % ifname)
+        iface_data.write("BOOTPROTO=static\n")
+        iface_data.write("HWADDR=%s\n" % interface['mac'])
 
         if ip4:
-            iface_data += "IPADDR=%(address)s\n" % ip4
-            iface_data += "NETMASK=%(netmask)s\n" % ip4
+            iface_data.write("IPADDR=%(address)s\n" % ip4)
+            iface_data.write("NETMASK=%(netmask)s\n" % ip4)
             if gateway4:
-                iface_data += "DEFROUTE=yes\n"
-                iface_data += "GATEWAY=%s\n" % gateway4
+                iface_data.write("DEFROUTE=yes\n")
+                iface_data.write("GATEWAY=%s\n" % gateway4)
                 gateway4 = None
 
         if ip6:
-            iface_data += "IPV6INIT=yes\n"
-            iface_data += "IPV6_AUTOCONF=no\n"
-            iface_data += "IPV6ADDR=%(address)s/%(prefixlen)s\n" % ip6
+            iface_data.write("IPV6INIT=yes\n")
+            iface_data.write("IPV6_AUTOCONF=no\n")
+            iface_data.write("IPV6ADDR=%(address)s/%(prefixlen)s\n" % ip6)
 
             if gateway6:
-                iface_data += "IPV6_DEFAULTGW=%s%%%s\n" % (gateway6, ifname)
+                iface_data.write("IPV6_DEFAULTGW=%s%%%s\n" %
+                                 (gateway6, ifname))
                 gateway6 = None
 
         if dns:
             for j, nameserver in enumerate(dns):
-                iface_data += "DNS%d=%s\n" % (j + 1, nameserver)
+                iface_data.write("DNS%d=%s\n" % (j + 1, nameserver))
             dns = None
 
-        iface_data += "ONBOOT=yes\n"
-        iface_data += "NM_CONTROLLED=no\n"
+        iface_data.write("ONBOOT=yes\n")
+        iface_data.write("NM_CONTROLLED=no\n")
         ifname_suffix_num += 1
 
-        ifaces.append((ifname, iface_data))
+        ifaces.append((ifname, iface_data.getvalue()))
+
+    return ifaces
+
+
+def _get_bulk_iface_data(ifname, interface):
+    """
+    Return data for the interface with all of its IPs in one file, using
+    numbered IPADDRn keys and IPV6ADDR_SECONDARIES
+    """
+
+    ip4s = interface['ip4s']
+    ip6s = interface['ip6s']
+
+    gateway4 = interface['gateway4']
+    gateway6 = interface['gateway6']
+
+    iface_data = commands.network.FileData()
+    iface_data.write("# Automatically generated, do not edit\n")
+    iface_data.write("DEVICE=%s\n" % ifname)
+    iface_data.write("BOOTPROTO=static\n")
+    iface_data.write("HWADDR=%s\n" % interface['mac'])
+
+    for i, ip4 in enumerate(ip4s):
+        if i:
+            iface_data.write("IPADDR%d=%s\n" % (i, ip4['address']))
+            iface_data.write("PREFIX%d=%s\n" %
+                             (i, commands.network.get_prefixlen(ip4)))
+        else:
+            iface_data.write("IPADDR=%(address)s\n" % ip4)
+            iface_data.write("NETMASK=%(netmask)s\n" % ip4)
+
+    if ip4s and gateway4:
+        iface_data.write("DEFROUTE=yes\n")
+        iface_data.write("GATEWAY=%s\n" % gateway4)
+
+    if ip6s:
+        iface_data.write("IPV6INIT=yes\n")
+        iface_data.write("IPV6_AUTOCONF=no\n")
+        iface_data.write("IPV6ADDR=%(address)s/%(prefixlen)s\n" % ip6s[0])
+
+        if ip6s[1:]:
+            iface_data.write('IPV6ADDR_SECONDARIES="%s"\n' % ' '.join(
+                    ['%(address)s/%(prefixlen)s' % ip6 for ip6 in ip6s[1:]]))
+
+        if gateway6:
+            iface_data.write("IPV6_DEFAULTGW=%s%%%s\n" % (gateway6, ifname))
+
+    for j, nameserver in enumerate(interface['dns']):
+        iface_data.write("DNS%d=%s\n" % (j + 1, nameserver))
+
+    iface_data.write("ONBOOT=yes\n")
+    iface_data.write("NM_CONTROLLED=no\n")
+
+    return iface_data.getvalue()
+
+
+def _get_file_data(ifname_prefix, interface):
+    """
+    Return data for (sub-)interfaces and routes
+    """
+
+    if commands.network.use_bulk_aliases(interface):
+        ifaces = [(ifname_prefix,
+                   _get_bulk_iface_data(ifname_prefix, interface))]
+    else:
+        ifaces = _get_alias_iface_data(ifname_prefix, interface)
 
-    route_data = ''
+    route_data = commands.network.FileData()
     for i, route in enumerate(interface['routes']):
-        route_data += "ADDRESS%d=%s\n" % (i, route['network'])
-        route_data += "NETMASK%d=%s\n" % (i, route['netmask'])
-        route_data += "GATEWAY%d=%s\n" % (i, route['gateway'])
+        route_data.write("ADDRESS%d=%s\n" % (i, route['network']))
+        route_data.write("NETMASK%d=%s\n" % (i, route['netmask']))
+        route_data.write("GATEWAY%d=%s\n" % (i, route['gateway']))
 
-    return (ifaces, route_data)
+    return (ifaces, route_data.getvalue())
 
 
 def get_interface_files(interfaces):
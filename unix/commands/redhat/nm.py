@@ -0,0 +1,258 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#  Copyright (c) 2011 Openstack, LLC.
+#  All Rights Reserved.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License"); you may
+#     not use this file except in compliance with the License. You may obtain
+#     a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#     WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#     License for the specific language governing permissions and limitations
+#     under the License.
+#
+
+"""
+redhat/centos NetworkManager helper module
+"""
+
+# On Red Hat guests where NetworkManager is running we use:
+# - 1 keyfile connection per interface, matched by MAC
+# - multiple IPs per connection
+# - routes are per connection
+# - gateways are per connection
+# - DNS is configured per connection
+#
+# Restarting the network service makes NetworkManager reload every
+# connection.  Instead, the changed keyfiles are loaded with a single
+# 'nmcli connection load' and only their devices are reapplied.
+
+import glob
+import os
+import logging
+import subprocess
+import uuid
+
+import commands.network
+import commands.redhat.network
+
+HOSTNAME_FILE = "/etc/hostname"
+CONNECTION_DIR = "/etc/NetworkManager/system-connections"
+CONNECTION_FILE = "nova-agent-%s.nmconnection"
+
+# NetworkManager ignores keyfiles readable by anyone but root
+CONNECTION_MODE = 0600
+
+# Connection UUIDs are derived from the MAC address so they stay the same
+# across updates
+_UUID_NAMESPACE = uuid.UUID('9f5c1d4e-3b7a-5c2e-8d61-0a4e7b2f6c13')
+
+
+def is_running():
+    """
+    Return True if a NetworkManager with keyfile support is running
+    """
+
+    pipe = subprocess.PIPE
+    try:
+        p = subprocess.Popen(['nmcli', '-t', '-f', 'RUNNING', 'general'],
+                stdin=pipe, stdout=pipe, stderr=pipe, env={})
+    except OSError:
+        return False
+
+    # Releases too old for 'nmcli connection load' don't know 'general'
+    stdout, stderr = p.communicate()
+    return p.returncode == 0 and stdout.strip() == 'running'
+
+
+def configure_network(hostname, interfaces):
+    update_files = {}
+    modes = {}
+
+    connection_files = {}
+    for filename, data in get_interface_files(interfaces).iteritems():
+        filepath = os.path.join(CONNECTION_DIR, filename)
+        connection_files[filepath] = _get_connection_ifname(filename)
+        update_files[filepath] = data
+        modes[filepath] = CONNECTION_MODE
+
+    # Remove connections for interfaces that are no longer configured,
+    # and ifcfg files so they don't compete with our connections
+    remove_files = set()
+    for filepath in glob.glob(os.path.join(CONNECTION_DIR,
+                                           CONNECTION_FILE % '*')):
+        if filepath not in update_files:
+            remove_files.add(filepath)
+
+    netconfig_dir = commands.redhat.network.NETCONFIG_DIR
+    for pattern in ('ifcfg-*', 'route-*'):
+        for filepath in glob.glob(os.path.join(netconfig_dir, pattern)):
+            if '.' not in os.path.basename(filepath):
+                remove_files.add(filepath)
+    remove_files.discard(os.path.join(netconfig_dir,
+            commands.redhat.network.INTERFACE_FILE % 'lo'))
+
+    # Generate new hostname file
+    update_files[HOSTNAME_FILE] = hostname + '\n'
+
+    # Generate new /etc/hosts file
+    filepath, data = commands.network.get_etc_hosts(interfaces, hostname)
+    update_files[filepath] = data
+
+    # Write out new files
+    changed = commands.network.update_files(update_files, remove_files,
+            modes)
+
+    errors = []
+
+    # Set hostname
+    try:
+        commands.network.sethostname(hostname)
+    except Exception, e:
+        logging.error("Couldn't sethostname(): %s" % str(e))
+        errors.append("Couldn't set hostname: %s" % str(e))
+
+    # Loading a file that no longer exists drops its connection
+    load_files = [filepath for filepath in changed
+                  if filepath in connection_files]
+    load_files.extend(remove_files)
+    load_files.sort()
+
+    if load_files:
+        errors.extend(_apply_connections(load_files, connection_files,
+                interfaces))
+
+    if errors:
+        return (500, "; ".join(errors))
+
+    return (0, "")
+
+
+def _apply_connections(load_files, connection_files, interfaces):
+    """
+    Load the connection files in 'load_files' and apply the changed ones
+    to their devices.  Returns a list of errors.
+    """
+
+    failed = commands.network.run_commands(
+            [['nmcli', 'connection', 'load'] + load_files])
+    if failed:
+        return ["Couldn't load connections: %d" % status
+                for cmd, status in failed]
+
+    ifnames = [connection_files[filepath] for filepath in load_files
+               if filepath in connection_files]
+
+    # Reapplying only works when the device already has our connection
+    # active, otherwise it needs to be brought up
+    failed = commands.network.run_commands(
+            [['nmcli', 'device', 'reapply', ifname] for ifname in ifnames],
+            parallel=True)
+
+    cmds = []
+    uuid_ifnames = {}
+    for cmd, status in failed:
+        ifname = cmd[-1]
+        connection_uuid = get_connection_uuid(interfaces[ifname])
+        uuid_ifnames[connection_uuid] = ifname
+        cmds.append(['nmcli', 'connection', 'up', 'uuid', connection_uuid])
+
+    failed = commands.network.run_commands(cmds, parallel=True)
+    return ["Couldn't apply connection for %s: %d" %
+            (uuid_ifnames[cmd[-1]], status) for cmd, status in failed]
+
+
+def _get_connection_ifname(filename):
+    """
+    Return the interface name from one of our connection file names
+    """
+
+    prefix, suffix = CONNECTION_FILE.split('%s')
+    return filename[len(prefix):-len(suffix)]
+
+
+def get_connection_uuid(interface):
+    return str(uuid.uuid5(_UUID_NAMESPACE, interface['mac'].lower()))
+
+
+def _write_ip_section(outfile, section, method, ips, gateway, dns, routes):
+    outfile.writeline('')
+    outfile.writeline('[%s]' % section)
+
+    if not ips:
+        outfile.writeline('method=%s' % method)
+        return
+
+    outfile.writeline('method=manual')
+
+    # The gateway goes with the first address
+    for i, (address, prefixlen) in enumerate(ips):
+        if i == 0 and gateway:
+            outfile.writeline('address%d=%s/%s,%s' % (i + 1, address,
+                    prefixlen, gateway))
+        else:
+            outfile.writeline('address%d=%s/%s' % (i + 1, address,
+                    prefixlen))
+
+    if dns:
+        outfile.writeline('dns=%s;' % ';'.join(dns))
+
+    for i, (network, prefixlen, route_gateway) in enumerate(routes):
+        outfile.writeline('route%d=%s/%s,%s' % (i + 1, network, prefixlen,
+                route_gateway))
+
+
+def _get_connection_data(ifname, interface):
+    """
+    Return the keyfile data for the connection for an interface
+    """
+
+    dns = interface.get('dns', [])
+    routes = [(route['network'], commands.network.get_prefixlen(route),
+               route['gateway']) for route in interface['routes']]
+
+    connection_data = commands.network.FileData()
+    connection_data.writeline('# Automatically generated, do not edit')
+    connection_data.writeline('[connection]')
+    connection_data.writeline('id=nova-agent %s' % ifname)
+    connection_data.writeline('uuid=%s' % get_connection_uuid(interface))
+    connection_data.writeline('type=ethernet')
+    connection_data.writeline('interface-name=%s' % ifname)
+    connection_data.writeline('autoconnect-priority=100')
+    connection_data.writeline('')
+    connection_data.writeline('[ethernet]')
+    connection_data.writeline('mac-address=%s' % interface['mac'].upper())
+
+    _write_ip_section(connection_data, 'ipv4', 'disabled',
+            [(ip4['address'], commands.network.get_prefixlen(ip4))
+             for ip4 in interface['ip4s']],
+            interface['gateway4'],
+            [nameserver for nameserver in dns if ':' not in nameserver],
+            routes)
+
+    _write_ip_section(connection_data, 'ipv6', 'ignore',
+            [(ip6['address'], ip6['prefixlen'])
+             for ip6 in interface['ip6s']],
+            interface['gateway6'],
+            [nameserver for nameserver in dns if ':' in nameserver],
+            [])
+
+    return connection_data.getvalue()
+
+
+def get_interface_files(interfaces):
+    """
+    Return a dictionary of connection file name to data for the
+    interfaces
+    """
+
+    update_files = {}
+    for ifname, interface in interfaces.iteritems():
+        update_files[CONNECTION_FILE % ifname] = \
+                _get_connection_data(ifname, interface)
+
+    return update_files
@@ -100,7 +100,7 @@ def get_hostname_file(hostname):
 
 
 def get_nameservers_file(infile, dns):
-    outfile = StringIO()
+    outfile = commands.network.FileData()
     if not dns:
         return outfile
 
@@ -108,23 +108,22 @@ def get_nameservers_file(infile, dns):
     for line in infile:
         line = line.strip()
         if '=' not in line:
-            print >> outfile, line
+            outfile.writeline(line)
             continue
 
         k, v = line.split('=', 1)
         k = k.strip()
         if k == 'NETCONFIG_DNS_STATIC_SERVERS':
-            print >> outfile, \
-                    'NETCONFIG_DNS_STATIC_SERVERS="%s"' % ' '.join(dns)
+            outfile.writeline(
+                    'NETCONFIG_DNS_STATIC_SERVERS="%s"' % ' '.join(dns))
             found = True
         else:
-            print >> outfile, line
+            outfile.writeline(line)
 
     if not found:
-        print >> outfile, 'NETCONFIG_DNS_STATIC_SERVERS="%s"' % ' '.join(dns)
+        outfile.writeline('NETCONFIG_DNS_STATIC_SERVERS="%s"' % ' '.join(dns))
 
-    outfile.seek(0)
-    return outfile.read()
+    return outfile.getvalue()
 
 
 def _get_file_data(ifname, interface):
@@ -140,49 +139,52 @@ def _get_file_data(ifname, interface):
 
     ifnum = None
 
-    iface_data = "# Automatically generated, do not edit\n"
-    iface_data += "BOOTPROTO='static'\n"
+    iface_data = commands.network.FileData()
+    iface_data.write("# Automatically generated, do not edit\n")
+    iface_data.write("BOOTPROTO='static'\n")
 
     for ip in ip4s:
         if ifnum is None:
-            iface_data += "IPADDR='%s'\n" % ip['address']
-            iface_data += "NETMASK='%s'\n" % ip['netmask']
+            iface_data.write("IPADDR='%s'\n" % ip['address'])
+            iface_data.write("NETMASK='%s'\n" % ip['netmask'])
             ifnum = 0
         else:
-            iface_data += "IPADDR_%s='%s'\n" % (ifnum, ip['address'])
-            iface_data += "NETMASK_%s='%s'\n" % (ifnum, ip['netmask'])
-            iface_data += "LABEL_%s='%s'\n" % (ifnum, ifnum)
+            iface_data.write("IPADDR_%s='%s'\n" % (ifnum, ip['address']))
+            iface_data.write("NETMASK_%s='%s'\n" % (ifnum, ip['netmask']))
+            iface_data.write("LABEL_%s='%s'\n" % (ifnum, ifnum))
             ifnum += 1
 
     for ip in ip6s:
         if ifnum is None:
-            iface_data += "IPADDR='%s'\n" % ip['address']
-            iface_data += "PREFIXLEN='%s'\n" % ip['prefixlen']
+            iface_data.write("IPADDR='%s'\n" % ip['address'])
+            iface_data.write("PREFIXLEN='%s'\n" % ip['prefixlen'])
             ifnum = 0
         else:
-            iface_data += "IPADDR_%s='%s'\n" % (ifnum, ip['address'])
-            iface_data += "PREFIXLEN_%s='%s'\n" % (ifnum, ip['prefixlen'])
-            iface_data += "LABEL_%s='%s'\n" % (ifnum, ifnum)
+            iface_data.write("IPADDR_%s='%s'\n" % (ifnum, ip['address']))
+            iface_data.write("PREFIXLEN_%s='%s'\n" %
+                             (ifnum, ip['prefixlen']))
+            iface_data.write("LABEL_%s='%s'\n" % (ifnum, ifnum))
             ifnum += 1
 
-    iface_data += "STARTMODE='auto'\n"
-    iface_data += "USERCONTROL='no'\n"
+    iface_data.write("STARTMODE='auto'\n")
+    iface_data.write("USERCONTROL='no'\n")
 
-    route_data = ''
+    route_data = commands.network.FileData()
     for route in interface['routes']:
         network = route['network']
         netmask = route['netmask']
         gateway = route['gateway']
 
-        route_data += '%s %s %s %s\n' % (network, gateway, netmask, ifname)
+        route_data.write('%s %s %s %s\n' %
+                         (network, gateway, netmask, ifname))
 
     if gateway4:
-        route_data += 'default %s - -\n' % gateway4
+        route_data.write('default %s - -\n' % gateway4)
 
     if gateway6:
-        route_data += 'default %s - -\n' % gateway6
+        route_data.write('default %s - -\n' % gateway6)
 
-    return (iface_data, route_data)
+    return (iface_data.getvalue(), route_data.getvalue())
 
 
 def get_interface_files(interfaces):
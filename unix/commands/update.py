@@ -27,6 +27,7 @@ import tarfile
 import urllib
 
 import commands
+import jobs
 
 TMP_PATH = "/var/run"
 DEST_PATH = "/usr/share/nova-agent"
@@ -105,7 +106,7 @@ class UpdateCommand(commands.CommandBase):
 
         return local_filename
 
-    @commands.command_add('agentupdate')
+    @commands.command_add('agentupdate', background=True, isolate=True)
     def update_cmd(self, data):
 
         if isinstance(data, basestring):
@@ -120,6 +121,8 @@ class UpdateCommand(commands.CommandBase):
         else:
             return (500, "Invalid arguments")
 
+        jobs.set_progress("downloading %s" % url)
+
         try:
             local_filename = self._get_to_local_file(url, md5sum)
         except AgentUpdateError, e:
@@ -155,6 +158,8 @@ class UpdateCommand(commands.CommandBase):
 
         pipe = subprocess.PIPE
 
+        jobs.set_progress("installing")
+
         if found_installer:
             dest_path = "%s.%d" % (DEST_PATH, os.getpid())
 
@@ -196,6 +201,8 @@ class UpdateCommand(commands.CommandBase):
         if not init_script:
             return(404, "No init script found to restart")
 
+        jobs.set_progress(jobs.RESTARTING)
+
         try:
             p = subprocess.Popen(["sh", init_script, "restart"],
                     stdin=pipe, stdout=pipe, stderr=pipe, env={})
@@ -0,0 +1,244 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#  Copyright (c) 2011 Openstack, LLC.
+#  All Rights Reserved.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License"); you may
+#     not use this file except in compliance with the License. You may obtain
+#     a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#     WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#     License for the specific language governing permissions and limitations
+#     under the License.
+#
+
+"""
+Worker processes for running commands outside of the agent process
+"""
+
+import cPickle
+import errno
+import logging
+import os
+import select
+import shutil
+import socket
+import tempfile
+
+import commands
+import jobs
+
+# Where the fork server's socket goes, if it exists
+WORKER_DIR = "/var/run"
+
+
+class WorkerError(Exception):
+    pass
+
+
+class Worker(object):
+    """
+    Runs commands in child processes of a fork server, one process per
+    command.  Memory used while running a command is given back to the
+    OS when its process exits, instead of staying with the agent.
+
+    The fork server is started by commands.init(), before the agent
+    daemonizes and starts any threads, so processes are never forked
+    from the multithreaded agent.  It takes a connection on a Unix
+    socket for each command and forks a child to run it, so commands
+    don't wait for each other.  Progress messages are sent back over
+    the connection along with the result.
+    """
+
+    def __init__(self):
+        self.pid = None
+        self._dir = None
+        self._path = None
+        self._stop_w = None
+
+    def _run_child(self, conn):
+        # Isolated commands run right here
+        commands.CommandBase._worker = None
+
+        req_file = conn.makefile('rb')
+        resp_file = conn.makefile('wb')
+
+        def send(msg):
+            cPickle.dump(msg, resp_file, 2)
+            resp_file.flush()
+
+        cmd_name, arg = cPickle.load(req_file)
+        jobs.forward_progress(lambda message: send(('progress', message)))
+
+        try:
+            func = commands.CommandBase.command_function(cmd_name)
+            resp = (True, func(arg))
+        except Exception, e:
+            logging.exception("Exception in worker running %r" % cmd_name)
+            # Not every exception class survives being unpickled
+            try:
+                cPickle.loads(cPickle.dumps(e, 2))
+            except Exception:
+                e = WorkerError(str(e))
+            resp = (False, e)
+
+        try:
+            send(('result', resp))
+        except Exception, e:
+            send(('result', (False, WorkerError(str(e)))))
+
+    def _fork(self, func, *args):
+        """Run 'func' in a child process and return its pid"""
+
+        pid = os.fork()
+        if pid == 0:
+            status = 0
+            try:
+                try:
+                    func(*args)
+                except Exception:
+                    logging.exception("Worker process failed")
+                    status = 1
+            finally:
+                os._exit(status)
+
+        return pid
+
+    def _serve(self, listener, stop_r):
+        # Keep out of the way of signals meant for the agent's terminal
+        os.setsid()
+
+        while True:
+            # Reap children that have finished their command
+            try:
+                while os.waitpid(-1, os.WNOHANG)[0]:
+                    pass
+            except OSError:
+                pass
+
+            try:
+                readable = select.select([listener, stop_r], [], [], 1)[0]
+            except select.error, e:
+                if e[0] == errno.EINTR:
+                    continue
+                raise
+
+            # The agent closes its end of the pipe when it stops or exits
+            if stop_r in readable:
+                break
+
+            if listener in readable:
+                conn, addr = listener.accept()
+
+                def child(conn):
+                    listener.close()
+                    os.close(stop_r)
+                    self._run_child(conn)
+
+                self._fork(child, conn)
+                conn.close()
+
+    def start(self):
+        """Start the fork server"""
+
+        if self.pid:
+            return
+
+        if os.path.isdir(WORKER_DIR):
+            self._dir = tempfile.mkdtemp(prefix='nova-agent-worker.',
+                    dir=WORKER_DIR)
+        else:
+            self._dir = tempfile.mkdtemp(prefix='nova-agent-worker.')
+        self._path = os.path.join(self._dir, 'socket')
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(self._path)
+        listener.listen(8)
+
+        stop_r, stop_w = os.pipe()
+
+        def server():
+            os.close(stop_w)
+            self._serve(listener, stop_r)
+
+        self.pid = self._fork(server)
+
+        listener.close()
+        os.close(stop_r)
+        self._stop_w = stop_w
+
+        logging.info("started worker fork server %d" % self.pid)
+
+    def stop(self):
+        """Tell the fork server to exit and wait for it"""
+
+        if not self.pid:
+            return
+
+        os.close(self._stop_w)
+        self._stop_w = None
+
+        try:
+            os.waitpid(self.pid, 0)
+        except OSError:
+            pass
+        self.pid = None
+
+        shutil.rmtree(self._dir, True)
+
+    def run(self, cmd_name, arg):
+        """Run a command in a worker process and return its result"""
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            try:
+                sock.connect(self._path)
+            except (socket.error, TypeError), e:
+                # Better to run it here than not at all
+                logging.error("couldn't reach worker fork server, running "
+                        "'%s' in the agent: %s" % (cmd_name, str(e)))
+                func = commands.CommandBase.command_function(cmd_name)
+                return func(arg)
+
+            req_file = sock.makefile('wb')
+            resp_file = sock.makefile('rb')
+
+            try:
+                cPickle.dump((cmd_name, arg), req_file, 2)
+                req_file.flush()
+
+                while True:
+                    msg = cPickle.load(resp_file)
+                    if msg[0] != 'progress':
+                        break
+                    jobs.set_progress(msg[1])
+            except (EOFError, IOError, OSError, socket.error), e:
+                raise WorkerError("Worker process died running '%s'" % (
+                        cmd_name))
+        finally:
+            sock.close()
+
+        success, resp = msg[1]
+        if not success:
+            raise resp
+        return resp
+
+
+class WorkerCommands(commands.CommandBase):
+    """
+    Sets up the worker for commands added with 'isolate' set.  This is
+    skipped in testmode or when 'isolate_commands' is False.
+    """
+
+    def __init__(self, *args, **kwargs):
+        if kwargs.get("testmode", False) or \
+                not kwargs.get("isolate_commands", True):
+            worker = None
+        else:
+            worker = Worker()
+
+        commands.CommandBase._worker = worker
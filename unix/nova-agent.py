@@ -30,12 +30,19 @@ import commands.command_list
 test_mode = False
 
 # Inits all command classes
+# Profiling can be turned on for the next N runs of a command, e.g.:
+# c = commands.init(profile_commands={'resetnetwork': 1})
+# Heavy commands run in a worker process unless isolate_commands=False
 c = commands.init()
 
 # Creates instance of JsonParser, passing in available commands
 parser = plugins.JsonParser(c)
-# Create the XSComm intance
-xs = plugins.XSComm()
+# Create the XSComm intance.  Pending requests the parser says can be
+# answered together (like several 'resetnetwork's) are coalesced.  The
+# command classes' background threads are started once it's polling,
+# after the agent has daemonized
+xs = plugins.XSComm(coalesce_key=parser.coalesce_key,
+        on_start=c.run_threads)
 
 # Register an exchange/parser combination with the main daemon
 agentlib.register(xs, parser)
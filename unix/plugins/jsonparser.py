@@ -20,7 +20,24 @@
 JSON agent command parser main code module
 """
 
+import base64
 import logging
+import threading
+import time
+import zlib
+
+# This is to support older python versions that don't have hashlib
+try:
+    import hashlib
+except ImportError:
+    import sha
+
+    class hashlib(object):
+        """Fake hashlib module as a class"""
+
+        @staticmethod
+        def sha1(buf=''):
+            return sha.new(buf)
 
 try:
     import anyjson
@@ -42,6 +59,116 @@ except ImportError:
             return json.loads(buf)
 
 
+# Messages at least this long are compressed if the request allows it
+COMPRESS_THRESHOLD = 1024
+# Responses longer than this are split into chunks if the request allows
+# it.  XenStore limits the size of a single value to 4096 bytes.
+MAX_RESPONSE_SIZE = 3072
+
+# Encodings a request can list in 'accept_encoding'
+ENCODINGS = ['zlib', 'chunked']
+
+# Number of responses to remember, and for how long, so a request the
+# host resubmits isn't run a second time
+RESULT_CACHE_SIZE = 64
+RESULT_CACHE_TTL = 600
+# How long a duplicate waits for the request it duplicates to finish
+RESULT_CACHE_WAIT = 30
+
+
+class ResultCache(object):
+    """
+    Bounded cache of responses, keyed by request path and data.  Also
+    tracks requests that are still being processed so a duplicate can
+    wait for that result instead of running the command again.
+    """
+
+    # Returned by start() when a duplicate gave up waiting
+    BUSY = object()
+
+    def __init__(self, size=RESULT_CACHE_SIZE, ttl=RESULT_CACHE_TTL,
+            wait=RESULT_CACHE_WAIT):
+        self.size = size
+        self.ttl = ttl
+        self.wait = wait
+        self.hits = 0
+
+        self._lock = threading.Lock()
+        # key -> (expiration time, response)
+        self._results = {}
+        # key -> [threading.Event set when done, response]
+        self._in_flight = {}
+
+    def _expire(self, now):
+        for key, (expires, resp) in self._results.items():
+            if expires <= now:
+                del self._results[key]
+
+        if len(self._results) > self.size:
+            oldest = [(expires, key) for key, (expires, resp) in
+                      self._results.iteritems()]
+            oldest.sort()
+            for expires, key in oldest[:len(self._results) - self.size]:
+                del self._results[key]
+
+    def start(self, key):
+        """
+        Return a cached response for this key, or None if the caller
+        should process the request and then call finish().  If the same
+        request is already being processed, wait for its response, or
+        return BUSY if it takes longer than 'wait' seconds.
+        """
+
+        self._lock.acquire()
+        try:
+            entry = self._results.get(key)
+            if entry and entry[0] > time.time():
+                self.hits += 1
+                return entry[1]
+
+            pending = self._in_flight.get(key)
+            if not pending:
+                self._in_flight[key] = [threading.Event(), None]
+                return None
+        finally:
+            self._lock.release()
+
+        if not pending[0].wait(self.wait):
+            return self.BUSY
+
+        if pending[1] is not None:
+            self._lock.acquire()
+            try:
+                self.hits += 1
+            finally:
+                self._lock.release()
+            return pending[1]
+
+        # The other run didn't get a response, so process it again
+        return self.start(key)
+
+    def finish(self, key, resp, cache=True):
+        """
+        Hand the response to duplicates waiting for it, and cache it for
+        later ones unless 'cache' is False
+        """
+
+        now = time.time()
+
+        self._lock.acquire()
+        try:
+            if resp is not None and cache:
+                self._results[key] = (now + self.ttl, resp)
+                self._expire(now)
+            pending = self._in_flight.pop(key, None)
+        finally:
+            self._lock.release()
+
+        if pending:
+            pending[1] = resp
+            pending[0].set()
+
+
 class JsonParser(object):
     """
     JSON command parser plugin for nova-agent
@@ -53,15 +180,134 @@ class JsonParser(object):
 
         self._command_cls = command_cls
 
-    def encode_result(self, result):
+        self.compress_threshold = kwargs.get("compress_threshold",
+                COMPRESS_THRESHOLD)
+        self.max_response_size = kwargs.get("max_response_size",
+                MAX_RESPONSE_SIZE)
+        # Let 'features' report the encodings we support
+        feature_add = getattr(command_cls, "feature_add", None)
+        if feature_add:
+            for encoding in ENCODINGS:
+                feature_add("encoding:%s" % encoding)
+
+        cache_size = kwargs.get("result_cache_size", RESULT_CACHE_SIZE)
+        if cache_size:
+            self.result_cache = ResultCache(cache_size,
+                    kwargs.get("result_cache_ttl", RESULT_CACHE_TTL),
+                    kwargs.get("result_cache_wait", RESULT_CACHE_WAIT))
+        else:
+            self.result_cache = None
+
+    def _cache_key(self, request):
+        """
+        Requests are resubmitted under the same path with the same data
+        when the host times out waiting for a response
+        """
+
+        if not self.result_cache or 'path' not in request or \
+                'data' not in request:
+            return None
+
+        return (request['path'], hashlib.sha1(request['data']).hexdigest())
+
+    def _cacheable(self, resp):
+        """
+        Only successful responses are cached.  A request that failed,
+        for example because the agent was busy, is run again when the
+        host resubmits it.
+        """
+
+        try:
+            returncode = anyjson.deserialize(resp['data'])['returncode']
+        except Exception:
+            return False
+
+        return not returncode.startswith(('4', '5'))
+
+    def encode_result(self, result, encodings=()):
+        """
+        Encode a (returncode, message) result.  'encodings' are the ones
+        the request accepted: large messages are zlib compressed and
+        base64 encoded with 'zlib', and if still too large are split
+        into chunks returned under the 'chunks' key with 'chunked'.
+        """
 
         our_format = {"returncode": str(result[0]),
                       "message": result[1]}
 
-        return {"data": anyjson.serialize(our_format)}
+        message = result[1]
+        if 'zlib' in encodings and isinstance(message, basestring) and \
+                len(message) >= self.compress_threshold:
+            if isinstance(message, unicode):
+                message = message.encode('utf-8')
+            our_format["message"] = base64.b64encode(zlib.compress(message))
+            our_format["encoding"] = "zlib"
+
+        data = anyjson.serialize(our_format)
+        if 'chunked' not in encodings or \
+                len(data) <= self.max_response_size or \
+                not isinstance(our_format["message"], basestring):
+            return {"data": data}
+
+        # The message is sent separately, in numbered chunks
+        message = our_format["message"]
+        size = self.max_response_size
+        chunks = [message[i:i + size] for i in xrange(0, len(message), size)]
+
+        our_format["message"] = ""
+        our_format["chunks"] = len(chunks)
+
+        return {"data": anyjson.serialize(our_format), "chunks": chunks}
+
+    def coalesce_key(self, request):
+        """
+        Return a key for requests that can be answered by a single run of
+        their command, or None.  Requests with the same key are
+        interchangeable.
+        """
+
+        try:
+            request = anyjson.deserialize(request['data'])
+            cmd_name = request['name']
+            if not self._command_cls.command_coalesce(cmd_name):
+                return None
+        except Exception:
+            # Not a request we can coalesce, parse_request() will
+            # deal with any errors
+            return None
+
+        return (cmd_name, bool(request.get('async')))
 
     def parse_request(self, request):
 
+        key = self._cache_key(request)
+        if not key:
+            return self._parse_request(request)
+
+        resp = self.result_cache.start(key)
+        if resp is ResultCache.BUSY:
+            logging.warning("Gave up waiting for duplicate request '%s'" %
+                    request['path'])
+            return self.encode_result((503,
+                    "An identical request is still being processed"))
+        if resp is not None:
+            logging.info("Returning cached response for duplicate "
+                    "request '%s'" % request['path'])
+            return resp
+
+        resp = None
+        try:
+            resp = self._parse_request(request)
+        finally:
+            self.result_cache.finish(key, resp, self._cacheable(resp))
+
+        return resp
+
+    def _parse_request(self, request):
+
+        if 'rejected' in request:
+            return self.encode_result((503, request['rejected']))
+
         try:
             request = anyjson.deserialize(request['data'])
         except KeyError, e:
@@ -90,7 +336,15 @@ class JsonParser(object):
                 (cmd_name, cmd_string))
 
         try:
-            result = self._command_cls.run_command(cmd_name, cmd_string)
+            # Long running commands can be run in the background if
+            # the request asks for it.  The response is then a 202 with
+            # a job ID that can be passed to the 'jobstatus' command.
+            if request.get('async') and \
+                    self._command_cls.command_background(cmd_name):
+                result = self._command_cls.run_command_background(cmd_name,
+                        cmd_string)
+            else:
+                result = self._command_cls.run_command(cmd_name, cmd_string)
         except self._command_cls.CommandNotFoundError, e:
             logging.warn(str(e))
             return self.encode_result((404, str(e)))
@@ -102,4 +356,8 @@ class JsonParser(object):
         logging.info("'%s' completed with code '%s', message '%s'" % \
                 (cmd_name, result[0], result[1]))
 
-        return self.encode_result(result)
+        encodings = request.get('accept_encoding', '')
+        if isinstance(encodings, basestring):
+            encodings = encodings.split(',')
+
+        return self.encode_result(result, encodings)
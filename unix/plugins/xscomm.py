@@ -20,6 +20,7 @@
 JSON agent command parser main code module
 """
 
+import errno
 import logging
 import pyxenstore
 
@@ -27,6 +28,15 @@ import pyxenstore
 XENSTORE_REQUEST_PATH = 'data/host'
 XENSTORE_RESPONSE_PATH = 'data/guest'
 
+# Requests beyond this many at once, or larger than this many bytes, are
+# rejected instead of queued
+MAX_QUEUE_DEPTH = 64
+MAX_REQUEST_SIZE = 65536
+
+# Number of times to try writing responses when the transaction conflicts
+# with another XenStore client
+TRANSACTION_RETRIES = 5
+
 
 class XSComm(object):
     """
@@ -39,6 +49,20 @@ class XSComm(object):
                 XENSTORE_REQUEST_PATH)
         self.response_path = kwargs.get("response_path",
                 XENSTORE_RESPONSE_PATH)
+        # Function returning a key for requests that can be answered
+        # together, see JsonParser.coalesce_key()
+        self.coalesce_key = kwargs.get("coalesce_key")
+        # Function called by the first get_request(), which runs in the
+        # daemonized agent
+        self.on_start = kwargs.get("on_start")
+        self.max_queue_depth = kwargs.get("max_queue_depth",
+                MAX_QUEUE_DEPTH)
+        self.max_request_size = kwargs.get("max_request_size",
+                MAX_REQUEST_SIZE)
+        # Number of requests rejected so far
+        self.rejected = 0
+        # Responses waiting to be written together with the next ones
+        self.responses = []
 
         self.xs_handle = pyxenstore.Handle()
         self.xs_handle.mkdir(self.request_path)
@@ -97,8 +121,17 @@ class XSComm(object):
                 raise e
             raise e
 
+        rejected = []
         for entry in entries:
             path = self.request_path + '/' + entry
+
+            # Requests we won't handle are passed on without their data,
+            # with the reason to reject them in 'rejected'
+            if len(self.requests) >= self.max_queue_depth:
+                rejected.append({'path': path,
+                                 'rejected': "Too many pending requests"})
+                continue
+
             try:
                 data = self.xs_handle.read(path)
             except pyxenstore.NotFoundError:
@@ -117,6 +150,11 @@ class XSComm(object):
                     self.xs_handle = None
                 raise e
 
+            if len(data) > self.max_request_size:
+                rejected.append({'path': path,
+                                 'rejected': "Request is too large"})
+                continue
+
             try:
                 self.requests.append({'path': path, 'data': data})
             except Exception, e:
@@ -131,12 +169,19 @@ class XSComm(object):
 
         try:
             self.xs_handle.transaction_end()
-        except:
+        except Exception, e:
             # No matter what exception we get, since we couldn't
             # end the transaction, we're going to need to reopen
             # the handle later
             self.xs_handle = None
             raise e
+
+        if rejected:
+            logging.warn("Rejecting %d requests" % len(rejected))
+            self.rejected += len(rejected)
+            # Answer these first, they're cheap
+            self.requests[0:0] = rejected
+
         return len(self.requests) > 0
 
     def get_request(self):
@@ -145,31 +190,120 @@ class XSComm(object):
         cache, try to populate it first.
         """
 
+        if self.on_start:
+            on_start, self.on_start = self.on_start, None
+            on_start()
+
         if len(self.requests) == 0:
             self._get_requests()
         if len(self.requests) == 0:
             return None
-        return self.requests.pop(0)
+        req = self.requests.pop(0)
+        if self.coalesce_key:
+            req = self._coalesce(req)
+        return req
+
+    def _coalesce(self, req):
+        """
+        Pull any other pending requests that can be answered together
+        with this one out of the cache.  The latest of them is returned
+        and the paths of the others are listed in its 'coalesced' key.
+        """
+
+        key = self.coalesce_key(req)
+        if key is None:
+            return req
+
+        group = [req]
+        remaining = []
+        for other in self.requests:
+            if self.coalesce_key(other) == key:
+                group.append(other)
+            else:
+                remaining.append(other)
+
+        if len(group) == 1:
+            return req
+
+        self.requests = remaining
+
+        req = group.pop()
+        req['coalesced'] = [other['path'] for other in group]
+        logging.info("Coalesced %d requests into '%s'" % (len(group) + 1,
+                req['path']))
+        return req
 
     def put_response(self, req, resp):
         """
         Remove original request from XenStore and write out the response
         """
 
+        self.responses.append((req, resp))
+
+        # Rejected requests are answered right away, so hold on to this
+        # response and write it in the same transaction as theirs
+        if self.requests and 'rejected' in self.requests[0]:
+            return
+
+        responses = self.responses
+        self.responses = []
+        self._write_responses(responses)
+
+    def _write_responses(self, responses):
+        """
+        Remove the requests and write their responses in one transaction,
+        retrying if it conflicts with another XenStore client
+        """
+
         self._check_handle()
 
-        try:
-            self.xs_handle.rm(req['path'])
-        except pyxenstore.PyXenStoreError, e:
-            self.xs_handle = None
-            self._check_handle()
-            # Fall through...
+        for attempt in xrange(TRANSACTION_RETRIES):
+            try:
+                self.xs_handle.transaction_start()
+            except pyxenstore.PyXenStoreError, e:
+                # Need to have the handle reopened later
+                self.xs_handle = None
+                raise e
 
-        basename = req['path'].rsplit('/', 1)[1]
-        resp_path = self.response_path + '/' + basename
+            try:
+                for req, resp in responses:
+                    for path in req.get('coalesced', []) + [req['path']]:
+                        try:
+                            self.xs_handle.rm(path)
+                        except pyxenstore.NotFoundError:
+                            # The host removed it already
+                            pass
 
-        try:
-            self.xs_handle.write(resp_path, resp['data'])
-        except pyxenstore.PyXenStoreError, e:
-            self.xs_handle = None
-            raise e
+                        basename = path.rsplit('/', 1)[1]
+                        resp_path = self.response_path + '/' + basename
+
+                        # Chunks go first, so they are there once the host
+                        # sees the response
+                        for i, chunk in enumerate(resp.get('chunks', [])):
+                            self.xs_handle.write('%s/%d' % (resp_path, i),
+                                    chunk)
+                        self.xs_handle.write(resp_path, resp['data'])
+            except Exception, e:
+                try:
+                    self.xs_handle.transaction_end(True)
+                except Exception:
+                    pass
+                # No matter what exception we get, we're going to need
+                # to reopen the handle later
+                self.xs_handle = None
+                raise e
+
+            try:
+                self.xs_handle.transaction_end()
+                return
+            except pyxenstore.PyXenStoreError, e:
+                if getattr(e, 'errno', None) != errno.EAGAIN:
+                    self.xs_handle = None
+                    raise e
+                logging.info("Conflict writing %d responses, retrying" % (
+                        len(responses)))
+
+        logging.error("Couldn't write %d responses after %d tries" % (
+                len(responses), TRANSACTION_RETRIES))
+        self.xs_handle = None
+        raise e
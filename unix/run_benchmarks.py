@@ -0,0 +1,58 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#  Copyright (c) 2011 Openstack, LLC.
+#  All Rights Reserved.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License"); you may
+#     not use this file except in compliance with the License. You may obtain
+#     a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#     WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#     License for the specific language governing permissions and limitations
+#     under the License.
+#
+
+"""
+Benchmark runner
+"""
+
+import glob
+import logging
+import optparse
+
+import benchmarks.agent_bench
+
+
+logging.basicConfig(level=logging.CRITICAL)
+
+parser = optparse.OptionParser(usage="%prog [options] [benchmark ...]")
+parser.add_option("-s", "--save-baseline", dest="save_baseline",
+        metavar="FILE", help="save results as a baseline to FILE")
+parser.add_option("-c", "--compare", dest="compare", metavar="FILE",
+        help="compare results against the baseline in FILE")
+(options, args) = parser.parse_args()
+
+baseline = None
+if options.compare:
+    baseline = benchmarks.agent_bench.load_baseline(options.compare)
+
+if args:
+    mod_names = ['benchmarks/bench_%s.py' % name for name in args]
+else:
+    mod_names = glob.glob('benchmarks/bench_*.py')
+    mod_names.sort()
+
+all_results = []
+for mod in mod_names:
+    mod_name = "benchmarks." + mod[:-3].split('/', 1)[1]
+    module = __import__(mod_name, globals(), locals(), ['run'])
+    results = module.run(options)
+    benchmarks.agent_bench.report(results, baseline)
+    all_results.extend(results)
+
+if options.save_baseline:
+    benchmarks.agent_bench.save_baseline(options.save_baseline, all_results)
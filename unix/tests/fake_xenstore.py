@@ -0,0 +1,245 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#  Copyright (c) 2011 Openstack, LLC.
+#  All Rights Reserved.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License"); you may
+#     not use this file except in compliance with the License. You may obtain
+#     a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#     WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#     License for the specific language governing permissions and limitations
+#     under the License.
+#
+
+"""
+In-memory stand-in for the pyxenstore module, for use in tests and
+benchmarks that need to run without Xen.
+
+This module can be used anywhere the 'pyxenstore' module is: it provides
+Handle, PyXenStoreError and NotFoundError.  All handles share one
+in-memory store which can be (re)created with reset().  The store can
+inject latency into every operation and make a fraction of transactions
+fail with EAGAIN like a conflicting xenstored transaction would.
+"""
+
+import errno
+import random
+import sys
+import time
+
+
+class PyXenStoreError(Exception):
+
+    def __init__(self, msg, err=None):
+        Exception.__init__(self, msg)
+        self.errno = err
+
+
+class NotFoundError(PyXenStoreError):
+
+    def __init__(self, path):
+        PyXenStoreError.__init__(self, "No such path '%s'" % path,
+                errno.ENOENT)
+
+
+def _split(path):
+    path = path.strip('/')
+    if '/' in path:
+        return path.rsplit('/', 1)
+    return '', path
+
+
+class XenStore(object):
+    """
+    The in-memory store shared by all handles
+    """
+
+    def __init__(self, latency=0, conflict_rate=0, seed=None):
+        self.latency = latency
+        self.conflict_rate = conflict_rate
+        self.random = random.Random(seed)
+
+        self.nodes = {'': ''}
+        self.children = {'': set()}
+        # Bumped on every committed change, used to detect conflicts
+        self.generation = 0
+        self.ops = 0
+        self.conflicts = 0
+
+    def op(self):
+        self.ops += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def read(self, path):
+        path = path.strip('/')
+        try:
+            return self.nodes[path]
+        except KeyError:
+            raise NotFoundError(path)
+
+    def entries(self, path):
+        path = path.strip('/')
+        try:
+            return list(self.children[path])
+        except KeyError:
+            raise NotFoundError(path)
+
+    def write(self, path, value, create_only=False):
+        path = path.strip('/')
+        if path not in self.nodes:
+            parent, name = _split(path)
+            self.write(parent, '', create_only=True)
+            self.children[parent].add(name)
+            self.children[path] = set()
+        elif create_only:
+            return
+        self.nodes[path] = value
+        self.generation += 1
+
+    def rm(self, path):
+        path = path.strip('/')
+        if path not in self.nodes:
+            raise NotFoundError(path)
+        for name in list(self.children[path]):
+            self.rm(path + '/' + name)
+        parent, name = _split(path)
+        self.children[parent].discard(name)
+        del self.nodes[path]
+        del self.children[path]
+        self.generation += 1
+
+
+_store = XenStore()
+
+
+def reset(**kwargs):
+    """Replace the shared store with a new, empty one"""
+
+    global _store
+    _store = XenStore(**kwargs)
+    return _store
+
+
+def get_store():
+    return _store
+
+
+def install():
+    """
+    Make 'import pyxenstore' return this module if the real one isn't
+    available
+    """
+
+    try:
+        import pyxenstore
+    except ImportError:
+        sys.modules['pyxenstore'] = sys.modules[__name__]
+        import pyxenstore
+    return pyxenstore
+
+
+class Handle(object):
+    """
+    Fake of pyxenstore.Handle.  Changes made inside a transaction are
+    only applied to the store by transaction_end()
+    """
+
+    def __init__(self):
+        self.store = _store
+        self._trans = None
+        self._trans_gen = None
+
+    def _lookup(self, path):
+        path = path.strip('/')
+        if self._trans is not None:
+            for op, op_path, value in reversed(self._trans):
+                if op_path == path or path.startswith(op_path + '/'):
+                    if op == 'rm':
+                        raise NotFoundError(path)
+                    if op_path == path:
+                        return value
+        return self.store.read(path)
+
+    def transaction_start(self):
+        self.store.op()
+        if self._trans is not None:
+            raise PyXenStoreError("Transaction already started")
+        self._trans = []
+        self._trans_gen = self.store.generation
+
+    def transaction_end(self, abort=False):
+        self.store.op()
+        if self._trans is None:
+            raise PyXenStoreError("No transaction started")
+
+        ops = self._trans
+        self._trans = None
+
+        if abort:
+            return
+
+        conflict = self.store.generation != self._trans_gen
+        if not conflict and self.store.conflict_rate:
+            conflict = self.store.random.random() < self.store.conflict_rate
+        if conflict:
+            self.store.conflicts += 1
+            raise PyXenStoreError("Transaction conflict", errno.EAGAIN)
+
+        for op, path, value in ops:
+            if op == 'rm':
+                try:
+                    self.store.rm(path)
+                except NotFoundError:
+                    pass
+            elif op == 'mkdir':
+                self.store.write(path, '', create_only=True)
+            else:
+                self.store.write(path, value)
+
+    def read(self, path):
+        self.store.op()
+        return self._lookup(path)
+
+    def entries(self, path):
+        self.store.op()
+        path = path.strip('/')
+        entries = set(self.store.entries(path))
+        if self._trans is not None:
+            for op, op_path, value in self._trans:
+                parent, name = _split(op_path)
+                if parent != path:
+                    continue
+                if op == 'rm':
+                    entries.discard(name)
+                else:
+                    entries.add(name)
+        return list(entries)
+
+    def write(self, path, value):
+        self.store.op()
+        if self._trans is not None:
+            self._trans.append(('write', path.strip('/'), value))
+        else:
+            self.store.write(path, value)
+
+    def mkdir(self, path):
+        self.store.op()
+        if self._trans is not None:
+            self._trans.append(('mkdir', path.strip('/'), ''))
+        else:
+            self.store.write(path, '', create_only=True)
+
+    def rm(self, path):
+        self.store.op()
+        if self._trans is not None:
+            # Make sure it exists, like the real thing
+            self._lookup(path)
+            self._trans.append(('rm', path.strip('/'), None))
+        else:
+            self.store.rm(path)
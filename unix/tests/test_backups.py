@@ -0,0 +1,128 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#  Copyright (c) 2011 Openstack, LLC.
+#  All Rights Reserved.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License"); you may
+#     not use this file except in compliance with the License. You may obtain
+#     a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#     WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#     License for the specific language governing permissions and limitations
+#     under the License.
+#
+
+"""
+Backup retention tester
+"""
+
+import os
+import shutil
+import tempfile
+import time
+
+import agent_test
+from commands import backups
+
+
+class TestBackups(agent_test.TestCase):
+
+    def setUp(self):
+        super(TestBackups, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.filepath = os.path.join(self.tmpdir, 'hosts')
+        open(self.filepath, 'w').close()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _make_backups(self, timestamps, inject=False):
+        for timestamp in timestamps:
+            if inject:
+                name = '%s.bak.%s' % (self.filepath, timestamp)
+            else:
+                name = '%s.%d.bak~' % (self.filepath, timestamp)
+            open(name, 'w').close()
+
+    def _remaining(self):
+        names = os.listdir(self.tmpdir)
+        names.sort()
+        return names
+
+    def test_1_keep(self):
+        """Test only the newest backups are kept"""
+
+        now = int(time.time())
+        self._make_backups(range(now - 10, now))
+
+        removed = backups.prune_backups([self.filepath], keep=3)
+        self.assertEqual(removed, 7)
+        self.assertEqual(self._remaining(), ['hosts'] +
+                ['hosts.%d.bak~' % t for t in range(now - 3, now)])
+
+    def test_2_max_age(self):
+        """Test old backups are removed except for the newest"""
+
+        now = int(time.time())
+        self._make_backups([now - 1000, now - 900, now - 10])
+        self._make_backups(['%d.5' % (now - 5)], inject=True)
+
+        removed = backups.prune_backups([self.filepath], keep=5,
+                max_age=100)
+        self.assertEqual(removed, 2)
+        self.assertEqual(self._remaining(), ['hosts',
+                'hosts.%d.bak~' % (now - 10), 'hosts.bak.%d.5' % (now - 5)])
+
+        removed = backups.prune_backups([self.filepath], keep=5, max_age=1)
+        self.assertEqual(removed, 1)
+        self.assertEqual(self._remaining(), ['hosts',
+                'hosts.bak.%d.5' % (now - 5)])
+
+    def test_3_cleanbackups(self):
+        """Test the cleanbackups command"""
+
+        now = int(time.time())
+        self._make_backups(range(now - 10, now))
+        open(os.path.join(self.tmpdir, 'other.1000000000.bak~'), 'w').close()
+
+        resp = self.commands.run_command('cleanbackups', self.tmpdir)
+        self.assertEqual(resp, (0, 'removed 5 backups'))
+
+        # The only backup of 'other' is kept, however old
+        remaining = self._remaining()
+        self.assertEqual(len(remaining), 2 + backups.BACKUP_KEEP)
+        self.assertTrue('other.1000000000.bak~' in remaining)
+
+    def test_4_admin_backups(self):
+        """Test backups that don't look like the agent's are left alone"""
+
+        names = ['hosts.bak.1', 'hosts.bak.2', 'hosts.1.bak~', 'hosts.bak']
+        for name in names:
+            open(os.path.join(self.tmpdir, name), 'w').close()
+
+        removed = backups.prune_backups([self.filepath], keep=0, max_age=0)
+        self.assertEqual(removed, 0)
+        self.assertEqual(self._remaining(), sorted(['hosts'] + names))
+
+    def test_5_options(self):
+        """Test the retention policy can be changed with options"""
+
+        now = int(time.time())
+        self._make_backups(range(now - 10, now))
+
+        init_args = self.commands.CommandBase._init_args
+        init_args['backup_keep'] = 2
+        try:
+            removed = backups.prune_backups([self.filepath])
+        finally:
+            del init_args['backup_keep']
+
+        self.assertEqual(removed, 8)
+
+
+if __name__ == "__main__":
+    agent_test.main()
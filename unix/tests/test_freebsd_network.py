@@ -24,6 +24,7 @@ import os
 from cStringIO import StringIO
 
 import agent_test
+import commands.network
 from commands.freebsd import network
 
 
@@ -288,5 +289,94 @@ class TestFreeBSDRCConf(agent_test.TestCase):
 
         self.assertEqual(filedata, expecteddata)
 
+    def test_bulk_aliases(self):
+        """Test setting lots of IPs with ifconfig_*_aliases"""
+
+        ip4s = [{"address": "10.127.31.%d" % i,
+                 "netmask": "255.255.255.0"} for i in (38, 39, 40, 41, 50)]
+        ip4s.append({"address": "10.127.31.51",
+                     "netmask": "255.255.255.255"})
+        interfaces = {"xn0":{"ip4s":ip4s,
+                             "ip6s":[{"address":"ffff::2",
+                                      "prefixlen":"96"},
+                                     {"address":"ffff::3",
+                                      "prefixlen":"96"}],
+                             "routes":[],
+                             "mac":"40:40:8f:1e:a0:0a",
+                             "gateway4":"10.127.31.1",
+                             "dns":["10.6.24.4", "10.6.24.5"]}}
+
+        expecteddata = '\n'.join([
+            'sshd_enable="YES"',
+            'dhcpd_enable="NO"',
+            'hostname=myhostname',
+            'ifconfig_xn0="10.127.31.38 netmask 255.255.255.0 up"',
+            'ipv6_ifconfig_xn0="ffff::2/96"',
+            'ifconfig_xn0_aliases="inet 10.127.31.39-41/24 '
+                    'inet 10.127.31.50/24 inet 10.127.31.51/32 '
+                    'inet6 ffff::3/96"',
+            'ipv6_enable="YES"',
+            'ipv6_network_interfaces="xn0"',
+            'defaultrouter="10.127.31.1"',
+            ''])
+
+        threshold = commands.network.BULK_ALIAS_THRESHOLD
+        commands.network.BULK_ALIAS_THRESHOLD = 4
+        try:
+            filedata = network._create_rcconf_file(
+                    StringIO('sshd_enable="YES"\n'), interfaces,
+                    'myhostname')
+        finally:
+            commands.network.BULK_ALIAS_THRESHOLD = threshold
+
+        self.assertEqual(filedata, expecteddata)
+
+
+class TestFreeBSDRestarts(agent_test.TestCase):
+    """Tests for working out what to restart on FreeBSD"""
+
+    rcconf = [
+        'sshd_enable="YES"',
+        'ifconfig_xn0="10.127.31.38 netmask 255.255.255.0 up"',
+        'ifconfig_xn1="192.168.2.30 netmask 255.255.224.0 up"',
+        'route_lan0="-net 10.176.0.0 -netmask 255.248.0.0 192.168.0.1"',
+        'static_routes="lan0"',
+        'defaultrouter="10.127.31.1"',
+    ]
+
+    def _get_restarts(self, new_rcconf):
+        return network._get_restarts(
+                network._get_rcconf_settings(self.rcconf),
+                network._get_rcconf_settings(new_rcconf))
+
+    def test_alias_added(self):
+        """Test only the interface with a new alias is restarted"""
+
+        rcconf = self.rcconf + [
+            'ifconfig_xn1_alias0="192.168.2.31 netmask 255.255.224.0"']
+        self.assertEqual(self._get_restarts(rcconf), (['xn1'], True))
+
+    def test_route_changed(self):
+        """Test a changed route only restarts routing"""
+
+        rcconf = [line.replace('10.176.0.0', '10.184.0.0')
+                  for line in self.rcconf]
+        self.assertEqual(self._get_restarts(rcconf), ([], True))
+
+    def test_unchanged(self):
+        """Test nothing is restarted for unrelated changes"""
+
+        rcconf = ['hostname=myhostname'] + self.rcconf
+        rcconf.reverse()
+        self.assertEqual(self._get_restarts(rcconf), ([], False))
+
+    def test_interface_removed(self):
+        """Test an interface no longer configured is restarted"""
+
+        rcconf = [line for line in self.rcconf
+                  if not line.startswith('ifconfig_xn1')]
+        self.assertEqual(self._get_restarts(rcconf), (['xn1'], True))
+
+
 if __name__ == "__main__":
     agent_test.main()
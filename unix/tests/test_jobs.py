@@ -0,0 +1,123 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#  Copyright (c) 2011 Openstack, LLC.
+#  All Rights Reserved.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License"); you may
+#     not use this file except in compliance with the License. You may obtain
+#     a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#     WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#     License for the specific language governing permissions and limitations
+#     under the License.
+#
+
+"""
+Background job tester
+"""
+
+import os
+import shutil
+import tempfile
+
+import agent_test
+import commands.jobs
+import plugins.jsonparser
+
+
+class TestJobs(agent_test.TestCase):
+
+    def setUp(self):
+        super(TestJobs, self).setUp()
+        self.jobs_inst = self.commands.command_instance("jobstatus")
+        self.jsonparser = plugins.jsonparser.JsonParser(self.commands)
+
+    def test_1_job_result(self):
+        """Test 'jobstatus' returns the result of a finished job"""
+
+        job = self.jobs_inst.start('features', '')
+        job.thread.join()
+
+        resp = self.commands.run_command('jobstatus', job.job_id)
+        self.assertEqual(resp, self.commands.run_command('features', ''))
+
+    def test_2_unknown_job(self):
+        """Test 'jobstatus' with an unknown job ID"""
+
+        resp = self.commands.run_command('jobstatus', 'abcdef')
+        self.assertEqual(resp, (404, "No such job 'abcdef'"))
+
+    def test_3_async_not_background(self):
+        """Test async request for a command that can't run in background"""
+
+        resp = self.jsonparser.parse_request({"data":
+                '{"name": "jobstatus", "value": "abcdef", "async": true}'})
+
+        data = '{"message": "No such job \'abcdef\'", "returncode": "404"}'
+        self.assertEqual(resp, {"data": data})
+
+    def test_4_background_commands(self):
+        """Test which commands can run in the background"""
+
+        self.assertTrue(self.commands.command_background('resetnetwork'))
+        self.assertTrue(self.commands.command_background('agentupdate'))
+        self.assertFalse(self.commands.command_background('password'))
+
+class TestJobState(agent_test.TestCase):
+
+    def setUp(self):
+        super(TestJobState, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.state_file = os.path.join(self.tmpdir, 'state', 'jobs.state')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _restart(self):
+        return commands.jobs.JobCommands(job_state_file=self.state_file)
+
+    def test_1_finished_job(self):
+        """Test a finished job's result survives an agent restart"""
+
+        runner = self._restart()
+        job = runner.start('features', '')
+        job.thread.join()
+
+        resp = self._restart().jobstatus_cmd(job.job_id)
+        self.assertEqual(resp, self.commands.run_command('features', ''))
+
+    def test_2_restarted_by_job(self):
+        """Test a job that was restarting the agent succeeded"""
+
+        runner = self._restart()
+        job = commands.jobs.Job('agentupdate', 'http://a/b.tar,abcdef')
+        job.progress = commands.jobs.RESTARTING
+        runner._jobs[job.job_id] = job
+        runner._save()
+
+        self.assertEqual(self._restart().jobstatus_cmd(job.job_id), (0, ""))
+
+    def test_3_interrupted_job(self):
+        """Test a job cut short by an agent restart failed"""
+
+        runner = self._restart()
+        job = commands.jobs.Job('agentupdate', 'http://a/b.tar,abcdef')
+        job.runner = runner
+        runner._jobs[job.job_id] = job
+
+        commands.jobs._current.job = job
+        try:
+            commands.jobs.set_progress('downloading http://a/b.tar')
+        finally:
+            commands.jobs._current.job = None
+
+        resp = self._restart().jobstatus_cmd(job.job_id)
+        self.assertEqual(resp, (500, "Interrupted by an agent restart"))
+
+
+if __name__ == "__main__":
+    agent_test.main()
@@ -20,16 +20,54 @@
 Misc commands tester
 """
 
+import base64
+import threading
+import time
+import zlib
+
 import agent_test
 import agentlib
 import commands
 import plugins.jsonparser
+from plugins.jsonparser import anyjson
 
 if __name__ == "__main__":
     import logging
     logging.basicConfig(level=logging.CRITICAL)
 
 
+class BigMessageCommands(object):
+    """Command class returning a large message"""
+
+    CommandNotFoundError = commands.CommandNotFoundError
+
+    def command_background(self, cmd_name):
+        return False
+
+    def run_command(self, cmd_name, arg):
+        return (0, ''.join([str(i) for i in xrange(2000)]))
+
+
+class CountingCommands(object):
+    """Command class that counts how often each command is run"""
+
+    CommandNotFoundError = commands.CommandNotFoundError
+
+    def __init__(self, returncode=0):
+        self.runs = 0
+        self.returncode = returncode
+        self.release = threading.Event()
+        self.release.set()
+
+    def command_background(self, cmd_name):
+        return False
+
+    def run_command(self, cmd_name, arg):
+        self.runs += 1
+        self.release.wait()
+        return (self.returncode, "run %d" % self.runs)
+
+
 class TestJsonParser(agent_test.TestCase):
 
     def setUp(self):
@@ -76,5 +114,146 @@ class TestJsonParser(agent_test.TestCase):
 
         self.assertEqual(resp, {"data": data})
 
+    def test_5_duplicate_request_cached(self):
+        """Test jsonparser returns the cached response for a resubmit"""
+
+        cmds = CountingCommands()
+        parser = plugins.jsonparser.JsonParser(cmds)
+
+        req = {"path": "data/host/1234",
+               "data": '{"name": "counting", "value": ""}'}
+
+        resp1 = parser.parse_request(req)
+        resp2 = parser.parse_request(dict(req))
+        self.assertEqual(cmds.runs, 1)
+        self.assertEqual(resp1, resp2)
+
+        # Different data under the same path is a different request
+        parser.parse_request({"path": "data/host/1234",
+                "data": '{"name": "counting", "value": "x"}'})
+        self.assertEqual(cmds.runs, 2)
+
+    def test_6_duplicate_request_in_flight(self):
+        """Test jsonparser attaches a duplicate to the running request"""
+
+        cmds = CountingCommands()
+        cmds.release.clear()
+        parser = plugins.jsonparser.JsonParser(cmds)
+
+        req = {"path": "data/host/5678",
+               "data": '{"name": "counting", "value": ""}'}
+
+        resps = []
+        threads = [threading.Thread(
+                target=lambda: resps.append(parser.parse_request(req)))
+                for i in xrange(2)]
+        for thread in threads:
+            thread.start()
+        cmds.release.set()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(cmds.runs, 1)
+        self.assertEqual(resps[0], resps[1])
+
+    def test_7_result_cache_expires(self):
+        """Test jsonparser result cache size and TTL limits"""
+
+        cmds = CountingCommands()
+        parser = plugins.jsonparser.JsonParser(cmds, result_cache_size=2)
+
+        for i in xrange(3):
+            parser.parse_request({"path": "data/host/%d" % i,
+                    "data": '{"name": "counting", "value": ""}'})
+
+        # The oldest response was evicted
+        parser.parse_request({"path": "data/host/0",
+                "data": '{"name": "counting", "value": ""}'})
+        self.assertEqual(cmds.runs, 4)
+
+        parser = plugins.jsonparser.JsonParser(cmds, result_cache_ttl=0)
+        req = {"path": "data/host/0",
+               "data": '{"name": "counting", "value": ""}'}
+        parser.parse_request(req)
+        parser.parse_request(req)
+        self.assertEqual(cmds.runs, 6)
+
+    def test_8_compressed_response(self):
+        """Test jsonparser compresses large messages when asked"""
+
+        cmds = BigMessageCommands()
+        parser = plugins.jsonparser.JsonParser(cmds)
+        message = cmds.run_command('big', '')[1]
+
+        req = {"data": '{"name": "big", "value": ""}'}
+        resp = anyjson.deserialize(parser.parse_request(req)['data'])
+        self.assertEqual(resp['message'], message)
+        self.assertTrue('encoding' not in resp)
+
+        req = {"data": '{"name": "big", "value": "", ' + \
+                '"accept_encoding": "zlib"}'}
+        resp = parser.parse_request(req)
+        self.assertTrue('chunks' not in resp)
+        resp = anyjson.deserialize(resp['data'])
+        self.assertEqual(resp['encoding'], 'zlib')
+        self.assertEqual(zlib.decompress(base64.b64decode(resp['message'])),
+                message)
+
+    def test_9_chunked_response(self):
+        """Test jsonparser splits large responses into chunks"""
+
+        cmds = BigMessageCommands()
+        parser = plugins.jsonparser.JsonParser(cmds, max_response_size=1000)
+        message = cmds.run_command('big', '')[1]
+
+        req = {"data": '{"name": "big", "value": "", ' + \
+                '"accept_encoding": "chunked"}'}
+        resp = parser.parse_request(req)
+        data = anyjson.deserialize(resp['data'])
+
+        self.assertEqual(data['message'], '')
+        self.assertEqual(data['chunks'], len(resp['chunks']))
+        self.assertTrue(len(resp['chunks']) > 1)
+        self.assertEqual(''.join(resp['chunks']), message)
+
+    def test_10_error_not_cached(self):
+        """Test jsonparser runs a failed request again when resubmitted"""
+
+        cmds = CountingCommands(returncode=500)
+        parser = plugins.jsonparser.JsonParser(cmds)
+
+        req = {"path": "data/host/1234",
+               "data": '{"name": "counting", "value": ""}'}
+
+        parser.parse_request(req)
+        resp = parser.parse_request(dict(req))
+        self.assertEqual(cmds.runs, 2)
+        self.assertEqual(anyjson.deserialize(resp['data'])['message'],
+                'run 2')
+
+    def test_11_duplicate_wait_bounded(self):
+        """Test jsonparser stops waiting for a slow duplicate request"""
+
+        cmds = CountingCommands()
+        cmds.release.clear()
+        parser = plugins.jsonparser.JsonParser(cmds, result_cache_wait=0.1)
+
+        req = {"path": "data/host/5678",
+               "data": '{"name": "counting", "value": ""}'}
+
+        thread = threading.Thread(target=parser.parse_request, args=(req,))
+        thread.start()
+        try:
+            while not cmds.runs:
+                time.sleep(0.01)
+            resp = parser.parse_request(dict(req))
+        finally:
+            cmds.release.set()
+            thread.join()
+
+        self.assertEqual(cmds.runs, 1)
+        self.assertEqual(anyjson.deserialize(resp['data'])['returncode'],
+                '503')
+
 if __name__ == "__main__":
     agent_test.main()
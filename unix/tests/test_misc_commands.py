@@ -30,7 +30,8 @@ class TestMiscCommands(agent_test.TestCase):
         """Test the 'features' command"""
 
         resp = self.commands.run_command('features', 'agent')
-        expected = (0, ','.join(self.commands.command_names()))
+        expected = (0, ','.join(self.commands.command_names() +
+                self.commands.feature_names()))
         self.assertEqual(resp, expected)
 
     def test_version(self):
@@ -0,0 +1,218 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#  Copyright (c) 2011 Openstack, LLC.
+#  All Rights Reserved.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License"); you may
+#     not use this file except in compliance with the License. You may obtain
+#     a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#     WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#     License for the specific language governing permissions and limitations
+#     under the License.
+#
+
+"""
+resetnetwork file update tester
+"""
+
+import hashlib
+import os
+import shutil
+import tempfile
+
+import agent_test
+import commands.network
+
+
+class TestFileState(agent_test.TestCase):
+
+    def setUp(self):
+        super(TestFileState, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.state_file = commands.network.FILE_STATE_FILE
+        commands.network.FILE_STATE_FILE = os.path.join(self.tmpdir,
+                'state', 'files.state')
+
+    def tearDown(self):
+        commands.network.FILE_STATE_FILE = self.state_file
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, filename, data):
+        filepath = os.path.join(self.tmpdir, filename)
+        f = open(filepath, 'w')
+        f.write(data)
+        f.close()
+        return filepath
+
+    def test_unchanged(self):
+        """Test a file we wrote is recognized without reading it"""
+
+        filepath = self._write('a', 'data\n')
+        digest = hashlib.sha1('data\n').hexdigest()
+        commands.network._record_file_state({filepath: digest}, [])
+
+        state = commands.network._load_file_state()
+        self.assertTrue(commands.network._file_unchanged(filepath, digest,
+                state))
+        self.assertFalse(commands.network._file_unchanged(filepath,
+                hashlib.sha1('other\n').hexdigest(), state))
+
+    def test_modified(self):
+        """Test a file changed since we wrote it isn't skipped"""
+
+        filepath = self._write('a', 'data\n')
+        digest = hashlib.sha1('data\n').hexdigest()
+        commands.network._record_file_state({filepath: digest}, [])
+
+        # Replaced by an editor
+        os.unlink(filepath)
+        self._write('a', 'data2\n')
+
+        state = commands.network._load_file_state()
+        self.assertFalse(commands.network._file_unchanged(filepath, digest,
+                state))
+
+    def test_removed(self):
+        """Test removed files are forgotten"""
+
+        filepath = self._write('a', 'data\n')
+        digest = hashlib.sha1('data\n').hexdigest()
+        commands.network._record_file_state({filepath: digest}, [])
+        commands.network._record_file_state({}, [filepath])
+
+        self.assertEqual(commands.network._load_file_state(), {})
+
+    def test_same_contents(self):
+        """Test files are compared block by block"""
+
+        filepath = self._write('a', 'x' * 10 + 'a')
+        same = self._write('b', 'x' * 10 + 'a')
+        other = self._write('c', 'x' * 10 + 'b')
+        shorter = self._write('d', 'x' * 10)
+
+        self.assertTrue(commands.network._same_contents(filepath, same,
+                blocksize=4))
+        self.assertFalse(commands.network._same_contents(filepath, other,
+                blocksize=4))
+        self.assertFalse(commands.network._same_contents(filepath, shorter,
+                blocksize=4))
+
+
+class TestJournal(agent_test.TestCase):
+
+    def setUp(self):
+        super(TestJournal, self).setUp()
+        self.tmpdir = tempfile.mkdtemp()
+        self.journal_file = commands.network.FILE_JOURNAL_FILE
+        commands.network.FILE_JOURNAL_FILE = os.path.join(self.tmpdir,
+                'state', 'files.journal')
+
+    def tearDown(self):
+        commands.network.FILE_JOURNAL_FILE = self.journal_file
+        shutil.rmtree(self.tmpdir)
+
+    def _write(self, filename, data):
+        filepath = os.path.join(self.tmpdir, filename)
+        f = open(filepath, 'w')
+        f.write(data)
+        f.close()
+        return filepath
+
+    def _read(self, filename):
+        return open(os.path.join(self.tmpdir, filename)).read()
+
+    def test_undo_staging(self):
+        """Test files staged before an interruption are removed"""
+
+        filepath = self._write('a', 'old\n')
+        self._write('a.1.tmp~', 'new\n')
+        commands.network._write_journal({'state': 'staging',
+                                         'tmp_suffix': '1.tmp~',
+                                         'update': [filepath],
+                                         'remove': []})
+
+        commands.network.recover_files()
+
+        names = os.listdir(self.tmpdir)
+        names.sort()
+        self.assertEqual(names, ['a', 'state'])
+        self.assertEqual(self._read('a'), 'old\n')
+        self.assertFalse(os.path.exists(commands.network.FILE_JOURNAL_FILE))
+
+    def test_unchanged_not_synced(self):
+        """Test an unchanged streamed file is compared before syncing"""
+
+        filepath = self._write('a', 'same\n')
+        os.chmod(filepath, 0644)
+
+        def stage(data):
+            synced = []
+            real_fsync = os.fsync
+            os.fsync = synced.append
+            try:
+                update_files = {filepath: lambda f: f.write(data)}
+                commands.network.stage_files(update_files)
+            finally:
+                os.fsync = real_fsync
+            return update_files, len(synced)
+
+        update_files, unchanged_syncs = stage('same\n')
+        self.assertEqual(update_files, {})
+        self.assertEqual(os.listdir(self.tmpdir).count('a'), 1)
+
+        update_files, changed_syncs = stage('new\n')
+        self.assertEqual(update_files.keys(), [filepath])
+        self.assertEqual(changed_syncs, unchanged_syncs + 1)
+
+    def test_finish_commit(self):
+        """Test an interrupted commit is finished"""
+
+        # 'a' was moved into place, 'b' was backed up but not replaced,
+        # 'c' wasn't touched yet and 'd' is to be removed
+        a = self._write('a', 'new a\n')
+        self._write('a.2.bak~', 'old a\n')
+        b = os.path.join(self.tmpdir, 'b')
+        self._write('b.2.bak~', 'old b\n')
+        self._write('b.1.tmp~', 'new b\n')
+        c = self._write('c', 'old c\n')
+        self._write('c.1.tmp~', 'new c\n')
+        d = self._write('d', 'old d\n')
+        commands.network._write_journal({'state': 'committing',
+                                         'tmp_suffix': '1.tmp~',
+                                         'bak_suffix': '2.bak~',
+                                         'update': [a, b, c],
+                                         'remove': [d]})
+
+        commands.network.recover_files()
+
+        names = os.listdir(self.tmpdir)
+        names.sort()
+        self.assertEqual(names, ['a', 'a.2.bak~', 'b', 'b.2.bak~', 'c',
+                'c.2.bak~', 'd.2.bak~', 'state'])
+        for name in ('a', 'b', 'c'):
+            self.assertEqual(self._read(name), 'new %s\n' % name)
+            self.assertEqual(self._read(name + '.2.bak~'),
+                    'old %s\n' % name)
+        self.assertFalse(os.path.exists(commands.network.FILE_JOURNAL_FILE))
+
+
+class TestRunCommands(agent_test.TestCase):
+
+    def test_failures_collected(self):
+        """Test every command runs and all the failures are returned"""
+
+        for parallel in (False, True):
+            failed = commands.network.run_commands([['false'], ['true'],
+                    ['/nonexistent'], ['sh', '-c', 'exit 3']],
+                    parallel=parallel)
+            self.assertEqual(failed, [(['false'], 1), (['/nonexistent'], -1),
+                    (['sh', '-c', 'exit 3'], 3)])
+
+
+if __name__ == "__main__":
+    agent_test.main()
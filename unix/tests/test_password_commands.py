@@ -20,13 +20,30 @@
 Misc commands tester
 """
 
+# This is to support older python versions that don't have hashlib
+try:
+    import hashlib
+except ImportError:
+    import md5
+
+    class hashlib(object):
+        """Fake hashlib module as a class"""
+
+        @staticmethod
+        def md5():
+            return md5.new()
+
 import base64
 import binascii
 import os
 import subprocess
+import time
+
+from Crypto.Cipher import AES
 
 import agent_test
 import agentlib
+from commands import password
 
 
 class TestPasswordCommands(agent_test.TestCase):
@@ -101,6 +118,25 @@ class TestPasswordCommands(agent_test.TestCase):
 
         return b64_pass
 
+    def _encrypt_password(self, shared_key, password):
+
+        aes_key, aes_iv = self._compute_aes_key(str(shared_key))
+        pad = 16 - len(password) % 16
+        aes = AES.new(aes_key, AES.MODE_CBC, aes_iv)
+        return base64.b64encode(aes.encrypt(password + chr(pad) * pad))
+
+    def _keyinit(self):
+        """Run 'keyinit', returning the session and shared key"""
+
+        our_private_key = self._make_private_key()
+        our_public_key = self._dh_compute_public_key(our_private_key)
+
+        resp = self.commands.run_command('keyinit', our_public_key)
+        self.assertEqual(resp[0], "D0")
+
+        return resp[1], self._dh_compute_shared_key(long(resp[1]),
+                our_private_key)
+
     def test_1_same_shared_key(self):
         """Test 'password' command computes shared key correctly"""
 
@@ -185,5 +221,111 @@ class TestPasswordCommands(agent_test.TestCase):
 
         self.assertEqual(resp[0], 0)
 
+    def test_6_keypair_pool(self):
+        """Test keypairs from the pool are valid and only used once"""
+
+        def wait_for_refill(pool):
+            for i in xrange(100):
+                if pool.available() == pool.size:
+                    break
+                time.sleep(0.05)
+            self.assertEqual(pool.available(), pool.size)
+
+        pool = password.KeyPairPool(self.pw_inst._make_keypair, 3)
+
+        # Nothing is computed until the pool is started, a keypair is
+        # made right away instead
+        pairs = [pool.get()]
+        time.sleep(0.1)
+        self.assertEqual(pool.available(), 0)
+
+        pool.start()
+        wait_for_refill(pool)
+
+        pairs.extend([pool.get() for i in xrange(4)])
+        self.assertEqual(len(set(pairs)), 5)
+
+        for private_key, public_key in pairs:
+            self.assertEqual(public_key,
+                    self._dh_compute_public_key(private_key))
+
+        wait_for_refill(pool)
+
+    def test_7_password_sessions(self):
+        """Test interleaved key exchanges using their session ids"""
+
+        self.pw_inst._wipe_key()
+
+        session1, shared_key1 = self._keyinit()
+        session2, shared_key2 = self._keyinit()
+
+        resp = self.commands.run_command('password',
+                {'session': session1,
+                 'password': self._encrypt_password(shared_key1, "pw1")})
+        self.assertEqual(resp, (0, ""))
+
+        # The session was used up
+        resp = self.commands.run_command('password',
+                {'session': session1,
+                 'password': self._encrypt_password(shared_key1, "pw1")})
+        self.assertEqual(resp, (500, "Password without key exchange"))
+
+        # Without a session, the latest key exchange is used
+        resp = self.commands.run_command('password',
+                self._encrypt_password(shared_key2, "pw2"))
+        self.assertEqual(resp, (0, ""))
+
+    def test_8_password_bad_padding(self):
+        """Test the 'password' command rejects invalid padding"""
+
+        self.pw_inst._wipe_key()
+
+        session, shared_key = self._keyinit()
+
+        aes_key, aes_iv = self._compute_aes_key(str(shared_key))
+        aes = AES.new(aes_key, AES.MODE_CBC, aes_iv)
+        data = base64.b64encode(aes.encrypt("password" + "\x01" * 7 +
+                "\x08"))
+
+        resp = self.commands.run_command('password',
+                {'session': session, 'password': data})
+        self.assertEqual(resp, (500, "Invalid password data received"))
+
+        # The failed attempt used up the session
+        resp = self.commands.run_command('password',
+                {'session': session,
+                 'password': self._encrypt_password(shared_key, "pw")})
+        self.assertEqual(resp, (500, "Password without key exchange"))
+
+    def test_9_password_session_expires(self):
+        """Test key exchange sessions expire"""
+
+        self.pw_inst._wipe_key()
+        self.pw_inst.key_session_ttl = 0
+
+        session, shared_key = self._keyinit()
+
+        resp = self.commands.run_command('password',
+                {'session': session,
+                 'password': self._encrypt_password(shared_key, "pw")})
+        self.assertEqual(resp, (500, "Password without key exchange"))
+
+    def test_10_expired_sessions_dropped(self):
+        """Test expired sessions are dropped without another command"""
+
+        self.pw_inst._wipe_key()
+        self.pw_inst.key_session_ttl = 0.1
+        self.pw_inst.start_threads()
+
+        self._keyinit()
+        self.assertEqual(len(self.pw_inst._aes_keys), 1)
+
+        for i in xrange(40):
+            if not self.pw_inst._aes_keys:
+                break
+            time.sleep(0.05)
+        self.assertEqual(self.pw_inst._aes_keys, {})
+        self.assertEqual(self.pw_inst._last_session, None)
+
 if __name__ == "__main__":
     agent_test.main()
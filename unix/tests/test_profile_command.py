@@ -0,0 +1,102 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#  Copyright (c) 2011 Openstack, LLC.
+#  All Rights Reserved.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License"); you may
+#     not use this file except in compliance with the License. You may obtain
+#     a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#     WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#     License for the specific language governing permissions and limitations
+#     under the License.
+#
+
+"""
+Profile command tester
+"""
+
+import os
+import shutil
+import tempfile
+
+import agent_test
+
+
+class TestProfileCommand(agent_test.TestCase):
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.command_kwargs = {'profile_dir': self.profile_dir,
+                               'profile_keep': 2}
+        super(TestProfileCommand, self).setUp()
+
+    def tearDown(self):
+        shutil.rmtree(self.profile_dir, ignore_errors=True)
+
+    def test_1_profile_next_run(self):
+        """Test 'profile' writes a dump for the next run only"""
+
+        resp = self.commands.run_command('profile',
+                {'command': 'features'})
+        self.assertEqual(resp[0], 0)
+
+        self.commands.run_command('features', '')
+        self.commands.run_command('features', '')
+
+        resp = self.commands.run_command('profile', '')
+        self.assertEqual(resp[0], 0)
+
+        dumps = resp[1].split(',')
+        self.assertEqual(len(dumps), 1)
+        self.assertTrue(dumps[0].startswith(self.profile_dir))
+        self.assertTrue(dumps[0].endswith('.prof'))
+        self.assertTrue(os.path.exists(dumps[0]))
+
+    def test_2_sampling_profiler(self):
+        """Test 'profile' with the sampling profiler"""
+
+        self.commands.run_command('profile',
+                {'command': 'features', 'profiler': 'sample'})
+
+        resp = self.commands.run_command('features', '')
+        self.assertEqual(resp[0], 0)
+
+        dumps = os.listdir(self.profile_dir)
+        self.assertEqual(len(dumps), 1)
+        self.assertTrue(dumps[0].endswith('.stacks'))
+
+    def test_3_rotation(self):
+        """Test 'profile' only keeps the newest dumps"""
+
+        self.commands.run_command('profile',
+                {'command': 'features', 'count': 5})
+
+        for i in xrange(5):
+            self.commands.run_command('features', '')
+
+        self.assertEqual(len(os.listdir(self.profile_dir)), 2)
+
+    def test_4_unknown_command(self):
+        """Test 'profile' with an unknown command"""
+
+        resp = self.commands.run_command('profile',
+                {'command': '<unknown_command>'})
+        self.assertEqual(resp[0], 404)
+
+    def test_5_invalid_count(self):
+        """Test 'profile' with a null or non-numeric count"""
+
+        for args in ({'command': 'features', 'count': None},
+                     {'command': 'features', 'seconds': None},
+                     {'command': 'features', 'count': 'abc'}):
+            resp = self.commands.run_command('profile', args)
+            self.assertEqual(resp, (500,
+                    "Invalid 'count' or 'seconds' argument"))
+
+if __name__ == "__main__":
+    agent_test.main()
@@ -84,6 +84,28 @@ class TestEtcHostUpdates(agent_test.TestCase):
             '# 192.0.2.1\toldname # comment\t# Removed by nova-agent\n' +
             '192.0.2.1\texample\t# comment\n')
 
+    def test_rest_copied(self):
+        """Test lines after the patched entry are copied unchanged"""
+        infile = StringIO('192.0.2.1\toldname\n'
+                          '  192.0.2.2\tother  \n'
+                          '192.0.2.1\tagain')
+        data = commands.network._get_etc_hosts(infile, self._interfaces,
+            self._hostname)
+        self.assertEqual(data,
+            '# 192.0.2.1\toldname\t# Removed by nova-agent\n' +
+            '192.0.2.1\texample\n' +
+            '  192.0.2.2\tother  \n' +
+            '192.0.2.1\tagain')
+
+    def test_add_no_newline(self):
+        """Test adding an entry to /etc/hosts without a final newline"""
+        infile = StringIO('192.0.2.2\tother')
+        data = commands.network._get_etc_hosts(infile, self._interfaces,
+            self._hostname)
+        self.assertEqual(data,
+            '192.0.2.2\tother\n' +
+            '192.0.2.1\texample\n')
+
 
 if __name__ == "__main__":
     agent_test.main()
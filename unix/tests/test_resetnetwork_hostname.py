@@ -29,6 +29,7 @@ import commands.debian.network
 import commands.arch.network
 import commands.gentoo.network
 import commands.suse.network
+import commands.networkd.network
 
 
 class TestHostNameUpdates(agent_test.TestCase):
@@ -97,6 +98,11 @@ class TestHostNameUpdates(agent_test.TestCase):
         data = self._run_test('suse', 'example')
         self.assertEqual(data, 'example\n')
 
+    def test_networkd(self):
+        """Test updating hostname in /etc/hostname for systemd-networkd"""
+        data = self._run_test('networkd', 'example')
+        self.assertEqual(data, 'example\n')
+
 
 if __name__ == "__main__":
     agent_test.main()
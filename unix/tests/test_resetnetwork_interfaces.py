@@ -21,14 +21,19 @@ resetnetwork interfaces tester
 """
 
 import os
+import shutil
+import tempfile
 from cStringIO import StringIO
 
 import agent_test
+import commands.network
 import commands.redhat.network
+import commands.redhat.nm
 import commands.debian.network
 import commands.arch.network
 import commands.gentoo.network
 import commands.suse.network
+import commands.networkd.network
 
 
 class TestInterfacesUpdates(agent_test.TestCase):
@@ -117,6 +122,76 @@ class TestInterfacesUpdates(agent_test.TestCase):
             'ONBOOT=yes',
             'NM_CONTROLLED=no']) + '\n')
 
+    def test_redhat_nm_ipv4(self):
+        """Test setting public IPv4 for Red Hat NetworkManager"""
+        interface = {
+            'mac': '00:11:22:33:44:55',
+            'ip4s': [{'address': '192.0.2.42', 'netmask': '255.255.255.0'},
+                     {'address': '192.0.2.43', 'netmask': '255.255.255.0'}],
+            'ip6s': [],
+            'gateway4': '192.0.2.1',
+            'gateway6': None,
+            'dns': ['192.0.2.2', '192.0.2.3'],
+            'routes': [{'network': '10.176.0.0', 'netmask': '255.248.0.0',
+                        'gateway': '192.0.2.1'}],
+        }
+        outfiles = commands.redhat.nm.get_interface_files({'eth0': interface})
+        self.assertEqual(outfiles.keys(), ['nova-agent-eth0.nmconnection'])
+        self.assertEqual(outfiles['nova-agent-eth0.nmconnection'], '\n'.join([
+            '# Automatically generated, do not edit',
+            '[connection]',
+            'id=nova-agent eth0',
+            'uuid=%s' % commands.redhat.nm.get_connection_uuid(interface),
+            'type=ethernet',
+            'interface-name=eth0',
+            'autoconnect-priority=100',
+            '',
+            '[ethernet]',
+            'mac-address=00:11:22:33:44:55',
+            '',
+            '[ipv4]',
+            'method=manual',
+            'address1=192.0.2.42/24,192.0.2.1',
+            'address2=192.0.2.43/24',
+            'dns=192.0.2.2;192.0.2.3;',
+            'route1=10.176.0.0/13,192.0.2.1',
+            '',
+            '[ipv6]',
+            'method=ignore']) + '\n')
+
+    def test_redhat_nm_ipv6(self):
+        """Test setting public IPv6 for Red Hat NetworkManager"""
+        interface = {
+            'mac': '00:11:22:33:44:55',
+            'ip4s': [],
+            'ip6s': [{'address': '2001:db8::42', 'prefixlen': '96'}],
+            'gateway4': None,
+            'gateway6': '2001:db8::1',
+            'dns': ['2001:db8::2'],
+            'routes': [],
+        }
+        outfiles = commands.redhat.nm.get_interface_files({'eth0': interface})
+        data = outfiles['nova-agent-eth0.nmconnection']
+        self.assertTrue(data.endswith('\n'.join([
+            '[ipv4]',
+            'method=disabled',
+            '',
+            '[ipv6]',
+            'method=manual',
+            'address1=2001:db8::42/96,2001:db8::1',
+            'dns=2001:db8::2;']) + '\n'))
+
+    def test_redhat_nm_uuid(self):
+        """Test NetworkManager connections keep the same UUID"""
+        interface = {'mac': '00:11:22:33:44:55'}
+        uuid = commands.redhat.nm.get_connection_uuid(interface)
+        self.assertEqual(commands.redhat.nm.get_connection_uuid(
+                {'mac': '00:11:22:33:44:55'}), uuid)
+        self.assertNotEqual(commands.redhat.nm.get_connection_uuid(
+                {'mac': '00:11:22:33:44:56'}), uuid)
+        self.assertEqual(commands.redhat.nm._get_connection_ifname(
+                'nova-agent-eth0.nmconnection'), 'eth0')
+
     def test_debian_ipv4(self):
         """Test setting public IPv4 for Debian networking"""
         interface = {
@@ -347,6 +422,36 @@ class TestInterfacesUpdates(agent_test.TestCase):
             'config_eth0="2001:db8::42/96"',
             'routes_eth0="default via 2001:db8::1"']) + '\n')
 
+    def test_gentoo_restarts(self):
+        """Test only changed interfaces are restarted for Gentoo"""
+        net = '\n'.join([
+            '# Automatically generated, do not edit',
+            'modules="ifconfig"',
+            '',
+            'config_eth0="192.0.2.42 netmask 255.255.255.0',
+            '192.0.2.43 netmask 255.255.255.0"',
+            'routes_eth0="default via 192.0.2.1"',
+            'config_eth1="10.0.0.2 netmask 255.255.255.0"'])
+        old_settings = commands.gentoo.network._get_net_settings(
+                StringIO(net))
+        ifaces = set(['eth0', 'eth1'])
+
+        def get_restarts(new_net):
+            new_settings = commands.gentoo.network._get_net_settings(
+                    new_net.split('\n'))
+            return commands.gentoo.network._get_restarts(old_settings,
+                    new_settings, ifaces)
+
+        self.assertEqual(get_restarts(net), set())
+        self.assertEqual(get_restarts(net.replace('192.0.2.43', '192.0.2.44')),
+                set(['eth0']))
+        self.assertEqual(get_restarts(net + '\nroutes_eth1="default via '
+                '10.0.0.1"'), set(['eth1']))
+        self.assertEqual(get_restarts(net.replace('"ifconfig"',
+                '"iproute2"')), ifaces)
+        self.assertEqual(commands.gentoo.network._get_restarts(None,
+                old_settings, ifaces), ifaces)
+
     def test_suse_ipv4(self):
         """Test setting public IPv4 for SuSE networking"""
         interface = {
@@ -383,6 +488,212 @@ class TestInterfacesUpdates(agent_test.TestCase):
             "STARTMODE='auto'",
             "USERCONTROL='no'"]) + '\n')
 
+    def test_networkd_ipv4(self):
+        """Test setting public IPv4 for systemd-networkd"""
+        interface = {
+            'hwaddr': '00:11:22:33:44:55',
+            'ipv4': [('192.0.2.42', '255.255.255.0'),
+                     ('192.0.2.43', '255.255.255.0')],
+            'gateway4': '192.0.2.1',
+            'dns': ['192.0.2.2'],
+        }
+        outfiles = self._run_test('networkd', eth0=interface)
+        self.assertEqual(outfiles.keys(), ['00-nova-agent-eth0.network'])
+        self.assertEqual(outfiles['00-nova-agent-eth0.network'], '\n'.join([
+            '# Automatically generated, do not edit',
+            '[Match]',
+            'MACAddress=00:11:22:33:44:55',
+            '',
+            '[Network]',
+            'Description=eth0',
+            'DHCP=no',
+            'Address=192.0.2.42/24',
+            'Address=192.0.2.43/24',
+            'Gateway=192.0.2.1',
+            'DNS=192.0.2.2']) + '\n')
+
+    def test_networkd_ipv6(self):
+        """Test setting public IPv6 for systemd-networkd"""
+        interface = {
+            'hwaddr': '00:11:22:33:44:55',
+            'ipv6': [('2001:db8::42', 96)],
+            'gateway6': '2001:db8::1',
+            'dns': ['2001:db8::2'],
+        }
+        outfiles = self._run_test('networkd', eth0=interface)
+        self.assertEqual(outfiles['00-nova-agent-eth0.network'], '\n'.join([
+            '# Automatically generated, do not edit',
+            '[Match]',
+            'MACAddress=00:11:22:33:44:55',
+            '',
+            '[Network]',
+            'Description=eth0',
+            'DHCP=no',
+            'IPv6AcceptRA=no',
+            'Address=2001:db8::42/96',
+            'Gateway=2001:db8::1',
+            'DNS=2001:db8::2']) + '\n')
+
+    def test_networkd_routes(self):
+        """Test setting routes for systemd-networkd"""
+        interface = {
+            'mac': '00:11:22:33:44:55',
+            'ip4s': [{'address': '10.0.0.2', 'netmask': '255.255.255.0'}],
+            'ip6s': [],
+            'gateway4': None,
+            'gateway6': None,
+            'routes': [{'network': '10.176.0.0', 'netmask': '255.248.0.0',
+                        'gateway': '10.0.0.1'}],
+        }
+        outfiles = commands.networkd.network.get_interface_files(
+                {'eth1': interface})
+        self.assertEqual(outfiles['00-nova-agent-eth1.network'], '\n'.join([
+            '# Automatically generated, do not edit',
+            '[Match]',
+            'MACAddress=00:11:22:33:44:55',
+            '',
+            '[Network]',
+            'Description=eth1',
+            'DHCP=no',
+            'Address=10.0.0.2/24',
+            '',
+            '[Route]',
+            'Destination=10.176.0.0/13',
+            'Gateway=10.0.0.1']) + '\n')
+        self.assertEqual(commands.networkd.network._get_unit_ifname(
+                '00-nova-agent-eth1.network'), 'eth1')
+
+    def _run_bulk_test(self, dist):
+        interface = {
+            'hwaddr': '00:11:22:33:44:55',
+            'ipv4': [('192.0.2.42', '255.255.255.0'),
+                     ('192.0.2.43', '255.255.255.0'),
+                     ('192.0.2.44', '255.255.255.0')],
+            'gateway4': '192.0.2.1',
+            'ipv6': [('2001:db8::42', 96),
+                     ('2001:db8::43', 96)],
+            'gateway6': '2001:db8::1',
+            'dns': ['192.0.2.2'],
+        }
+
+        threshold = commands.network.BULK_ALIAS_THRESHOLD
+        commands.network.BULK_ALIAS_THRESHOLD = 2
+        try:
+            return self._run_test(dist, eth0=interface)
+        finally:
+            commands.network.BULK_ALIAS_THRESHOLD = threshold
+
+    def test_redhat_bulk_aliases(self):
+        """Test setting lots of IPs in one file for Red Hat networking"""
+        outfiles = self._run_bulk_test('redhat')
+        self.assertEqual(outfiles.keys(), ['ifcfg-eth0'])
+        self.assertEqual(outfiles['ifcfg-eth0'], '\n'.join([
+            '# Automatically generated, do not edit',
+            'DEVICE=eth0',
+            'BOOTPROTO=static',
+            'HWADDR=00:11:22:33:44:55',
+            'IPADDR=192.0.2.42',
+            'NETMASK=255.255.255.0',
+            'IPADDR1=192.0.2.43',
+            'PREFIX1=24',
+            'IPADDR2=192.0.2.44',
+            'PREFIX2=24',
+            'DEFROUTE=yes',
+            'GATEWAY=192.0.2.1',
+            'IPV6INIT=yes',
+            'IPV6_AUTOCONF=no',
+            'IPV6ADDR=2001:db8::42/96',
+            'IPV6ADDR_SECONDARIES="2001:db8::43/96"',
+            'IPV6_DEFAULTGW=2001:db8::1%eth0',
+            'DNS1=192.0.2.2',
+            'ONBOOT=yes',
+            'NM_CONTROLLED=no']) + '\n')
+
+    def test_debian_bulk_aliases(self):
+        """Test setting lots of IPs with up commands for Debian networking"""
+        outfiles = self._run_bulk_test('debian')
+        self.assertEqual(outfiles['interfaces'], '\n'.join([
+            '# Used by ifup(8) and ifdown(8). See the interfaces(5) '
+                'manpage or',
+            '# /usr/share/doc/ifupdown/examples for more information.',
+            '# The loopback network interface',
+            'auto lo',
+            'iface lo inet loopback',
+            '',
+            'auto eth0',
+            'iface eth0 inet static',
+            '    address 192.0.2.42',
+            '    netmask 255.255.255.0',
+            '    gateway 192.0.2.1',
+            '    up ip addr add 192.0.2.43/24 dev eth0',
+            '    down ip addr del 192.0.2.43/24 dev eth0',
+            '    up ip addr add 192.0.2.44/24 dev eth0',
+            '    down ip addr del 192.0.2.44/24 dev eth0',
+            'iface eth0 inet6 static',
+            '    address 2001:db8::42',
+            '    netmask 96',
+            '    gateway 2001:db8::1',
+            '    up ip -6 addr add 2001:db8::43/96 dev eth0',
+            '    down ip -6 addr del 2001:db8::43/96 dev eth0',
+            '    dns-nameservers 192.0.2.2']) + '\n')
+
+    def test_debian_batch_routes(self):
+        """Test installing lots of routes with ip -batch for Debian"""
+        interface = {
+            'mac': '00:11:22:33:44:55',
+            'ip4s': [{'address': '192.0.2.42', 'netmask': '255.255.255.0'}],
+            'ip6s': [],
+            'gateway4': None,
+            'gateway6': None,
+            'dns': [],
+            'routes': [{'network': '198.51.100.0',
+                        'netmask': '255.255.255.0',
+                        'gateway': '192.0.2.1'},
+                       {'network': '203.0.113.0',
+                        'netmask': '255.255.255.128',
+                        'gateway': '192.0.2.1'}],
+        }
+
+        threshold = commands.network.BATCH_ROUTE_THRESHOLD
+        commands.network.BATCH_ROUTE_THRESHOLD = 1
+        try:
+            outfiles = commands.debian.network.get_interface_files(
+                    {'eth0': interface})
+        finally:
+            commands.network.BATCH_ROUTE_THRESHOLD = threshold
+
+        self.assertTrue(outfiles['interfaces'].endswith('\n'.join([
+            'auto eth0',
+            'iface eth0 inet static',
+            '    address 192.0.2.42',
+            '    netmask 255.255.255.0',
+            'up ip -batch /etc/network/routes-eth0']) + '\n'))
+        self.assertEqual(outfiles['routes-eth0'], '\n'.join([
+            'route replace 198.51.100.0/24 via 192.0.2.1 dev eth0',
+            'route replace 203.0.113.0/25 via 192.0.2.1 dev eth0']) + '\n')
+
+    def test_debian_stale_routes(self):
+        """Test only unused route batch files are removed, not backups"""
+        tmpdir = tempfile.mkdtemp()
+        routes_file = commands.debian.network.ROUTES_FILE
+        commands.debian.network.ROUTES_FILE = os.path.join(tmpdir,
+                'routes-%s')
+        try:
+            for name in ('routes-eth0', 'routes-eth1', 'routes-eth0.100',
+                         'routes-eth1.1300000000.bak~', 'routes-eth1~',
+                         'routes-eth1.bak.1300000000'):
+                open(os.path.join(tmpdir, name), 'w').close()
+
+            update_files = {os.path.join(tmpdir, 'routes-eth0'): ''}
+            self.assertEqual(
+                    commands.debian.network._get_stale_route_files(
+                        update_files),
+                    set([os.path.join(tmpdir, 'routes-eth1'),
+                         os.path.join(tmpdir, 'routes-eth0.100')]))
+        finally:
+            commands.debian.network.ROUTES_FILE = routes_file
+            shutil.rmtree(tmpdir)
+
 
 if __name__ == "__main__":
     agent_test.main()
@@ -0,0 +1,115 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#  Copyright (c) 2011 Openstack, LLC.
+#  All Rights Reserved.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License"); you may
+#     not use this file except in compliance with the License. You may obtain
+#     a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#     WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#     License for the specific language governing permissions and limitations
+#     under the License.
+#
+
+"""
+Worker process tester
+"""
+
+import os
+import threading
+import time
+
+import agent_test
+import commands
+from commands import jobs
+from commands import worker
+
+
+def _test_cmd(arg):
+    jobs.set_progress('started %s' % arg)
+    time.sleep(float(arg))
+    return (0, os.getpid())
+
+
+class TestWorker(agent_test.TestCase):
+
+    def setUp(self):
+        super(TestWorker, self).setUp()
+
+        # Commands have to be known before the fork server starts
+        commands.CommandBase._cmds['_test_cmd'] = (_test_cmd, None)
+
+        self.worker = worker.Worker()
+        self.worker.start()
+
+    def tearDown(self):
+        self.worker.stop()
+        del commands.CommandBase._cmds['_test_cmd']
+
+    def test_1_run_command(self):
+        """Test running a command in the worker process"""
+
+        resp = self.worker.run('version', '')
+        self.assertEqual(resp, self.commands.run_command('version', ''))
+
+        self.assertNotEqual(self.worker.pid, None)
+        self.assertNotEqual(self.worker.pid, os.getpid())
+
+    def test_2_process_per_command(self):
+        """Test each command runs in a new process"""
+
+        code, pid1 = self.worker.run('_test_cmd', '0')
+        code, pid2 = self.worker.run('_test_cmd', '0')
+        self.assertNotEqual(pid1, pid2)
+        self.assertFalse(os.getpid() in (pid1, pid2))
+
+    def test_3_exception(self):
+        """Test exceptions in the worker are raised in the agent"""
+
+        self.assertRaises(commands.CommandNotFoundError, self.worker.run,
+                '<unknown_command>', '')
+
+        # The worker is still usable
+        resp = self.worker.run('version', '')
+        self.assertEqual(resp[0], 0)
+
+    def test_4_progress(self):
+        """Test progress messages reach the job running the command"""
+
+        job = jobs.Job('_test_cmd', '0')
+        jobs._current.job = job
+        try:
+            self.worker.run('_test_cmd', '0')
+        finally:
+            jobs._current.job = None
+
+        self.assertEqual(job.progress, 'started 0')
+
+    def test_5_concurrent(self):
+        """Test a command doesn't wait for one that's already running"""
+
+        thread = threading.Thread(target=self.worker.run,
+                args=('_test_cmd', '1'))
+        thread.start()
+        time.sleep(0.1)
+
+        start = time.time()
+        self.worker.run('_test_cmd', '0')
+        self.assertTrue(time.time() - start < 0.5)
+
+        thread.join()
+
+    def test_6_no_server(self):
+        """Test commands still run if the fork server has gone away"""
+
+        self.worker.stop()
+        code, pid = self.worker.run('_test_cmd', '0')
+        self.assertEqual(pid, os.getpid())
+
+if __name__ == "__main__":
+    agent_test.main()
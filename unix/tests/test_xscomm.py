@@ -0,0 +1,229 @@
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+#
+#  Copyright (c) 2011 Openstack, LLC.
+#  All Rights Reserved.
+#
+#     Licensed under the Apache License, Version 2.0 (the "License"); you may
+#     not use this file except in compliance with the License. You may obtain
+#     a copy of the License at
+#
+#          http://www.apache.org/licenses/LICENSE-2.0
+#
+#     Unless required by applicable law or agreed to in writing, software
+#     distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#     WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#     License for the specific language governing permissions and limitations
+#     under the License.
+#
+
+"""
+XenStore exchange plugin tester
+"""
+
+import stubout
+
+import agent_test
+import fake_xenstore
+import plugins.jsonparser
+import plugins.xscomm
+from plugins.jsonparser import anyjson
+
+
+class TestXSComm(agent_test.TestCase):
+
+    def setUp(self):
+        super(TestXSComm, self).setUp()
+        self.stubs = stubout.StubOutForTesting()
+        self.stubs.Set(plugins.xscomm, 'pyxenstore', fake_xenstore)
+
+        self.store = fake_xenstore.reset()
+        self.host = fake_xenstore.Handle()
+        self.xs = plugins.xscomm.XSComm()
+        self.parser = plugins.jsonparser.JsonParser(self.commands)
+
+    def tearDown(self):
+        super(TestXSComm, self).tearDown()
+        self.stubs.UnsetAll()
+
+    def _run_once(self):
+        req = self.xs.get_request()
+        if req is None:
+            return None
+        resp = self.parser.parse_request(req)
+        self.xs.put_response(req, resp)
+        return req
+
+    def test_1_no_requests(self):
+        """Test XSComm with no pending requests"""
+
+        self.assertEqual(self.xs.get_request(), None)
+
+    def test_2_request_response(self):
+        """Test XSComm request through to response"""
+
+        self.host.write('data/host/1234',
+                '{"name": "<unknown_command>", "value": ""}')
+
+        req = self._run_once()
+        self.assertEqual(req['path'], 'data/host/1234')
+
+        self.assertEqual(self.host.entries('data/host'), [])
+
+        data = '{"message": "No such agent command ' + \
+                '\'<unknown_command>\'", "returncode": "404"}'
+        self.assertEqual(self.host.read('data/guest/1234'), data)
+
+    def test_3_multiple_requests(self):
+        """Test XSComm handles every queued request"""
+
+        for i in xrange(10):
+            self.host.write('data/host/%d' % i, '{"name": "features"}')
+
+        handled = 0
+        while self._run_once():
+            handled += 1
+
+        self.assertEqual(handled, 10)
+        self.assertEqual(len(self.host.entries('data/guest')), 10)
+
+    def test_4_transaction_conflict(self):
+        """Test XSComm recovers after a transaction conflict"""
+
+        self.store.conflict_rate = 1.0
+        self.host.write('data/host/1234', '{"name": "features"}')
+
+        self.assertRaises(fake_xenstore.PyXenStoreError,
+                self.xs.get_request)
+
+        self.store.conflict_rate = 0
+        self.assertNotEqual(self._run_once(), None)
+        self.assertEqual(self.host.entries('data/guest'), ['1234'])
+
+    def test_5_coalesce_requests(self):
+        """Test XSComm answers coalescible requests with one run"""
+
+        self.xs = plugins.xscomm.XSComm(
+                coalesce_key=self.parser.coalesce_key)
+
+        self.stubs.Set(self.commands.CommandBase, 'command_coalesce',
+                classmethod(lambda cls, cmd_name: cmd_name == 'features'))
+
+        for i in xrange(5):
+            self.host.write('data/host/%d' % i, '{"name": "features"}')
+        self.host.write('data/host/5', '{"name": "version", "value": ""}')
+
+        handled = 0
+        while self._run_once():
+            handled += 1
+
+        # One run of 'features' and one of 'version'
+        self.assertEqual(handled, 2)
+        self.assertEqual(self.host.entries('data/host'), [])
+
+        guest = sorted(self.host.entries('data/guest'))
+        self.assertEqual(guest, [str(i) for i in xrange(6)])
+        responses = set([self.host.read('data/guest/%d' % i)
+                         for i in xrange(5)])
+        self.assertEqual(len(responses), 1)
+
+    def test_6_chunked_response(self):
+        """Test XSComm writes response chunks under the response path"""
+
+        self.host.write('data/host/1234', '{"name": "features"}')
+
+        req = self.xs.get_request()
+        self.xs.put_response(req, {'data': '{"chunks": 2}',
+                                   'chunks': ['abc', 'def']})
+
+        self.assertEqual(self.host.read('data/guest/1234'), '{"chunks": 2}')
+        self.assertEqual(self.host.read('data/guest/1234/0'), 'abc')
+        self.assertEqual(self.host.read('data/guest/1234/1'), 'def')
+
+    def test_7_queue_depth(self):
+        """Test XSComm rejects requests beyond the queue depth"""
+
+        self.xs = plugins.xscomm.XSComm(max_queue_depth=3)
+
+        for i in xrange(5):
+            self.host.write('data/host/%d' % i, '{"name": "features"}')
+
+        codes = []
+        while self._run_once():
+            pass
+        for entry in self.host.entries('data/guest'):
+            resp = self.host.read('data/guest/%s' % entry)
+            codes.append(anyjson.deserialize(resp)['returncode'])
+
+        codes.sort()
+        self.assertEqual(codes, ['0', '0', '0', '503', '503'])
+        self.assertEqual(self.xs.rejected, 2)
+        self.assertEqual(self.host.entries('data/host'), [])
+
+    def test_8_request_size(self):
+        """Test XSComm rejects requests that are too large"""
+
+        self.xs = plugins.xscomm.XSComm(max_request_size=100)
+
+        self.host.write('data/host/1234',
+                '{"name": "features", "value": "%s"}' % ('x' * 100))
+
+        self._run_once()
+
+        resp = anyjson.deserialize(self.host.read('data/guest/1234'))
+        self.assertEqual(resp['returncode'], '503')
+        self.assertEqual(self.xs.rejected, 1)
+
+    def test_9_response_conflicts(self):
+        """Test XSComm retries writing responses after conflicts"""
+
+        self.store = fake_xenstore.reset(conflict_rate=0.3, seed=1)
+        self.host = fake_xenstore.Handle()
+        self.xs = plugins.xscomm.XSComm()
+
+        for i in xrange(10):
+            self.host.write('data/host/%d' % i, '{"name": "features"}')
+
+        handled = 0
+        while handled < 10:
+            try:
+                req = self.xs.get_request()
+            except fake_xenstore.PyXenStoreError:
+                continue
+            self.xs.put_response(req, self.parser.parse_request(req))
+            handled += 1
+
+        self.assertTrue(self.store.conflicts > 0)
+        self.assertEqual(self.host.entries('data/host'), [])
+        self.assertEqual(len(self.host.entries('data/guest')), 10)
+
+    def test_10_rejected_responses_grouped(self):
+        """Test XSComm writes responses to rejected requests together"""
+
+        self.xs = plugins.xscomm.XSComm(max_queue_depth=1)
+
+        for i in xrange(3):
+            self.host.write('data/host/%d' % i, '{"name": "features"}')
+
+        self._run_once()
+        self.assertRaises(fake_xenstore.NotFoundError, self.host.entries,
+                'data/guest')
+
+        self._run_once()
+        self.assertEqual(len(self.host.entries('data/guest')), 2)
+
+        self._run_once()
+        self.assertEqual(len(self.host.entries('data/guest')), 3)
+
+    def test_11_on_start(self):
+        """Test XSComm calls on_start once, when it starts polling"""
+
+        calls = []
+        self.xs = plugins.xscomm.XSComm(on_start=lambda: calls.append(1))
+        self.assertEqual(calls, [])
+
+        self.xs.get_request()
+        self.xs.get_request()
+        self.assertEqual(calls, [1])
+
+if __name__ == "__main__":
+    agent_test.main()